@@ -0,0 +1,360 @@
+import json
+import logging
+import os
+import time
+import types
+from typing import Dict, Iterator, Optional
+
+from checkpoint import atomic_write_json, read_json, repair_tail
+from cost_ledger import BATCH_DISCOUNT
+from response_cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+SHARD_PATTERN = "requests_{:05d}.jsonl"
+RESULT_PATTERN = "predictions_{:05d}.jsonl"
+BILLED_PATTERN = "billed_{:05d}.txt"
+
+
+def expand_grid(generator, samples: int = 1) -> Iterator[Dict]:
+    # Sorted so the same grid produces the same shards no matter how the list was shuffled
+    starters = getattr(generator, "story_starters", None) or [None]
+    items = sorted({generator.build_request(index)[:2] for index in range(generator.cycle_length)})
+    for sample_index in range(samples):
+        for category, aspect in items:
+            for starter in starters:
+                if starter is None:
+                    prompt = generator.create_prompt(category, aspect)
+                else:
+                    prompt = generator.create_prompt(category, aspect, starter)
+                # Same key as the response cache, so a request id also names its cache entry
+                request_id = ResponseCache.make_key(generator.MODEL_ID, prompt, generator.generation_config,
+                                                    sample_index)
+                yield {
+                    "request_id": request_id,
+                    "category": category,
+                    "aspect": aspect,
+                    "starter": starter,
+                    "sample_index": sample_index,
+                    "prompt": prompt,
+                }
+
+
+def batch_request_line(request: Dict, generation_config: Dict) -> Dict:
+    # "request" is a GenerateContentRequest as batch prediction expects it; the rest stays local
+    metadata = {key: value for key, value in request.items() if key != "prompt"}
+    return {
+        "request": {
+            "contents": [{'role': 'user', 'parts': [{'text': request["prompt"]}]}],
+            "generationConfig": generation_config,
+            "labels": {"request_id": request["request_id"][:40]},
+        },
+        "metadata": metadata,
+    }
+
+
+def response_to_json(response) -> Dict:
+    candidates = []
+    for candidate in response.candidates:
+        try:
+            candidates.append({"content": {"role": "model", "parts": [{"text": candidate.text}]}})
+        except ValueError:
+            candidates.append({"finishReason": "SAFETY"})
+    result = {"candidates": candidates}
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        result["usageMetadata"] = {
+            "promptTokenCount": usage.prompt_token_count,
+            "candidatesTokenCount": usage.candidates_token_count,
+        }
+    return result
+
+
+def response_text(response: Dict) -> Optional[str]:
+    for candidate in response.get("candidates", []):
+        parts = candidate.get("content", {}).get("parts", [])
+        text = "".join(part.get("text", "") for part in parts)
+        if text:
+            return text
+    return None
+
+
+def write_jsonl_atomic(path: str, lines: Iterator[Dict]) -> int:
+    # A shard either exists complete or not at all, which is what makes shard-level resume safe
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            count += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_jsonl(path: str) -> Iterator[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class LocalBatchBackend:
+    # Stand-in for batch prediction: answers a request shard with any generate_content model. Those are online
+    # calls, billed at the full price and paced and retried like the realtime loop
+    discount = 0.0
+
+    def __init__(self, model, retry_policy=None, limiter=None):
+        self.model = model
+        self.retry_policy = retry_policy
+        self.limiter = limiter
+
+    def _predict(self, line: Dict) -> Dict:
+        request = line["request"]
+        call = lambda: self.model.generate_content(request["contents"],
+                                                   generation_config=request.get("generationConfig"))
+        try:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            response = self.retry_policy.call(call) if self.retry_policy is not None else call()
+            return dict(line, response=response_to_json(response), status="")
+        except Exception as e:
+            return dict(line, status=str(e))
+
+    def submit(self, request_path: str, result_path: str) -> str:
+        write_jsonl_atomic(result_path, (self._predict(line) for line in read_jsonl(request_path)))
+        return f"local:{os.path.basename(request_path)}"
+
+    def poll(self, job_id: str, result_path: str) -> bool:
+        return os.path.exists(result_path)
+
+
+class VertexBatchBackend:
+    discount = BATCH_DISCOUNT
+
+    def __init__(self, model_id: str, bucket: str, prefix: str = "rocket_league_batch"):
+        self.model_id = model_id
+        self.bucket_name = bucket
+        self.prefix = prefix
+
+    def _bucket(self):
+        from google.cloud import storage
+        return storage.Client().bucket(self.bucket_name)
+
+    def submit(self, request_path: str, result_path: str) -> str:
+        from vertexai.batch_prediction import BatchPredictionJob
+
+        name = os.path.basename(request_path)
+        blob_name = f"{self.prefix}/input/{name}"
+        self._bucket().blob(blob_name).upload_from_filename(request_path)
+        job = BatchPredictionJob.submit(
+            source_model=self.model_id,
+            input_dataset=f"gs://{self.bucket_name}/{blob_name}",
+            output_uri_prefix=f"gs://{self.bucket_name}/{self.prefix}/output/{os.path.splitext(name)[0]}",
+        )
+        return job.resource_name
+
+    def poll(self, job_id: str, result_path: str) -> bool:
+        from vertexai.batch_prediction import BatchPredictionJob
+
+        if os.path.exists(result_path):
+            return True
+        job = BatchPredictionJob(job_id)
+        if not job.has_ended:
+            return False
+        if not job.has_succeeded:
+            raise RuntimeError(f"Batch job {job_id} failed: {job.error}")
+
+        # Prediction files are written under the output location; concatenate them into one local shard
+        prefix = job.output_location.replace(f"gs://{self.bucket_name}/", "", 1)
+        tmp_path = f"{result_path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            for blob in self._bucket().list_blobs(prefix=prefix):
+                if blob.name.endswith(".jsonl"):
+                    f.write(blob.download_as_bytes())
+        os.replace(tmp_path, result_path)
+        return True
+
+
+class BatchJob:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.request_dir = os.path.join(directory, "requests")
+        self.result_dir = os.path.join(directory, "results")
+        self.manifest_path = os.path.join(directory, "job.json")
+        os.makedirs(self.request_dir, exist_ok=True)
+        os.makedirs(self.result_dir, exist_ok=True)
+        self.manifest = read_json(self.manifest_path) or {"shards": 0, "requests": 0, "jobs": {}, "reserved": {},
+                                                          "ingested": []}
+        # Discount each shard was submitted at, since only real batch prediction is billed at half price
+        self.manifest.setdefault("discounts", {})
+
+    def save(self):
+        atomic_write_json(self.manifest_path, self.manifest)
+
+    def request_path(self, shard: int) -> str:
+        return os.path.join(self.request_dir, SHARD_PATTERN.format(shard))
+
+    def result_path(self, shard: int) -> str:
+        return os.path.join(self.result_dir, RESULT_PATTERN.format(shard))
+
+    def billed_path(self, shard: int) -> str:
+        return os.path.join(self.result_dir, BILLED_PATTERN.format(shard))
+
+    def billed_ids(self, shard: int) -> set:
+        # Request ids of a shard interrupted halfway that already have their cost ledger entry
+        path = self.billed_path(shard)
+        if not os.path.exists(path):
+            return set()
+        repair_tail(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            return set(f.read().split())
+
+    @staticmethod
+    def completed_ids(stories) -> set:
+        return {record["request_id"] for record in stories if "request_id" in record}
+
+    def prepare(self, generator, stories, samples: int = 1, shard_size: int = 1000) -> int:
+        if self.manifest["shards"]:
+            logger.info(f"Batch job already prepared: {self.manifest['requests']} requests in "
+                        f"{self.manifest['shards']} shards")
+            return self.manifest["shards"]
+
+        done = self.completed_ids(stories)
+        pending = [request for request in expand_grid(generator, samples) if request["request_id"] not in done]
+        for start in range(0, len(pending), shard_size):
+            shard = start // shard_size
+            lines = (batch_request_line(request, generator.generation_config)
+                     for request in pending[start:start + shard_size])
+            write_jsonl_atomic(self.request_path(shard), lines)
+
+        self.manifest.update(model=generator.MODEL_ID, samples=samples, shard_size=shard_size,
+                             shards=(len(pending) + shard_size - 1) // shard_size, requests=len(pending),
+                             skipped=len(done), created=time.strftime("%Y-%m-%d %H:%M:%S"))
+        self.save()
+        logger.info(f"Prepared {len(pending)} requests in {self.manifest['shards']} shards "
+                    f"({len(done)} already have stories)")
+        return self.manifest["shards"]
+
+    def shard_cost(self, ledger, shard: int, max_output_tokens: int, discount: float = 0.0) -> float:
+        return sum(ledger.worst_case_cost(line["request"]["contents"][0]["parts"][0]["text"], max_output_tokens)
+                   for line in read_jsonl(self.request_path(shard))) * (1 - discount)
+
+    def submit(self, backend, ledger, max_output_tokens: int) -> int:
+        submitted = 0
+        for shard in range(self.manifest["shards"]):
+            key = str(shard)
+            if key in self.manifest["jobs"] or os.path.exists(self.result_path(shard)):
+                continue
+            # Shards in flight keep their worst case reserved until they are ingested
+            cost = self.shard_cost(ledger, shard, max_output_tokens, backend.discount)
+            if not ledger.can_afford(cost + sum(self.manifest["reserved"].values())):
+                logger.info(f"Remaining budget cannot cover shard {shard}. Stopping submission.")
+                break
+            self.manifest["jobs"][key] = backend.submit(self.request_path(shard), self.result_path(shard))
+            self.manifest["reserved"][key] = cost
+            self.manifest["discounts"][key] = backend.discount
+            self.save()
+            submitted += 1
+            logger.info(f"Submitted shard {shard}: {self.manifest['jobs'][key]}")
+        return submitted
+
+    def wait(self, backend, poll_interval: float = 60):
+        while True:
+            waiting = [int(key) for key, job_id in self.manifest["jobs"].items()
+                       if not backend.poll(job_id, self.result_path(int(key)))]
+            if not waiting:
+                return
+            logger.info(f"Waiting for {len(waiting)} batch shards...")
+            time.sleep(poll_interval)
+
+    def add_shard(self, lines: list) -> int:
+        shard = self.manifest["shards"]
+        write_jsonl_atomic(self.request_path(shard), lines)
+        self.manifest["shards"] += 1
+        self.manifest["requests"] += len(lines)
+        return shard
+
+    def ingest(self, generator, stories, output_dir: str) -> Dict:
+        counts = {"accepted": 0, "duplicates": 0, "skipped": 0, "failed": 0, "rejected": 0, "requeued": 0}
+        ready = [shard for shard in range(self.manifest["shards"])
+                 if shard not in self.manifest["ingested"] and os.path.exists(self.result_path(shard))]
+        if not ready:
+            return counts
+        done = self.completed_ids(stories)
+
+        for shard in ready:
+            discount = self.manifest["discounts"].get(str(shard), 0.0)
+            retry = []
+            # A shard interrupted halfway is read again; stories it already produced are skipped by id, and lines
+            # it already billed are handled again without a second ledger entry
+            billed = self.billed_ids(shard)
+            # Results are matched through the request label, which batch prediction echoes back
+            metadata = {line["request"]["labels"]["request_id"]: line["metadata"]
+                        for line in read_jsonl(self.request_path(shard))}
+            with open(self.billed_path(shard), 'a', encoding='utf-8') as progress:
+                for line in read_jsonl(self.result_path(shard)):
+                    request = metadata.get(line["request"].get("labels", {}).get("request_id"))
+                    if request is None or request["request_id"] in done:
+                        counts["skipped"] += 1
+                        continue
+                    request_id = request["request_id"]
+                    prompt = line["request"]["contents"][0]["parts"][0]["text"]
+                    text = response_text(line.get("response", {})) if not line.get("status") else None
+                    usage = line.get("response", {}).get("usageMetadata")
+                    if usage is not None:
+                        usage = types.SimpleNamespace(prompt_token_count=usage.get("promptTokenCount"),
+                                                      candidates_token_count=usage.get("candidatesTokenCount"))
+                    if text is None:
+                        counts["failed"] += 1
+                        retry.append((line, request))
+                        continue
+
+                    # Same check as the realtime loop, so only stories that passed are cached and replayed
+                    reason = generator.response_format.check(text, request["aspect"])
+                    if request_id not in billed:
+                        # A rejected story is still billed, but does not count as produced
+                        generator.ledger.record(prompt, text, usage, stories=int(reason is None), discount=discount,
+                                                category=request["category"], aspect=request["aspect"],
+                                                request_id=request_id)
+                        progress.write(request_id + "\n")
+                        progress.flush()
+                    if reason is not None:
+                        generator.metrics.reject(reason)
+                        counts["rejected"] += 1
+                        retry.append((line, request))
+                        continue
+                    generator.cache_response(prompt, request["sample_index"], text)
+                    story = generator.finalize_story(text)
+                    accepted = generator.accept_story(stories, output_dir, story, len(story), request["category"],
+                                                      request["aspect"], False, starter=request["starter"],
+                                                      request_id=request_id)
+                    done.add(request_id)
+                    counts["accepted" if accepted else "duplicates"] += 1
+
+            generator.save_stories(stories, output_dir)
+            # Failed and rejected requests go to a follow-up shard, up to the validation retry limit
+            retry_lines = [{"request": line["request"],
+                            "metadata": dict(request, attempt=request.get("attempt", 0) + 1)}
+                           for line, request in retry if request.get("attempt", 0) < generator.max_validation_retries]
+            if retry_lines:
+                follow_up = self.add_shard(retry_lines)
+                counts["requeued"] += len(retry_lines)
+                logger.info(f"Re-queued {len(retry_lines)} failed or rejected requests of shard {shard} "
+                            f"as shard {follow_up}")
+            self.manifest["ingested"].append(shard)
+            self.manifest["reserved"].pop(str(shard), None)
+            self.save()
+            os.remove(self.billed_path(shard))
+            logger.info(f"Ingested shard {shard} ({len(self.manifest['ingested'])}/{self.manifest['shards']})")
+        return counts
+
+    def status(self) -> Dict:
+        return {
+            "shards": self.manifest["shards"],
+            "requests": self.manifest["requests"],
+            "submitted": len(self.manifest["jobs"]),
+            "completed": sum(1 for shard in range(self.manifest["shards"]) if os.path.exists(self.result_path(shard))),
+            "ingested": len(self.manifest["ingested"]),
+        }
@@ -0,0 +1,130 @@
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from catalog import Catalog
+from story_store import StoryStore
+
+TERMS = ("rotation boost kickoff demo backboard aerial challenge shadow defense pressure corner pass dribble flick "
+         "ceiling wavedash recovery goalie third man midfield possession fake bump centre clear save").split()
+CATEGORIES = ("defensive_scenarios", "offensive_scenarios", "special_situations", "kickoff_scenarios")
+QUERIES = ("rotation", "NEAR(boost pressure, 5)", "wavedash AND recovery", '"third man"')
+
+
+def vocabulary(size: int) -> tuple[list, list]:
+    # Zipf-distributed words, with the Rocket League terms among the common ones but not the stop words
+    words = [f"w{number}" for number in range(size)]
+    for rank, term in enumerate(TERMS):
+        words[20 + 10 * rank] = term
+    return words, [1 / (rank + 1) for rank in range(size)]
+
+
+def story_text(rng: random.Random, words: list, weights: list, count: int, aspect: str) -> str:
+    opening = f"In a 3v3 match, when {aspect}, the optimal strategy is to "
+    return opening + " ".join(rng.choices(words, weights, k=count))
+
+
+def fill_store(directory: str, args) -> StoryStore:
+    rng = random.Random(args.seed)
+    words, weights = vocabulary(args.vocabulary)
+    stories = StoryStore(directory, fsync_every=10 ** 9)
+    for _ in range(args.stories):
+        aspect = rng.randrange(args.aspects)
+        stories.append(story_text(rng, words, weights, args.words, f"aspect {aspect}"),
+                       CATEGORIES[aspect % len(CATEGORIES)], f"aspect {aspect}")
+    stories.checkpoint()
+    return stories
+
+
+def timed(function, repeats: int) -> tuple:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, round(statistics.median(timings), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stories", type=int, default=200000)
+    parser.add_argument("--words", type=int, default=60)
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--aspects", type=int, default=40)
+    parser.add_argument("--append", type=int, default=2000, help="Stories added before the incremental ingest")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    with tempfile.TemporaryDirectory(prefix="rl_catalog_") as work_dir:
+        store_dir = os.path.join(work_dir, "store")
+        stories = fill_store(store_dir, args)
+        catalog = Catalog(os.path.join(work_dir, "catalog.sqlite"))
+
+        start = time.perf_counter()
+        catalog.ingest([store_dir])
+        ingest_seconds = time.perf_counter() - start
+
+        rng = random.Random(args.seed + 1)
+        words, weights = vocabulary(args.vocabulary)
+        for _ in range(args.append):
+            stories.append(story_text(rng, words, weights, args.words, "aspect 0"), CATEGORIES[0], "aspect 0")
+        start = time.perf_counter()
+        added = catalog.sync_store(stories)
+        incremental_ms = (time.perf_counter() - start) * 1000
+        _, unchanged_ms = timed(lambda: catalog.sync_store(stories), args.repeats)
+
+        stories.export_text(os.path.join(work_dir, "stories.txt"))
+        stories.close()
+        text_catalog = Catalog(os.path.join(work_dir, "text_catalog.sqlite"))
+        start = time.perf_counter()
+        text_stories = text_catalog.ingest([os.path.join(work_dir, "stories.txt")],
+                                           [(CATEGORIES[aspect % len(CATEGORIES)], f"aspect {aspect}")
+                                            for aspect in range(args.aspects)])
+        text_seconds = time.perf_counter() - start
+        inferred = text_catalog.count() - text_catalog.count(category="")
+        text_catalog.close()
+
+        total, count_ms = timed(catalog.count, args.repeats)
+        _, cell_count_ms = timed(lambda: catalog.count(category=CATEGORIES[1], aspect="aspect 1"), args.repeats)
+        _, grouped_ms = timed(lambda: catalog.counts(("category", "aspect")), args.repeats)
+        queries = []
+        for query in QUERIES:
+            matches, match_count_ms = timed(lambda: catalog.count(query), args.repeats)
+            _, search_ms = timed(lambda: catalog.search(query, 10), args.repeats)
+            _, filtered_search_ms = timed(lambda: catalog.search(query, 10, category=CATEGORIES[2]), args.repeats)
+            queries.append({"query": query, "matches": matches, "count_ms": match_count_ms,
+                            "top10_ms": search_ms, "top10_in_category_ms": filtered_search_ms})
+        _, sample_ms = timed(lambda: catalog.sample(100, seed=1), args.repeats)
+        _, filtered_sample_ms = timed(lambda: catalog.sample(100, seed=1, aspect="aspect 3"), args.repeats)
+        ids = catalog.ids(category=CATEGORIES[3])
+        export_path = os.path.join(work_dir, "subset.jsonl")
+        written, export_ms = timed(lambda: catalog.export(export_path, ids, "jsonl"), 1)
+        database_bytes = os.path.getsize(os.path.join(work_dir, "catalog.sqlite"))
+        catalog.close()
+
+    results = {
+        "stories": total,
+        "ingest": {"seconds": round(ingest_seconds, 2), "stories_per_second": round(args.stories / ingest_seconds),
+                   "database_bytes_per_story": round(database_bytes / total, 1)},
+        "incremental": {"added": added, "ms": round(incremental_ms, 1), "unchanged_ms": unchanged_ms},
+        "text_corpus": {"stories": text_stories, "seconds": round(text_seconds, 2), "metadata_inferred": inferred},
+        "count_ms": count_ms,
+        "cell_count_ms": cell_count_ms,
+        "grouped_counts_ms": grouped_ms,
+        "queries": queries,
+        "sample_100_ms": sample_ms,
+        "sample_100_in_aspect_ms": filtered_sample_ms,
+        "export": {"stories": written, "ms": export_ms, "us_per_story": round(export_ms * 1000 / max(written, 1), 1)},
+    }
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import json
+import os
+import time
+
+from concurrent_generation import ConcurrentGenerationEngine
+from cost_ledger import CostLedger
+from fake_model import FakeGenerativeModel, load_generator_script
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR_SCRIPT = os.path.join(REPO_ROOT, "rocket-league-gemini_v1.py")
+
+
+def run_level(module, concurrency: int, requests: int, latency: float) -> dict:
+    generator = module.RocketLeagueGeminiGenerator()
+    generator.model = FakeGenerativeModel(generator.MODEL_ID, latency=latency, seed=concurrency)
+    generator.ledger = CostLedger(generator.MODEL_ID, generator.BUDGET)
+    engine = ConcurrentGenerationEngine(generator, max_concurrency=concurrency, requests_per_minute=1e9)
+
+    stories = []
+    start = time.perf_counter()
+    engine.run(lambda results, span: stories.extend(story for story, *_ in results), max_requests=requests)
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "stories": len(stories),
+        "seconds": round(elapsed, 3),
+        "stories_per_second": round(len(stories) / elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--levels", default="1,2,4,8,16")
+    args = parser.parse_args()
+
+    module = load_generator_script(GENERATOR_SCRIPT)
+    results = [run_level(module, int(level), args.requests, args.latency) for level in args.levels.split(",")]
+    baseline = results[0]["stories_per_second"]
+    for result in results:
+        result["speedup"] = round(result["stories_per_second"] / baseline, 2)
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import json
+import random
+import time
+from array import array
+
+from dedup import MAX_HASH, NearDuplicateIndex
+
+
+def random_story(rng: random.Random, vocabulary: list, words: int = 400) -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stories", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--groups", type=int, default=40)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    index = NearDuplicateIndex()
+    groups = [index.group_id("category", f"aspect {i}") for i in range(args.groups)]
+
+    # Hashing 100k texts takes minutes in pure Python, so the bulk of the index is filled with
+    # random signatures; lookup cost only depends on bucket sizes, not on where signatures came from
+    start = time.perf_counter()
+    for story_id in range(1, args.stories + 1):
+        signature = array('Q', (rng.randrange(MAX_HASH) for _ in range(index.num_perm)))
+        index.add(story_id, signature, groups[story_id % args.groups])
+    build_seconds = time.perf_counter() - start
+
+    texts = [random_story(rng, vocabulary) for _ in range(args.queries)]
+    start = time.perf_counter()
+    signatures = [index.signature(text) for text in texts]
+    signature_seconds = time.perf_counter() - start
+
+    for i, signature in enumerate(signatures[:args.queries // 2]):
+        index.add(args.stories + 1 + i, signature, groups[i % args.groups])
+
+    start = time.perf_counter()
+    duplicates = sum(1 for i, signature in enumerate(signatures)
+                     if index.query(signature, groups[i % args.groups]) is not None)
+    query_seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        "indexed_stories": len(index),
+        "build_seconds": round(build_seconds, 2),
+        "signature_ms_per_story": round(signature_seconds / args.queries * 1000, 3),
+        "query_ms_per_story": round(query_seconds / args.queries * 1000, 4),
+        "duplicates_found": duplicates,
+        "expected_duplicates": args.queries // 2,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
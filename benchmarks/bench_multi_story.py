@@ -0,0 +1,66 @@
+import argparse
+import json
+import os
+import time
+
+from concurrent_generation import ConcurrentGenerationEngine
+from cost_ledger import CostLedger
+from fake_model import FakeGenerativeModel, load_generator_script
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR_SCRIPT = os.path.join(REPO_ROOT, "rocket-league-gemini_v1.py")
+
+
+def run_mode(module, mode: str, candidates: int, pack: int, args) -> dict:
+    generator = module.RocketLeagueGeminiGenerator()
+    generator.model = FakeGenerativeModel(generator.MODEL_ID, latency=args.latency, response_chars=args.story_chars,
+                                          seed=1, malformed_rate=args.malformed_rate)
+    generator.configure_batching(candidates, pack)
+    generator.ledger = CostLedger(generator.MODEL_ID, generator.BUDGET)
+    engine = ConcurrentGenerationEngine(generator, max_concurrency=4, requests_per_minute=1e9)
+
+    stories = []
+    start = time.perf_counter()
+    engine.run(lambda results, span: stories.extend(results), max_requests=args.requests)
+    elapsed = time.perf_counter() - start
+
+    # The fake names the topic inside each packed section, so a story split under the wrong header shows up here
+    misattributed = sum(1 for story, _, category, scenario, *_ in stories
+                        if pack > 1 and f"{category} / {scenario}" not in story)
+    ledger = generator.ledger
+    totals = ledger.summary()
+    input_cost = ledger.cost(*ledger.units(totals["input_chars"], 0, totals["input_tokens"], 0))
+    return {
+        "mode": mode,
+        "requests": engine.requests_sent,
+        "rejected_responses": engine.requests_failed,
+        "stories": len(stories),
+        "stories_per_request": round(len(stories) / engine.requests_sent, 2),
+        "input_cost_per_story": round(input_cost / len(stories), 6),
+        "total_cost_per_story": round(totals["cost"] / len(stories), 6),
+        "misattributed": misattributed,
+        "seconds": round(elapsed, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--story-chars", type=int, default=2500)
+    parser.add_argument("--per-request", type=int, default=4, help="Candidates / packed stories per request")
+    parser.add_argument("--malformed-rate", type=float, default=0.05,
+                        help="Share of packed responses with a missing header")
+    args = parser.parse_args()
+
+    module = load_generator_script(GENERATOR_SCRIPT)
+    results = [
+        run_mode(module, "single", 1, 1, args),
+        run_mode(module, f"candidates_{args.per_request}", args.per_request, 1, args),
+        run_mode(module, f"packed_{args.per_request}", 1, args.per_request, args),
+    ]
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import time
+
+from concurrent_generation import ConcurrentGenerationEngine
+from cost_ledger import CostLedger
+from fake_model import FakeGenerativeModel, load_generator_script
+from retry_policy import CircuitBreaker, RetryPolicy
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR_SCRIPT = os.path.join(REPO_ROOT, "rocket-league-gemini_v1.py")
+
+
+def make_model(args, seed: int) -> FakeGenerativeModel:
+    return FakeGenerativeModel(latency=args.latency, jitter=args.latency / 4, response_chars=1500, seed=seed,
+                               throttle_rate=args.throttle_rate, transient_rate=args.transient_rate,
+                               permanent_rate=args.permanent_rate, max_concurrent=args.max_concurrent)
+
+
+def run_fixed_sleep(module, args) -> dict:
+    # The original loop: one call, swallow any error, fixed sleep, repeat
+    generator = module.RocketLeagueGeminiGenerator()
+    generator.model = make_model(args, seed=1)
+    successes = 0
+    start = time.perf_counter()
+    for index in range(args.requests):
+        category, scenario, prompt, sample_index = generator.build_request(index)
+        try:
+            if generator.call_model(prompt):
+                successes += 1
+        except Exception:
+            pass
+        time.sleep(args.fixed_sleep)
+    return summarize("fixed_sleep", successes, time.perf_counter() - start, generator.model)
+
+
+def run_adaptive(module, args) -> dict:
+    generator = module.RocketLeagueGeminiGenerator()
+    generator.model = make_model(args, seed=1)
+    generator.retry_policy = RetryPolicy(base_delay=args.latency / 2, max_delay=args.latency * 20,
+                                         breaker=CircuitBreaker(failure_threshold=20, reset_timeout=args.latency * 10))
+    generator.ledger = CostLedger(generator.MODEL_ID, generator.BUDGET)
+    engine = ConcurrentGenerationEngine(generator, max_concurrency=args.concurrency, requests_per_minute=1e9)
+    stories = []
+    start = time.perf_counter()
+    engine.run(lambda results, span: stories.extend(story for story, *_ in results), max_requests=args.requests)
+    result = summarize("adaptive", len(stories), time.perf_counter() - start, generator.model)
+    result["final_concurrency_limit"] = engine.controller.limit
+    result["retries"] = generator.retry_policy.retries
+    result["errors_by_class"] = generator.retry_policy.error_counts
+    return result
+
+
+def summarize(mode: str, successes: int, seconds: float, model: FakeGenerativeModel) -> dict:
+    return {
+        "mode": mode,
+        "stories": successes,
+        "api_calls": model.calls,
+        "api_errors": model.errors,
+        "seconds": round(seconds, 3),
+        "goodput_stories_per_second": round(successes / seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.08)
+    parser.add_argument("--fixed-sleep", type=float, default=0.02,
+                        help="The 2s sleep, scaled by the same factor as latency")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--max-concurrent", type=int, default=6, help="Concurrent calls before the fake returns 429")
+    parser.add_argument("--throttle-rate", type=float, default=0.02)
+    parser.add_argument("--transient-rate", type=float, default=0.05)
+    parser.add_argument("--permanent-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    module = load_generator_script(GENERATOR_SCRIPT)
+    fixed = run_fixed_sleep(module, args)
+    adaptive = run_adaptive(module, args)
+    print(json.dumps({
+        "fixed_sleep": fixed,
+        "adaptive": adaptive,
+        "goodput_ratio": round(adaptive["goodput_stories_per_second"] / fixed["goodput_stories_per_second"], 2),
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from fake_model import FakeGenerativeModel, load_generator_script
+from scheduler import CoverageScheduler
+from story_store import StoryStore
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR_SCRIPT = os.path.join(REPO_ROOT, "rocket-league-gemini_v1.py")
+
+
+class SaturatedModel(FakeGenerativeModel):
+    # Prompts about the saturated aspects always get the same answer, so every story after the first is a duplicate
+    def __init__(self, saturated: list, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.saturated = saturated
+
+    def _story_text(self, prompt: str) -> str:
+        for aspect in self.saturated:
+            if aspect in prompt:
+                return " ".join([aspect] * 400)
+        return super()._story_text(prompt)
+
+
+def make_generator(module, args, seed: int, schedule: str, output_dir: str, budget: float,
+                   rejection_weight: float = 4.0, saturated: list = ()):
+    # The shuffled list comes from the global random module; the coverage schedule must not depend on it
+    random.seed(seed)
+    generator = module.RocketLeagueGeminiGenerator()
+    generator.model = SaturatedModel(list(saturated), generator.MODEL_ID, latency=0.0, response_chars=args.story_chars,
+                                     seed=seed, permanent_rate=args.permanent_rate)
+    generator.request_interval = 0
+    generator.BUDGET = budget
+    generator.configure_batching(pack=args.pack)
+    if saturated:
+        generator.enable_dedup(output_dir, mode="reject")
+    if schedule == "coverage":
+        generator.enable_scheduler(output_dir, rejection_weight)
+    return generator
+
+
+def stored_cells(output_dir: str) -> list:
+    stories = StoryStore(output_dir)
+    cells = [(record["category"], record["aspect"]) for record in stories]
+    stories.close()
+    return cells
+
+
+def spread(cells: list, grid: int) -> dict:
+    counts = {}
+    for cell in cells:
+        counts[cell] = counts.get(cell, 0) + 1
+    values = list(counts.values()) + [0] * (grid - len(counts))
+    return {"stories": len(cells), "min": min(values), "max": max(values),
+            "stdev": round(statistics.pstdev(values), 3)}
+
+
+def run_spread(module, args, schedule: str, concurrency: int, rejection_weight: float = 4.0,
+               saturated: list = ()) -> dict:
+    with tempfile.TemporaryDirectory(prefix="rl_schedule_") as output_dir:
+        generator = make_generator(module, args, args.seed, schedule, output_dir, args.budget, rejection_weight,
+                                   saturated)
+        if concurrency > 1:
+            generator.generate_dataset_concurrent(output_dir, concurrency, requests_per_minute=1e9)
+        else:
+            generator.generate_dataset(output_dir)
+        result = spread(stored_cells(output_dir), generator.cycle_length)
+        requests = generator.ledger.summary()["requests"]
+    return dict(result, schedule=schedule, concurrency=concurrency, rejection_weight=rejection_weight,
+                paid_requests=requests, stories_per_request=round(result["stories"] / max(requests, 1), 3))
+
+
+def run_resume(module, args) -> dict:
+    # Stop halfway, restart with a different global seed, and compare the cell order with an uninterrupted run
+    with tempfile.TemporaryDirectory(prefix="rl_schedule_") as straight_dir, \
+            tempfile.TemporaryDirectory(prefix="rl_schedule_") as resumed_dir:
+        make_generator(module, args, args.seed, "coverage", straight_dir, args.budget).generate_dataset(straight_dir)
+        make_generator(module, args, args.seed, "coverage", resumed_dir, args.budget / 2).generate_dataset(resumed_dir)
+        interrupted = len(stored_cells(resumed_dir))
+        # Drop the coverage index so the second half has to recount from the story store
+        os.remove(os.path.join(resumed_dir, "coverage_index.json"))
+        make_generator(module, args, args.seed + 1, "coverage", resumed_dir, args.budget).generate_dataset(resumed_dir)
+        straight = stored_cells(straight_dir)
+        resumed = stored_cells(resumed_dir)
+    common = min(len(straight), len(resumed))
+    return {"interrupted_at": interrupted, "compared": common,
+            "same_order": straight[:common] == resumed[:common]}
+
+
+def run_selection(args) -> list:
+    results = []
+    for size in [int(size) for size in args.grid_sizes.split(",")]:
+        scheduler = CoverageScheduler([(f"category {number % 10}", f"aspect {number}", None) for number in range(size)])
+        start = time.perf_counter()
+        for _ in range(args.takes):
+            cell, _ = scheduler.take()
+            scheduler.record(cell)
+        elapsed = time.perf_counter() - start
+        results.append({"cells": size, "us_per_take_and_record": round(elapsed / args.takes * 1e6, 2)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--budget", type=float, default=0.6, help="Dollars per run; not a whole number of grid passes")
+    parser.add_argument("--story-chars", type=int, default=2500)
+    parser.add_argument("--pack", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--permanent-rate", type=float, default=0.05,
+                        help="Share of requests failing for good; the shuffled list skips their cell")
+    parser.add_argument("--saturated-cells", type=int, default=8)
+    parser.add_argument("--rejection-weights", default="0,1,4,16")
+    parser.add_argument("--grid-sizes", default="40,1000,100000")
+    parser.add_argument("--takes", type=int, default=20000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    module = load_generator_script(GENERATOR_SCRIPT)
+    saturated = sorted(aspect for _, aspect in module.RocketLeagueGeminiGenerator().aspect_list)[:args.saturated_cells]
+    results = {
+        "spread": [run_spread(module, args, schedule, concurrency)
+                   for schedule in ("shuffled", "coverage") for concurrency in (1, args.concurrency)],
+        # Cells that only produce near-duplicates; the rejection weight decides how much budget they keep getting
+        "saturated": [run_spread(module, args, "shuffled", 1, saturated=saturated)]
+                     + [run_spread(module, args, "coverage", 1, float(weight), saturated)
+                        for weight in args.rejection_weights.split(",")],
+        "resume": run_resume(module, args),
+        "selection": run_selection(args),
+    }
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import functools
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from fake_model import FakeGenerativeModel, load_generator_script
+from retry_policy import CircuitBreaker, RetryPolicy
+from sharded_launcher import ShardedLauncher
+from story_store import StoryStore
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR_SCRIPT = os.path.join(REPO_ROOT, "rocket-league-gemini_v1.py")
+
+
+def use_fake_model(generator, worker: int, latency: float, quota: int):
+    # Each worker process has its own fake, so the quota applies per worker like a per-worker share of the real one
+    generator.model = FakeGenerativeModel(generator.MODEL_ID, latency=latency, jitter=latency / 4,
+                                          response_chars=1500, seed=worker, quota=quota, quota_window=1.0,
+                                          follow_format=True)
+    generator.retry_policy = RetryPolicy(base_delay=latency, max_delay=latency * 10,
+                                         breaker=CircuitBreaker(failure_threshold=50, reset_timeout=latency * 10))
+
+
+def stored_ids(output_dir: str) -> list:
+    ids = []
+    for name in sorted(os.listdir(output_dir)):
+        if name.startswith("worker_"):
+            store = StoryStore(os.path.join(output_dir, name))
+            ids.extend(record.get("request_id") for record in store)
+            store.close()
+    return ids
+
+
+def run(args, workers: int, kill_after: float = None) -> dict:
+    output_dir = tempfile.mkdtemp(prefix="rl_sharded_")
+    setup = functools.partial(use_fake_model, latency=args.latency, quota=args.quota_per_worker)
+    launcher = ShardedLauncher(GENERATOR_SCRIPT, output_dir, workers, budget=args.budget, samples=args.samples,
+                               requests_per_minute=1e9, load_module=load_generator_script, setup=setup)
+    if kill_after is not None:
+        # Kill worker 0 mid-run; its slice has to be finished by the others
+        def kill():
+            time.sleep(kill_after)
+            process = launcher.processes.get(0)
+            if process is not None:
+                process.kill()
+        threading.Thread(target=kill, daemon=True).start()
+
+    summary = launcher.run(poll_interval=0.2)
+    ids = stored_ids(output_dir)
+    with sqlite3.connect(os.path.join(output_dir, "shared_ledger.sqlite")) as connection:
+        forfeited = connection.execute("SELECT COUNT(*) FROM entries WHERE entry LIKE '%forfeited_reservation%'"
+                                       ).fetchone()[0]
+    return {
+        "workers": workers,
+        "killed_worker": kill_after is not None,
+        "items": summary["items"],
+        "stories_stored": len(ids),
+        "duplicate_items": len(ids) - len(set(ids)),
+        "paid_requests": summary["requests"],
+        "cost": round(summary["cost"], 5),
+        "within_budget": summary["cost"] <= args.budget,
+        "forfeited_reservations": forfeited,
+        "seconds": summary["seconds"],
+        "stories_per_second": round(len(ids) / summary["seconds"], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--levels", default="1,2,4")
+    parser.add_argument("--samples", type=int, default=2, help="Grid passes; the v1 grid has 40 cells")
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--quota-per-worker", type=int, default=None,
+                        help="Requests/s each fake worker accepts before answering 429")
+    parser.add_argument("--budget", type=float, default=5.0)
+    args = parser.parse_args()
+
+    results = [run(args, int(level)) for level in args.levels.split(",")]
+    baseline = results[0]["stories_per_second"]
+    for result in results:
+        result["speedup"] = round(result["stories_per_second"] / baseline, 2)
+    results.append(run(args, max(int(level) for level in args.levels.split(",")), kill_after=1.5))
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+
+from fake_model import FILLER_WORDS
+from story_store import STORY_SEPARATOR
+from tokenize_shards import TokenShards, tokenize_corpus
+
+
+def write_corpus(path: str, stories: int, words: int, seed: int):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for index in range(stories):
+            if index:
+                f.write(STORY_SEPARATOR)
+            f.write(" ".join(rng.choice(FILLER_WORDS) for _ in range(words)) + " EOS")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--stories", type=int, default=5000, help="Stories per file")
+    parser.add_argument("--words", type=int, default=400)
+    parser.add_argument("--levels", default="1,2,4")
+    parser.add_argument("--seq-len", type=int, default=2048)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rl_tokenize_")
+    sources = []
+    for number in range(args.files):
+        path = os.path.join(workdir, f"corpus_{number}.txt")
+        write_corpus(path, args.stories, args.words, seed=number)
+        sources.append(path)
+
+    results = []
+    for workers in (int(level) for level in args.levels.split(",")):
+        output_dir = os.path.join(workdir, f"shards_{workers}")
+        stats = tokenize_corpus(sources, output_dir, seq_len=args.seq_len, workers=workers)
+        results.append({"workers": workers, "tokens": stats["tokens"], "seconds": stats["seconds"],
+                        "tokens_per_second": stats["tokens_per_second"]})
+    baseline = results[0]["tokens_per_second"]
+    for result in results:
+        result["speedup"] = round(result["tokens_per_second"] / baseline, 2)
+
+    # Second run over unchanged files only checks signatures
+    rerun = tokenize_corpus(sources, output_dir, seq_len=args.seq_len, workers=workers)
+    shards = TokenShards(output_dir)
+    print(json.dumps({
+        "cpu_count": os.cpu_count(),
+        "levels": results,
+        "incremental_rerun": {"skipped": rerun["skipped"], "seconds": rerun["seconds"]},
+        "rows": len(shards),
+        "first_row_head": shards[0][:8].tolist(),
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from fake_model import FakeGenerativeModel, load_generator_script
+from story_store import StoryStore
+from validator import validate_stories
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = ("rocket-league-gemini_v1.py", "rocket-league-gemini-master.py")
+
+
+def make_generator(module, args, seed: int):
+    random.seed(seed)
+    generator = module.RocketLeagueGeminiGenerator()
+    generator.model = FakeGenerativeModel(generator.MODEL_ID, latency=args.latency, response_chars=args.story_chars,
+                                          seed=seed, follow_format=True, off_format_rate=args.off_format_rate)
+    generator.request_interval = 0
+    generator.BUDGET = args.budget
+    generator.enable_validation(args.max_retries)
+    return generator
+
+
+def run_generation(module, args, name: str, concurrency: int = 1, candidates: int = 1, pack: int = 1) -> dict:
+    generator = make_generator(module, args, args.seed)
+    generator.configure_batching(candidates, pack)
+    with tempfile.TemporaryDirectory(prefix="rl_validation_") as output_dir:
+        if concurrency > 1:
+            generator.generate_dataset_concurrent(output_dir, concurrency, requests_per_minute=1e9)
+        else:
+            generator.generate_dataset(output_dir)
+        stories = StoryStore(output_dir)
+        stored = validate_stories(stories, generator.response_format)["counts"]
+        stories.close()
+    counters = generator.metrics.snapshot()["counters"]
+    return {
+        "name": name,
+        "stories": generator.stories_generated,
+        "paid_requests": generator.ledger.summary()["requests"],
+        "invalid_stories": counters["invalid_stories"],
+        "requeued_stories": counters["requeued_stories"],
+        "invalid_reasons": dict(generator.metrics.invalid_reasons),
+        "stored_invalid": sum(count for reason, count in stored.items() if reason != "valid"),
+    }
+
+
+def run_throughput(module, args) -> dict:
+    # Offline validation of a stored corpus, the cost of --validate-existing
+    generator = make_generator(module, args, args.seed)
+    model = FakeGenerativeModel(response_chars=args.story_chars, response_chars_sigma=0.25, seed=args.seed,
+                                follow_format=True, off_format_rate=args.off_format_rate)
+    # A pool of distinct stories per cell, repeated up to the corpus size; building each one is the slow part
+    cells = [generator.build_request(index)[:2] for index in range(generator.cycle_length)]
+    pool = [(category, aspect, generator.finalize_story(model._formatted_text(generator.create_prompt(category, aspect))))
+            for _ in range(args.pool_per_cell) for category, aspect in cells]
+    records = []
+    for seq in range(1, args.corpus_size + 1):
+        category, aspect, text = pool[seq % len(pool)]
+        records.append({"seq": seq, "text": text, "category": category, "aspect": aspect})
+    start = time.perf_counter()
+    report = validate_stories(records, generator.response_format)
+    elapsed = time.perf_counter() - start
+    return {"stories": len(records), "seconds": round(elapsed, 3),
+            "us_per_story": round(elapsed / len(records) * 1e6, 2), "counts": report["counts"]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--script", default=os.path.join(REPO_ROOT, SCRIPTS[0]))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    # The fake model's filler words are short, so 2000 characters is about the 400 words the prompts allow
+    parser.add_argument("--story-chars", type=int, default=2000)
+    parser.add_argument("--off-format-rate", type=float, default=0.2)
+    parser.add_argument("--max-retries", type=int, default=2)
+    parser.add_argument("--budget", type=float, default=0.3)
+    parser.add_argument("--corpus-size", type=int, default=100000)
+    parser.add_argument("--pool-per-cell", type=int, default=25)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    module = load_generator_script(args.script)
+    results = {
+        "generation": [
+            run_generation(module, args, "sequential"),
+            run_generation(module, args, "concurrent_4", concurrency=4),
+            run_generation(module, args, "pack_3", pack=3),
+            run_generation(module, args, "candidates_2", candidates=2),
+        ],
+        "throughput": run_throughput(module, args),
+    }
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
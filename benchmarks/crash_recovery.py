@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from checkpoint import recover_counters
+from fake_model import FakeGenerativeModel, load_generator_script
+from story_store import StoryStore
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR_SCRIPT = os.path.join(REPO_ROOT, "rocket-league-gemini_v1.py")
+
+
+def run_child(output_dir: str):
+    module = load_generator_script(GENERATOR_SCRIPT)
+    generator = module.RocketLeagueGeminiGenerator()
+    generator.model = FakeGenerativeModel(generator.MODEL_ID, latency=0.002, jitter=0.002, response_chars=1500)
+    generator.generate_dataset_concurrent(output_dir, max_concurrency=4, requests_per_minute=1e9)
+
+
+def verify(output_dir: str) -> dict:
+    store = StoryStore(output_dir)
+    state, source = recover_counters(os.path.join(output_dir, "generation_state.json"), store)
+    records = 0
+    chars = 0
+    for record in store:
+        records += 1
+        chars += record["chars"]
+    store.close()
+    return {
+        "records": records,
+        "store_count": len(store),
+        "stories_generated": state.get("stories_generated", 0),
+        "characters_generated": state.get("characters_generated", 0),
+        "record_chars": chars,
+        "source": source,
+        "consistent": (records == len(store) == state.get("stories_generated", 0)
+                       and chars == state.get("characters_generated", 0)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--max-run-seconds", type=float, default=1.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    rng = random.Random(args.seed)
+    output_dir = tempfile.mkdtemp(prefix="rl_crash_")
+    rounds = []
+    for round_number in range(args.rounds):
+        child = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.crash_recovery", "--child", output_dir],
+            cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        time.sleep(rng.uniform(0.3, args.max_run_seconds))
+        child.send_signal(signal.SIGKILL)
+        child.wait()
+
+        if rng.random() < 0.5:
+            # Simulate a torn append that SIGKILL alone rarely produces
+            segments = sorted(name for name in os.listdir(output_dir) if name.startswith("stories_"))
+            with open(os.path.join(output_dir, segments[-1]), 'a', encoding='utf-8') as f:
+                f.write('{"seq": 999999, "text": "partial')
+
+        result = verify(output_dir)
+        result["round"] = round_number
+        rounds.append(result)
+
+    summary = {
+        "output_dir": output_dir,
+        "rounds": len(rounds),
+        "consistent_rounds": sum(1 for result in rounds if result["consistent"]),
+        "final": rounds[-1] if rounds else None,
+    }
+    print(json.dumps(summary, indent=4))
+    if summary["consistent_rounds"] != summary["rounds"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
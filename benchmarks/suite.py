@@ -0,0 +1,314 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_model import LATENCY_DISTRIBUTIONS, FakeGenerativeModel, load_generator_script
+from multi_story import split_packed_response, story_header
+from retry_policy import CircuitBreaker, RetryPolicy
+from story_store import StoryStore
+from streaming import clip_text
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR_SCRIPT = os.path.join(REPO_ROOT, "rocket-league-gemini_v1.py")
+SCENARIOS = ("generation", "checkpoint", "validation", "startup")
+CLI = os.path.join(REPO_ROOT, "rl_cli.py")
+# Imports a generator script the way rl_cli.py does, without the fake vertexai module
+IMPORT_SCRIPT = ("import importlib.util\n"
+                 "spec = importlib.util.spec_from_file_location('rocket_league_generator', {path!r})\n"
+                 "spec.loader.exec_module(importlib.util.module_from_spec(spec))")
+
+
+def make_model(args, seed: int, **overrides) -> FakeGenerativeModel:
+    settings = dict(latency=args.latency, jitter=args.jitter, latency_distribution=args.latency_distribution,
+                    response_chars=args.story_chars, response_chars_sigma=args.story_chars_sigma, seed=seed)
+    settings.update(overrides)
+    return FakeGenerativeModel(**settings)
+
+
+def make_generator(module, args, seed: int, **model_overrides):
+    # The shuffled scenario list comes from the global random module
+    random.seed(seed)
+    generator = module.RocketLeagueGeminiGenerator()
+    generator.model = make_model(args, seed, **model_overrides)
+    generator.request_interval = 0
+    # Backoff scaled to the fake latency, otherwise a single retry would dominate the run
+    generator.retry_policy = RetryPolicy(base_delay=args.latency, max_delay=args.latency * 20, seed=seed,
+                                         breaker=CircuitBreaker(failure_threshold=20, reset_timeout=args.latency * 20))
+    return generator
+
+
+def run_generation(module, args, name: str, concurrency: int, **model_overrides) -> dict:
+    generator = make_generator(module, args, args.seed, **model_overrides)
+    generator.BUDGET = args.budget
+    with tempfile.TemporaryDirectory(prefix="rl_bench_") as output_dir:
+        start = time.perf_counter()
+        if concurrency > 1:
+            generator.generate_dataset_concurrent(output_dir, concurrency, requests_per_minute=1e9)
+        else:
+            generator.generate_dataset(output_dir)
+        elapsed = time.perf_counter() - start
+    snapshot = generator.metrics.snapshot()
+    return {
+        "name": name,
+        "concurrency": concurrency,
+        "stories": generator.stories_generated,
+        "requests": snapshot["counters"]["requests"],
+        "model_calls": generator.model.calls,
+        "seconds": round(elapsed, 3),
+        "stories_per_second": round(generator.stories_generated / elapsed, 2),
+        "api_p50": snapshot["phases"]["api"]["p50"],
+        "api_p99": snapshot["phases"]["api"]["p99"],
+        # Summed over requests, so concurrent phases can add up to more than the wall time
+        "phase_seconds": {phase: data["sum"] for phase, data in snapshot["phases"].items()},
+        "errors": snapshot["errors"],
+        "retries": snapshot["retries"],
+    }
+
+
+def scenario_generation(module, args) -> list:
+    return [
+        run_generation(module, args, "sequential", 1),
+        run_generation(module, args, f"concurrent_{args.concurrency}", args.concurrency),
+        # A request quota below the offered load plus a few percent of server errors
+        run_generation(module, args, f"concurrent_{args.concurrency}_throttled", args.concurrency,
+                       quota=args.quota, quota_window=1.0, transient_rate=0.03),
+    ]
+
+
+def grow_corpus(stories: StoryStore, target: int, story_chars: int, rng: random.Random):
+    # Writes records in the story store format directly; appending 1M stories one fsync at a time takes too long
+    text = " ".join(rng.choice(["rotate", "boost", "challenge", "shadow", "defense"]) for _ in range(story_chars // 7))
+    characters = len(text) * len(stories)
+    while len(stories) < target:
+        seq = len(stories) + 1
+        characters += len(text)
+        record = {"seq": seq, "text": text, "category": "defensive_scenarios", "aspect": f"scenario {seq % 60}",
+                  "starter": None, "chars": len(text), "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "cached": False, "state": {"stories_generated": seq, "characters_generated": characters,
+                                             "last_aspect_index": seq}}
+        stories.file.write(json.dumps(record) + "\n")
+        stories.count = seq
+        if stories.file.tell() >= stories.segment_max_bytes:
+            stories.rotate()
+    stories.sync()
+
+
+def scenario_checkpoint(module, args) -> list:
+    results = []
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory(prefix="rl_bench_") as output_dir:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            stories = StoryStore(output_dir)
+            start = time.perf_counter()
+            grow_corpus(stories, size, args.story_chars, rng)
+            build_seconds = time.perf_counter() - start
+            stories.close()
+
+            # Resume: what a restarted run pays before its first request
+            generator = make_generator(module, args, args.seed)
+            start = time.perf_counter()
+            stories = generator.load_existing_stories(output_dir)
+            generator.open_ledger(output_dir)
+            generator.load_progress_state(output_dir, stories)
+            resume_seconds = time.perf_counter() - start
+
+            save_times = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                generator.save_stories(stories, output_dir)
+                save_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for _ in range(args.repeats * 10):
+                generator.accept_story(stories, output_dir, "x" * args.story_chars, args.story_chars,
+                                       "defensive_scenarios", "benchmark", False)
+            append_seconds = time.perf_counter() - start
+            stories.close()
+            generator.ledger.close()
+
+            disk_bytes = sum(os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir))
+            results.append({
+                "stories": size,
+                "build_seconds": round(build_seconds, 3),
+                "resume_seconds": round(resume_seconds, 4),
+                "save_ms": round(sorted(save_times)[len(save_times) // 2] * 1000, 3),
+                "append_ms_per_story": round(append_seconds / (args.repeats * 10) * 1000, 3),
+                "disk_mb": round(disk_bytes / 1024 / 1024, 1),
+            })
+    return results
+
+
+def scenario_validation(module, args) -> dict:
+    model = make_model(args, args.seed, latency=0.0)
+    texts = [model._story_text("") for _ in range(args.validation_stories)]
+    result = {"stories": len(texts)}
+
+    for mode in ("off", "reject"):
+        generator = make_generator(module, args, args.seed)
+        with tempfile.TemporaryDirectory(prefix="rl_bench_") as output_dir:
+            stories = StoryStore(output_dir)
+            generator.open_ledger(output_dir)
+            if mode != "off":
+                generator.enable_dedup(output_dir, mode=mode)
+            start = time.perf_counter()
+            for number, text in enumerate(texts):
+                story = generator.finalize_story(text)
+                generator.accept_story(stories, output_dir, story, len(story), "defensive_scenarios",
+                                       f"scenario {number % 60}", False)
+            elapsed = time.perf_counter() - start
+            stories.close()
+            generator.ledger.close()
+        result[f"accept_ms_per_story_dedup_{mode}"] = round(elapsed / len(texts) * 1000, 4)
+    result["dedup_overhead_ms_per_story"] = round(result["accept_ms_per_story_dedup_reject"]
+                                                  - result["accept_ms_per_story_dedup_off"], 4)
+
+    start = time.perf_counter()
+    for text in texts:
+        clip_text(text, max_words=400)
+    result["clip_ms_per_story"] = round((time.perf_counter() - start) / len(texts) * 1000, 4)
+
+    generator = make_generator(module, args, args.seed)
+    generator.enable_validation()
+    category, aspect = generator.build_request(0)[:2]
+    formatted = [model._formatted_text(generator.create_prompt(category, aspect)) for _ in range(len(texts))]
+    start = time.perf_counter()
+    for text in formatted:
+        generator.response_format.check(text, aspect)
+    result["format_check_ms_per_story"] = round((time.perf_counter() - start) / len(texts) * 1000, 4)
+
+    requests = [("defensive_scenarios", f"scenario {number}") for number in range(4)]
+    packed = "\n\n".join(f"{story_header(number, category, aspect)}\n{texts[number % len(texts)]}"
+                         for number, (category, aspect) in enumerate(requests, 1))
+    start = time.perf_counter()
+    for _ in range(len(texts) // len(requests)):
+        split_packed_response(packed, requests)
+    result["split_ms_per_story"] = round((time.perf_counter() - start) / (len(texts) // len(requests) * len(requests))
+                                         * 1000, 4)
+    return result
+
+
+def run_process(argv: list, repeats: int) -> tuple[float, list]:
+    # Median wall time of a fresh interpreter, and the modules it imported (from a separate -X importtime run)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + argv, cwd=REPO_ROOT, capture_output=True, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    traced = subprocess.run([sys.executable, "-X", "importtime"] + argv, cwd=REPO_ROOT, capture_output=True, text=True)
+    modules = [line.rsplit("|", 1)[1].strip() for line in traced.stderr.splitlines() if line.startswith("import time:")]
+    return round(statistics.median(timings), 1), modules[1:]
+
+
+def scenario_startup(module, args) -> dict:
+    # Offline subcommands must never load the Vertex SDK, which takes seconds and needs credentials
+    interpreter_ms, _ = run_process(["-c", "pass"], args.startup_repeats)
+    result = {"interpreter_ms": interpreter_ms, "import_ms": {}, "commands": []}
+    for path in (args.script, os.path.join(REPO_ROOT, "rocket-league-gemini-master.py")):
+        elapsed, _ = run_process(["-c", IMPORT_SCRIPT.format(path=path)], args.startup_repeats)
+        result["import_ms"][os.path.basename(path)] = round(elapsed - interpreter_ms, 1)
+
+    generator = make_generator(module, args, args.seed, latency=0.0)
+    generator.BUDGET = 0.02
+    with tempfile.TemporaryDirectory(prefix="rl_bench_") as output_dir:
+        generator.generate_dataset(output_dir)
+        for command in (["stats", output_dir], ["export", output_dir, "--path", os.path.join(output_dir, "x.txt")],
+                        ["validate", output_dir], ["--help"]):
+            elapsed, modules = run_process([CLI, "--script", args.script] + command, args.startup_repeats)
+            result["commands"].append({"name": command[0].lstrip("-"), "ms": elapsed, "modules": len(modules),
+                                       "vertexai_imported": any(name.startswith("vertexai") for name in modules)})
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(data, prefix: str = "") -> dict:
+    # Numeric leaves keyed by path; list entries are keyed by their name or corpus size so runs line up
+    values = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            values.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(data, list):
+        for number, value in enumerate(data):
+            label = value.get("name", value.get("stories", number)) if isinstance(value, dict) else number
+            values.update(flatten(value, f"{prefix}{label}."))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        values[prefix.rstrip(".")] = data
+    return values
+
+
+def compare(baseline: dict, current: dict):
+    old = flatten(baseline["scenarios"])
+    new = flatten(current["scenarios"])
+    print(f"Compared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    for key in sorted(old.keys() & new.keys()):
+        change = f"{(new[key] - old[key]) / old[key]:+.1%}" if old[key] else "n/a"
+        print(f"  {key}: {old[key]} -> {new[key]} ({change})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generator against a simulated GenerativeModel")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--script", default=GENERATOR_SCRIPT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.05, help="Median/mean API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.3,
+                        help="+/- seconds for uniform latency, sigma of the log for lognormal")
+    parser.add_argument("--latency-distribution", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--story-chars", type=int, default=2500)
+    parser.add_argument("--story-chars-sigma", type=float, default=0.25)
+    parser.add_argument("--budget", type=float, default=0.3, help="Dollars per generation run")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--quota", type=int, default=40, help="Requests per second the throttled run allows")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Corpus sizes, e.g. up to 1000000")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--validation-stories", type=int, default=400)
+    parser.add_argument("--startup-repeats", type=int, default=7)
+    parser.add_argument("--output", default=None, help="Write the JSON results to this file")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    module = load_generator_script(args.script)
+    runners = {"generation": scenario_generation, "checkpoint": scenario_checkpoint,
+               "validation": scenario_validation, "startup": scenario_startup}
+    scenarios = {}
+    for name in args.scenarios.split(","):
+        scenarios[name] = runners[name](module, args)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "script": os.path.basename(args.script),
+            "args": vars(args),
+        },
+        "scenarios": scenarios,
+    }
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Optional
+
+from corpus_reader import CorpusReader
+from story_store import STORY_SEPARATOR
+
+logger = logging.getLogger(__name__)
+
+# The FTS index is contentless: story text stays in the story store segments and text corpora, and the catalog
+# keeps where to find it (byte offset for JSONL segments, story number for text corpora)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    ingested INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    tail_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS stories (
+    id INTEGER PRIMARY KEY,
+    source_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    offset INTEGER,
+    length INTEGER,
+    category TEXT NOT NULL DEFAULT '',
+    aspect TEXT NOT NULL DEFAULT '',
+    starter TEXT NOT NULL DEFAULT '',
+    chars INTEGER NOT NULL,
+    timestamp TEXT,
+    cached INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS stories_cell ON stories (category, aspect, starter);
+CREATE INDEX IF NOT EXISTS stories_aspect ON stories (aspect);
+CREATE TABLE IF NOT EXISTS cell_counts (
+    category TEXT NOT NULL,
+    aspect TEXT NOT NULL,
+    starter TEXT NOT NULL,
+    stories INTEGER NOT NULL,
+    chars INTEGER NOT NULL,
+    PRIMARY KEY (category, aspect, starter)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5(text, content='', tokenize='porter unicode61');
+"""
+FILTERS = ("category", "aspect", "starter")
+EXPORT_FORMATS = ("text", "jsonl")
+INSERT_BATCH = 5000
+# Opening of a text corpus story searched for a known aspect name
+INFER_CHARS = 400
+
+
+def tail_hash(path: str, size: int) -> str:
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - 4096))
+        return hashlib.sha1(f.read(size - max(0, size - 4096))).hexdigest()
+
+
+class MetadataGuesser:
+    # Text corpora carry no category/aspect. YouTube blocks are labelled with their video title; generated stories
+    # are matched by the aspect/scenario their opening names ("In a 3v3 match, when <scenario>, ...")
+    def __init__(self, cells: List[tuple] = ()):
+        # youtube_postprocess pulls in multiprocessing; only needed when text corpora are ingested
+        from youtube_postprocess import parse_block
+        self.parse_block = parse_block
+        self.aspects = sorted({(aspect.lower(), category, aspect) for category, aspect in cells},
+                              key=lambda entry: -len(entry[0]))
+
+    def guess(self, text: str) -> tuple[str, str]:
+        if text.startswith("[VIDEO_TITLE]"):
+            title, _, _ = self.parse_block(text)
+            return "youtube", title
+        opening = text[:INFER_CHARS].lower()
+        for lowered, category, aspect in self.aspects:
+            if lowered in opening:
+                return category, aspect
+        return "", ""
+
+
+class Catalog:
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def _source(self, path: str, kind: str) -> tuple:
+        row = self.connection.execute("SELECT id, ingested, size, tail_hash FROM sources WHERE path = ?",
+                                      (path,)).fetchone()
+        if row is None:
+            source_id = self.connection.execute("INSERT INTO sources (path, kind) VALUES (?, ?)",
+                                                (path, kind)).lastrowid
+            return source_id, 0, 0, None
+        return row
+
+    def _insert(self, rows: list, texts: list):
+        ids = []
+        cursor = self.connection.cursor()
+        for row in rows:
+            ids.append(cursor.execute("INSERT INTO stories (source_id, position, offset, length, category, aspect, "
+                                      "starter, chars, timestamp, cached) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                      row).lastrowid)
+        cursor.executemany("INSERT INTO stories_fts (rowid, text) VALUES (?, ?)", zip(ids, texts))
+        counts = {}
+        for row in rows:
+            key = (row[4], row[5], row[6])
+            stories, chars = counts.get(key, (0, 0))
+            counts[key] = (stories + 1, chars + row[7])
+        cursor.executemany("INSERT INTO cell_counts (category, aspect, starter, stories, chars) VALUES (?, ?, ?, ?, ?) "
+                           "ON CONFLICT (category, aspect, starter) DO UPDATE SET "
+                           "stories = stories + excluded.stories, chars = chars + excluded.chars",
+                           [(*key, stories, chars) for key, (stories, chars) in counts.items()])
+
+    def _ingest_segment(self, path: str) -> int:
+        # Story store segments are append-only, so only the bytes after the last ingested line are read
+        source_id, ingested, _, _ = self._source(path, "jsonl")
+        size = os.path.getsize(path)
+        if size < ingested:
+            raise ValueError(f"{path} is shorter than when it was catalogued; rebuild the catalog")
+        added = 0
+        rows, texts = [], []
+        with open(path, 'rb') as f:
+            f.seek(ingested)
+            offset = ingested
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                record = json.loads(line)
+                rows.append((source_id, record.get("seq", 0), offset, len(line), record.get("category") or "",
+                             record.get("aspect") or "", record.get("starter") or "",
+                             record.get("chars", len(record["text"])), record.get("timestamp"),
+                             int(bool(record.get("cached")))))
+                texts.append(record["text"])
+                offset += len(line)
+                if len(rows) >= INSERT_BATCH:
+                    self._insert(rows, texts)
+                    added += len(rows)
+                    rows, texts = [], []
+        if rows:
+            self._insert(rows, texts)
+            added += len(rows)
+        self.connection.execute("UPDATE sources SET ingested = ?, size = ? WHERE id = ?", (offset, size, source_id))
+        return added
+
+    def _ingest_text(self, path: str, guesser: MetadataGuesser) -> int:
+        # Text corpora are finished exports: catalogued once, and only checked for changes afterwards
+        source_id, ingested, old_size, old_hash = self._source(path, "text")
+        size = os.path.getsize(path)
+        if ingested:
+            if size != old_size or tail_hash(path, size) != old_hash:
+                raise ValueError(f"{path} changed since it was catalogued; rebuild the catalog")
+            return 0
+        rows, texts = [], []
+        added = 0
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(path)))
+        with CorpusReader(path, strip_eos=False) as reader:
+            for position, text in enumerate(reader):
+                category, aspect = guesser.guess(text)
+                rows.append((source_id, position, None, None, category, aspect, "", len(text), timestamp, 0))
+                texts.append(text)
+                if len(rows) >= INSERT_BATCH:
+                    self._insert(rows, texts)
+                    added += len(rows)
+                    rows, texts = [], []
+        if rows:
+            self._insert(rows, texts)
+            added += len(rows)
+        self.connection.execute("UPDATE sources SET ingested = ?, size = ?, tail_hash = ? WHERE id = ?",
+                                (added, size, tail_hash(path, size), source_id))
+        return added
+
+    def ingest(self, paths: List[str], cells: List[tuple] = ()) -> int:
+        # tokenize_shards pulls in numpy; only needed when stories are ingested
+        from tokenize_shards import expand_sources
+        guesser = MetadataGuesser(cells)
+        added = 0
+        for path in expand_sources(paths):
+            if not os.path.exists(path):
+                continue
+            with self.connection:
+                if path.endswith(".jsonl"):
+                    added += self._ingest_segment(path)
+                else:
+                    added += self._ingest_text(path, guesser)
+        return added
+
+    def sync_store(self, stories) -> int:
+        # Called at every checkpoint; the store has just been flushed
+        return self.ingest(stories.segments)
+
+    def rebuild(self, cells: List[tuple] = ()) -> int:
+        paths = [row[0] for row in self.connection.execute("SELECT path FROM sources ORDER BY id")]
+        with self.connection:
+            for table in ("stories_fts", "stories", "cell_counts", "sources"):
+                self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+        self.connection.executescript(SCHEMA)
+        return self.ingest([path for path in paths if os.path.exists(path)], cells)
+
+    @staticmethod
+    def _where(filters: Dict, query: Optional[str]) -> tuple[str, list]:
+        clauses, params = [], []
+        for name in FILTERS:
+            if filters.get(name) is not None:
+                clauses.append(f"s.{name} = ?")
+                params.append(filters[name])
+        if query:
+            clauses.append("s.id IN (SELECT rowid FROM stories_fts WHERE stories_fts MATCH ?)")
+            params.append(query)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, query: Optional[str] = None, **filters) -> int:
+        if query is None:
+            # Served from the per-cell totals, not the stories table
+            clauses = [f"{name} = ?" for name in FILTERS if filters.get(name) is not None]
+            params = [filters[name] for name in FILTERS if filters.get(name) is not None]
+            where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+            return self.connection.execute(f"SELECT IFNULL(SUM(stories), 0) FROM cell_counts{where}",
+                                           params).fetchone()[0]
+        where, params = self._where(filters, query)
+        return self.connection.execute(f"SELECT COUNT(*) FROM stories s{where}", params).fetchone()[0]
+
+    def counts(self, by: tuple = ("category",), **filters) -> List[tuple]:
+        # The columns are spliced into the SQL, so only the filter columns are accepted
+        unknown = [name for name in by if name not in FILTERS]
+        if unknown or not by:
+            raise ValueError(f"Can only group by {', '.join(FILTERS)}, not {', '.join(unknown) or 'nothing'}")
+        columns = ", ".join(by)
+        clauses = [f"{name} = ?" for name in FILTERS if filters.get(name) is not None]
+        params = [filters[name] for name in FILTERS if filters.get(name) is not None]
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        return self.connection.execute(f"SELECT {columns}, SUM(stories), SUM(chars) FROM cell_counts{where} "
+                                       f"GROUP BY {columns} ORDER BY SUM(stories) DESC", params).fetchall()
+
+    def search(self, query: str, limit: int = 20, **filters) -> List[Dict]:
+        clauses = [f"s.{name} = ?" for name in FILTERS if filters.get(name) is not None]
+        params = [query] + [filters[name] for name in FILTERS if filters.get(name) is not None] + [limit]
+        extra = "".join(f" AND {clause}" for clause in clauses)
+        rows = self.connection.execute(
+            "SELECT s.id FROM stories_fts f JOIN stories s ON s.id = f.rowid "
+            f"WHERE stories_fts MATCH ?{extra} ORDER BY f.rank LIMIT ?", params).fetchall()
+        return self.records([row[0] for row in rows])
+
+    def ids(self, query: Optional[str] = None, **filters) -> List[int]:
+        where, params = self._where(filters, query)
+        return [row[0] for row in self.connection.execute(f"SELECT s.id FROM stories s{where} ORDER BY s.id", params)]
+
+    def sample(self, count: int, seed: int = None, query: Optional[str] = None, **filters) -> List[Dict]:
+        rng = random.Random(seed)
+        if query is None and not any(filters.get(name) is not None for name in FILTERS):
+            # Ids are dense, so an unfiltered sample never touches more than the sampled rows
+            total = self.connection.execute("SELECT IFNULL(MAX(id), 0) FROM stories").fetchone()[0]
+            return self.records(sorted(rng.sample(range(1, total + 1), min(count, total))))
+        ids = self.ids(query, **filters)
+        return self.records(sorted(rng.sample(ids, min(count, len(ids)))))
+
+    def records(self, ids: List[int]) -> List[Dict]:
+        return list(self.iter_records(ids))
+
+    def iter_records(self, ids: List[int], chunk: int = 500) -> Iterator[Dict]:
+        # Story store records come back whole; text corpus stories get the catalogued metadata
+        readers = {}
+        try:
+            for start in range(0, len(ids), chunk):
+                batch = ids[start:start + chunk]
+                marks = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    "SELECT s.id, src.path, src.kind, s.position, s.offset, s.length, s.category, s.aspect, "
+                    f"s.starter, s.chars, s.timestamp FROM stories s JOIN sources src ON src.id = s.source_id "
+                    f"WHERE s.id IN ({marks})", batch).fetchall()
+                by_id = {row[0]: row for row in rows}
+                for story_id in batch:
+                    row = by_id.get(story_id)
+                    if row is None:
+                        continue
+                    _, path, kind, position, offset, length, category, aspect, starter, chars, timestamp = row
+                    if path not in readers:
+                        readers[path] = open(path, 'rb') if kind == "jsonl" else CorpusReader(path, strip_eos=False)
+                    if kind == "jsonl":
+                        readers[path].seek(offset)
+                        record = json.loads(readers[path].read(length))
+                    else:
+                        record = {"seq": position + 1, "text": readers[path][position], "category": category or None,
+                                  "aspect": aspect or None, "starter": starter or None, "chars": chars,
+                                  "timestamp": timestamp}
+                    record["catalog_id"] = story_id
+                    yield record
+        finally:
+            for reader in readers.values():
+                reader.close()
+
+    def export(self, path: str, ids: List[int], fmt: str = "text") -> int:
+        # text: "---"-separated like stories.txt; jsonl: story store records. tokenize_shards.py reads both
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}, expected one of {list(EXPORT_FORMATS)}")
+        tmp_path = path + ".tmp"
+        written = 0
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in self.iter_records(ids):
+                if fmt == "jsonl":
+                    record.pop("catalog_id")
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                else:
+                    if written:
+                        f.write(STORY_SEPARATOR)
+                    f.write(record["text"])
+                written += 1
+        os.replace(tmp_path, path)
+        return written
+
+    def close(self):
+        self.connection.close()
+
+
+def load_cells(script_path: str) -> List[tuple]:
+    from story_generator import load_generator_module
+    generator = load_generator_module(script_path).RocketLeagueGeminiGenerator()
+    return sorted({generator.build_request(index)[:2] for index in range(generator.cycle_length)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index stories by category/aspect with full-text search")
+    parser.add_argument("--db", default="catalog.sqlite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="Catalogue story store directories and text corpora")
+    ingest.add_argument("sources", nargs="+")
+    ingest.add_argument("--infer-from", action="append", default=[], metavar="SCRIPT",
+                        help="Generator script whose categories/aspects are matched in text corpus stories")
+    ingest.add_argument("--rebuild", action="store_true", help="Drop the index and catalogue every source again")
+
+    for name, help_text in (("count", "Number of stories matching the filters"),
+                            ("search", "Best full-text matches"),
+                            ("sample", "Random stories matching the filters"),
+                            ("export", "Write the matching stories in a training format")):
+        command = commands.add_parser(name, help=help_text)
+        if name == "search":
+            command.add_argument("query")
+        elif name == "sample":
+            command.add_argument("count", type=int)
+            command.add_argument("--seed", type=int, default=None)
+        elif name == "export":
+            command.add_argument("path")
+            command.add_argument("--format", choices=EXPORT_FORMATS, default="text")
+        if name != "search":
+            command.add_argument("--query", default=None, help="FTS5 query, e.g. 'NEAR(boost starve, 5)'")
+        command.add_argument("--category", default=None)
+        command.add_argument("--aspect", default=None)
+        command.add_argument("--starter", default=None)
+        if name == "count":
+            command.add_argument("--by", default=None, help=f"Group by these columns ({', '.join(FILTERS)}), "
+                                                            "e.g. category,aspect")
+        if name == "search":
+            command.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    catalog = Catalog(args.db)
+    start = time.perf_counter()
+    if args.command == "ingest":
+        cells = [cell for script in args.infer_from for cell in load_cells(script)]
+        if args.rebuild:
+            catalog.rebuild(cells)
+        added = catalog.ingest(args.sources, cells)
+        logger.info(f"Catalogued {added:,} new stories in {time.perf_counter() - start:.1f}s "
+                    f"({catalog.count():,} in total)")
+        catalog.close()
+        return
+
+    filters = {name: getattr(args, name) for name in FILTERS}
+    if args.command == "count":
+        if args.by and args.query is None:
+            by = tuple(args.by.split(","))
+            if any(name not in FILTERS for name in by):
+                parser.error(f"--by takes a comma-separated list of {', '.join(FILTERS)}")
+            for row in catalog.counts(by, **filters):
+                print("\t".join(str(value) for value in row))
+        else:
+            print(catalog.count(args.query, **filters))
+    elif args.command == "search":
+        for record in catalog.search(args.query, args.limit, **filters):
+            print(f"#{record['catalog_id']} [{record.get('category')} / {record.get('aspect')}] "
+                  f"{record['text'][:200]!r}")
+    elif args.command == "sample":
+        for record in catalog.sample(args.count, args.seed, args.query, **filters):
+            print(json.dumps(record, ensure_ascii=False))
+    elif args.command == "export":
+        written = catalog.export(args.path, catalog.ids(args.query, **filters), args.format)
+        logger.info(f"Exported {written:,} stories to {args.path}")
+    logger.debug(f"{args.command} took {(time.perf_counter() - start) * 1000:.1f}ms")
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
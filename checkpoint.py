@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+COUNTER_KEYS = ("stories_generated", "characters_generated", "last_aspect_index")
+
+
+def atomic_write_json(path: str, data: Dict):
+    # Write-then-rename: readers see either the old file or the new one, never a truncated mix
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def read_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError:
+        logger.warning(f"Ignoring unreadable checkpoint {path}")
+        return None
+
+
+def repair_tail(path: str):
+    # A crash mid-append leaves a partial last line; drop it so the log ends on a record boundary
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - 64 * 1024)
+            f.seek(start)
+            block = f.read(position - start)
+            newline = block.rfind(b'\n')
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            f.truncate(position)
+            logger.warning(f"Dropped {end - position} bytes of a partial record from {path}")
+
+
+def read_last_line(path: str) -> Optional[bytes]:
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return None
+        chunk = 4096
+        while True:
+            start = max(0, end - chunk)
+            f.seek(start)
+            block = f.read(end - start)
+            newline = block.rfind(b'\n', 0, len(block) - 1)
+            if newline != -1:
+                return block[newline + 1:]
+            if start == 0:
+                return block
+            chunk *= 2
+
+
+def recover_counters(state_file: str, store=None) -> Tuple[Dict, str]:
+    # Every story record carries the counters after it was accepted, so the tail of the
+    # store is the write-ahead log; the JSON snapshot only covers stores without counters
+    if store is not None:
+        tail = store.tail_record()
+        if tail is not None and "state" in tail:
+            return dict(tail["state"]), "log"
+    state = read_json(state_file)
+    if state is not None and all(key in state for key in COUNTER_KEYS):
+        return state, "snapshot"
+    return {}, "none"
@@ -0,0 +1,134 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable
+
+from multi_story import PackedResponseError
+from rate_limiter import RateLimiter
+from response_cache import CacheMiss
+from retry_policy import RETRYABLE, AIMDController
+
+logger = logging.getLogger(__name__)
+
+# Gemini output tokens average ~4 characters; used to reserve rate-limit capacity before a call
+CHARS_PER_TOKEN_RESERVE = 4
+
+
+class ConcurrentGenerationEngine:
+    def __init__(self, generator, max_concurrency: int = 8, requests_per_minute: float = 60,
+                 chars_per_minute: float = None):
+        self.generator = generator
+        self.max_concurrency = max_concurrency
+        self.limiter = RateLimiter(requests_per_minute, chars_per_minute)
+        self.ledger = generator.ledger
+        # Covers every candidate / packed story of a request
+        self.max_output_tokens = generator.max_request_output_tokens()
+        self.reserve_chars = (
+            self.max_output_tokens * CHARS_PER_TOKEN_RESERVE
+            + len(getattr(generator, "EOS_TOKEN", ""))
+        )
+        # Additive increase while calls succeed, halve on every 429
+        self.controller = AIMDController(initial=max(1, max_concurrency // 2), maximum=max_concurrency)
+        self.requests_sent = 0
+        self.requests_failed = 0
+        # List positions of requests that failed with a retryable error, sent again before new positions
+        self.retry_positions = deque()
+
+    def _call(self, prompt: str) -> tuple[list, object, object]:
+        # Errors left after the retry policy are raised from future.result() and handled with the request
+        with self.generator.metrics.phase("api"):
+            return self.generator.retry_policy.call(lambda: self.generator.call_batch(prompt), self.controller)
+
+    def run(self, on_batch: Callable[[list, int], None], max_requests: int = None):
+        # on_batch receives the (story, chars, category, aspect, cached, fields) tuples of one request
+        # and the number of list positions the request covered
+        next_index = self.generator.last_aspect_index
+        in_flight = {}
+        pending = None
+        budget_exhausted = False
+        replay_misses = 0
+        metrics = self.generator.metrics
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            while True:
+                while not budget_exhausted and len(in_flight) < self.controller.limit:
+                    if max_requests is not None and self.requests_sent >= max_requests:
+                        break
+                    if pending is None:
+                        with metrics.phase("prompt"):
+                            if self.retry_positions:
+                                # The shuffled list is deterministic, so the same position rebuilds the same request
+                                index = self.retry_positions.popleft()
+                                slots, prompt, span = self.generator.build_batch(index, reserve=False)
+                            else:
+                                index = next_index
+                                slots, prompt, span = self.generator.build_batch(next_index)
+                                next_index += span
+                        try:
+                            with metrics.phase("cache"):
+                                cached = self.generator.cached_batch(slots)
+                        except CacheMiss:
+                            # Replay-only: skip prompts that were never answered, stop after a full cycle of misses
+                            self.generator.release_batch(slots, skipped=True)
+                            replay_misses += span
+                            budget_exhausted = replay_misses >= self.generator.cycle_length
+                            continue
+                        replay_misses = 0
+                        if cached is not None:
+                            on_batch(cached, span)
+                            continue
+                        pending = (slots, prompt, span, index)
+
+                    # Reserve the worst case (full max_output_tokens) so in-flight calls can never overspend
+                    reserved_cost = self.ledger.worst_case_cost(pending[1], self.max_output_tokens)
+                    if not self.ledger.try_reserve(reserved_cost):
+                        # Outstanding reservations may still be released; only stop once nothing is in flight
+                        budget_exhausted = not in_flight
+                        break
+                    self.limiter.acquire(self.reserve_chars)
+                    slots, prompt, span, index = pending
+                    pending = None
+                    future = pool.submit(self._call, prompt)
+                    in_flight[future] = (slots, prompt, span, index, reserved_cost)
+                    self.requests_sent += 1
+                    metrics.count("requests")
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    slots, prompt, span, index, reserved_cost = in_flight.pop(future)
+                    try:
+                        texts, usage, stream_stats = future.result()
+                    except Exception as e:
+                        self.ledger.release(reserved_cost)
+                        self.limiter.reconcile(self.reserve_chars, 0)
+                        self.requests_failed += 1
+                        error_class = self.generator.fail_batch(slots, e)
+                        if error_class in RETRYABLE and self.generator.scheduler is None:
+                            # Other requests already moved past this span; without a retry it would only come
+                            # back a full pass later. Re-queued stories (span 0) go back to the generator's queue
+                            if span:
+                                self.retry_positions.append(index)
+                            else:
+                                self.generator.retry_slots.extend(slots)
+                        else:
+                            # Skipped like in the sequential loop; the scheduler already took its cells back
+                            on_batch([], span)
+                        continue
+                    results = None
+                    try:
+                        with metrics.phase("validation"):
+                            results = self.generator.complete_batch(slots, prompt, texts, usage, stream_stats)
+                    except PackedResponseError as e:
+                        logger.warning(f"Discarding packed response: {e}")
+                    self.ledger.release(reserved_cost)
+                    self.limiter.reconcile(self.reserve_chars, sum(result[1] for result in results or []))
+
+                    if results is None:
+                        self.requests_failed += 1
+                        self.generator.release_batch(slots)
+                        continue
+                    # Empty when the validator rejected every story; those were re-queued by the generator
+                    on_batch(results, span)
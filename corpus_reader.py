@@ -0,0 +1,165 @@
+import argparse
+import hashlib
+import mmap
+import os
+from array import array
+from typing import Iterator, Optional
+
+from checkpoint import atomic_write_json, read_json
+
+# "---" joins stories in the Gemini/OpenAI outputs; "EOS" and "[EOS]" terminate stories
+# in the v1 and YouTube outputs
+SEPARATORS = {
+    "---": b"\n\n---\n\n",
+    "EOS": b" EOS",
+    "[EOS]": b"[EOS]",
+}
+DETECT_BYTES = 16 * 1024 * 1024
+INDEX_VERSION = 1
+
+
+class CorpusReader:
+    def __init__(self, path: str, separator: Optional[str] = None, index_path: Optional[str] = None,
+                 strip_eos: bool = True):
+        self.path = path
+        self.index_path = index_path or path + ".idx"
+        self.meta_path = self.index_path + ".json"
+        self.strip_eos = strip_eos
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+        meta = read_json(self.meta_path)
+        if separator is None:
+            separator = meta["separator"] if meta else self._detect_separator()
+        if separator not in SEPARATORS:
+            raise ValueError(f"Unknown separator {separator!r}, expected one of {list(SEPARATORS)}")
+        self.separator = separator
+        self.sep_bytes = SEPARATORS[separator]
+
+        # Flat array of (start, end) byte offsets for every closed story
+        self.offsets = array('Q')
+        self.tail_start = 0
+        if not self._load_index(meta):
+            self._scan(0)
+            self._save_index()
+
+    def _detect_separator(self) -> str:
+        if self.mm is None:
+            return "---"
+        head = self.mm[:DETECT_BYTES]
+        for name in ("---", "[EOS]", "EOS"):
+            if SEPARATORS[name] in head:
+                return name
+        return "---"
+
+    def _prefix_hash(self, size: int) -> str:
+        return hashlib.sha1(self.mm[max(0, size - 4096):size] if self.mm else b"").hexdigest()
+
+    def _load_index(self, meta) -> bool:
+        if (not meta or meta.get("version") != INDEX_VERSION or meta.get("separator") != self.separator
+                or meta["size"] > self.size or not os.path.exists(self.index_path)
+                or meta["prefix_hash"] != self._prefix_hash(meta["size"])):
+            return False
+        with open(self.index_path, 'rb') as f:
+            self.offsets.fromfile(f, meta["count"] * 2)
+        self.tail_start = meta["tail_start"]
+        if meta["size"] < self.size:
+            # Appended since the last scan: only the open tail story and new bytes are scanned
+            self._scan(self.tail_start)
+            self._save_index()
+        return True
+
+    def _scan(self, start: int):
+        if self.mm is None:
+            return
+        find = self.mm.find
+        sep = self.sep_bytes
+        sep_len = len(sep)
+        position = start
+        while True:
+            match = find(sep, position)
+            if match == -1:
+                break
+            self.offsets.append(position)
+            self.offsets.append(match)
+            position = match + sep_len
+        self.tail_start = position
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            self.offsets.tofile(f)
+        os.replace(tmp_path, self.index_path)
+        atomic_write_json(self.meta_path, {
+            "version": INDEX_VERSION,
+            "separator": self.separator,
+            "size": self.size,
+            "count": len(self.offsets) // 2,
+            "tail_start": self.tail_start,
+            "prefix_hash": self._prefix_hash(self.size),
+        })
+
+    def _has_tail(self) -> bool:
+        if self.mm is None or self.tail_start >= self.size:
+            return False
+        return bool(self.mm[self.tail_start:self.size].strip())
+
+    def __len__(self) -> int:
+        return len(self.offsets) // 2 + (1 if self._has_tail() else 0)
+
+    def span(self, index: int) -> tuple[int, int]:
+        closed = len(self.offsets) // 2
+        if index < 0:
+            index += len(self)
+        if 0 <= index < closed:
+            return self.offsets[2 * index], self.offsets[2 * index + 1]
+        if index == closed and self._has_tail():
+            return self.tail_start, self.size
+        raise IndexError(f"story {index} out of range")
+
+    def _decode(self, start: int, end: int) -> str:
+        text = self.mm[start:end].decode('utf-8', errors='replace')
+        if self.separator == "---":
+            if self.strip_eos and text.endswith(" EOS"):
+                text = text[:-4]
+            return text
+        return text.strip()
+
+    def __getitem__(self, index: int) -> str:
+        return self._decode(*self.span(index))
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self.offsets) // 2):
+            yield self._decode(self.offsets[2 * i], self.offsets[2 * i + 1])
+        if self._has_tail():
+            yield self._decode(self.tail_start, self.size)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index a story corpus and print its size or a single story")
+    parser.add_argument("path")
+    parser.add_argument("--separator", choices=list(SEPARATORS))
+    parser.add_argument("--story", type=int, help="Print story number N (1-based)")
+    args = parser.parse_args()
+
+    with CorpusReader(args.path, args.separator) as reader:
+        if args.story:
+            print(reader[args.story - 1])
+        else:
+            print(f"{args.path}: {len(reader):,} stories ({reader.separator!r} separated, {reader.size:,} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from checkpoint import read_json, read_last_line, repair_tail
+
+# USD per 1k units. Vertex bills Gemini 1.5 per character (whitespace excluded), OpenAI per token.
+PRICE_TABLES = {
+    "gemini-1.5-pro-001": {"unit": "chars", "input_per_1k": 0.0003125, "output_per_1k": 0.00125},
+    "gemini-1.5-pro-002": {"unit": "chars", "input_per_1k": 0.0003125, "output_per_1k": 0.00125},
+    "gemini-1.5-flash-001": {"unit": "chars", "input_per_1k": 0.00001875, "output_per_1k": 0.000075},
+    "gemini-1.5-flash-002": {"unit": "chars", "input_per_1k": 0.00001875, "output_per_1k": 0.000075},
+    "gpt-4": {"unit": "tokens", "input_per_1k": 0.03, "output_per_1k": 0.06},
+}
+CHARS_PER_TOKEN = 4
+# Batch prediction is billed at half the online price
+BATCH_DISCOUNT = 0.5
+WHITESPACE = re.compile(r"\s+")
+EMPTY_TOTALS = {"requests": 0, "stories": 0, "input_tokens": 0, "output_tokens": 0, "input_chars": 0, "output_chars": 0,
+                "cost": 0.0}
+
+
+def billable_chars(text: str) -> int:
+    return len(WHITESPACE.sub("", text))
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def load_price_tables(path: Optional[str] = None) -> Dict:
+    tables = dict(PRICE_TABLES)
+    if path:
+        tables.update(read_json(path) or {})
+    return tables
+
+
+class CostLedger:
+    def __init__(self, model_id: str, budget: float, price_tables: Dict = None, path: Optional[str] = None):
+        price_tables = price_tables or PRICE_TABLES
+        if model_id not in price_tables:
+            raise KeyError(f"No price table for {model_id}; pass one with --price-table")
+        self.model_id = model_id
+        self.budget = budget
+        self.prices = price_tables[model_id]
+        self.lock = threading.Lock()
+        self.path = path
+        self.file = None
+        self._load_totals()
+
+    def _load_totals(self):
+        self.totals = dict(EMPTY_TOTALS)
+        self.reserved = 0.0
+        # One JSON line per paid request, each carrying the running totals so resume reads only the tail
+        if self.path is not None:
+            if os.path.exists(self.path):
+                repair_tail(self.path)
+                line = read_last_line(self.path)
+                if line and line.endswith(b'\n'):
+                    self.totals.update(json.loads(line)["totals"])
+            self.file = open(self.path, 'a', encoding='utf-8')
+
+    @property
+    def spent(self) -> float:
+        return self.totals["cost"]
+
+    @property
+    def remaining(self) -> float:
+        return self.budget - self.totals["cost"]
+
+    def cost(self, input_units: int, output_units: int) -> float:
+        return (input_units * self.prices["input_per_1k"] + output_units * self.prices["output_per_1k"]) / 1000
+
+    def units(self, input_chars: int, output_chars: int, input_tokens: int, output_tokens: int) -> tuple[int, int]:
+        if self.prices["unit"] == "chars":
+            return input_chars, output_chars
+        return input_tokens, output_tokens
+
+    def worst_case_cost(self, prompt: str, max_output_tokens: int) -> float:
+        return self.cost(*self.units(billable_chars(prompt), max_output_tokens * CHARS_PER_TOKEN,
+                                     estimate_tokens(prompt), max_output_tokens))
+
+    def can_afford(self, amount: float) -> bool:
+        with self.lock:
+            return self.totals["cost"] + self.reserved + amount <= self.budget
+
+    def try_reserve(self, amount: float) -> bool:
+        with self.lock:
+            if self.totals["cost"] + self.reserved + amount > self.budget:
+                return False
+            self.reserved += amount
+            return True
+
+    def release(self, amount: float):
+        with self.lock:
+            self.reserved -= amount
+
+    def price_entry(self, prompt: str, response_text: str, usage=None, stories: int = 1,
+                    discount: float = 0.0) -> Dict:
+        input_tokens = getattr(usage, "prompt_token_count", None) if usage is not None else None
+        output_tokens = getattr(usage, "candidates_token_count", None) if usage is not None else None
+        estimated = input_tokens is None or output_tokens is None
+        if input_tokens is None:
+            input_tokens = estimate_tokens(prompt)
+        if output_tokens is None:
+            output_tokens = estimate_tokens(response_text)
+        input_chars = billable_chars(prompt)
+        output_chars = billable_chars(response_text)
+        return {
+            "model": self.model_id,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "input_chars": input_chars,
+            "output_chars": output_chars,
+            "stories": stories,
+            "estimated_tokens": estimated,
+            "cost": self.cost(*self.units(input_chars, output_chars, input_tokens, output_tokens)) * (1 - discount),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    def record(self, prompt: str, response_text: str, usage=None, stories: int = 1, discount: float = 0.0,
+               **metadata) -> Dict:
+        entry = self.price_entry(prompt, response_text, usage, stories, discount)
+        return self.append(entry, 1, metadata)
+
+    def open_balance(self, amount: float, stories: int = 0, **metadata) -> Dict:
+        # Spend from before the ledger existed (a legacy budget_used), carried over as one entry without usage
+        entry = dict(EMPTY_TOTALS, model=self.model_id, stories=stories, estimated_tokens=True, cost=amount,
+                     timestamp=time.strftime("%Y-%m-%d %H:%M:%S"))
+        del entry["requests"]
+        return self.append(entry, 0, metadata)
+
+    def append(self, entry: Dict, requests: int, metadata: Dict) -> Dict:
+        with self.lock:
+            totals = self.totals
+            for key in ("input_tokens", "output_tokens", "input_chars", "output_chars", "stories", "cost"):
+                totals[key] += entry[key]
+            totals["requests"] += requests
+            entry["totals"] = dict(totals)
+            entry.update(metadata)
+            if self.file is not None:
+                self.file.write(json.dumps(entry) + "\n")
+                self.file.flush()
+        return entry
+
+    def project(self, prompt: str, expected_output_chars: int, stories: int = None,
+                stories_per_request: int = 1) -> Dict:
+        input_chars = billable_chars(prompt)
+        expected_output_chars *= stories_per_request
+        # Billable output excludes whitespace, roughly one character in six for English prose
+        output_chars = int(expected_output_chars * 5 / 6)
+        per_request = self.cost(*self.units(input_chars, output_chars, estimate_tokens(prompt),
+                                            expected_output_chars // CHARS_PER_TOKEN))
+        per_story = per_request / stories_per_request
+        projection = {
+            "model": self.model_id,
+            "stories_per_request": stories_per_request,
+            "cost_per_story": per_story,
+            "input_share": self.cost(*self.units(input_chars, 0, estimate_tokens(prompt), 0)) / per_request,
+            "stories_in_remaining_budget": int(self.remaining // per_story) if per_story else None,
+        }
+        if stories is not None:
+            projection["cost_for_stories"] = per_story * stories
+        return projection
+
+    def summary(self) -> Dict:
+        with self.lock:
+            return dict(self.totals, budget=self.budget, remaining=self.budget - self.totals["cost"])
+
+    def sync(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
@@ -0,0 +1,155 @@
+import os
+import random
+import re
+import zlib
+from array import array
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class NearDuplicateIndex:
+    # 64 permutations in 8 bands of 8 rows: pairs above ~0.77 Jaccard share a band with high probability
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 8, shingle_size: int = 3,
+                 seed: int = 1, path: Optional[str] = None):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+                             for _ in range(num_perm)]
+        # Column vectors, so one broadcast hashes every shingle under every permutation
+        a = np.array([a for a, _ in self.permutations], dtype=np.uint64)[:, None]
+        self.a_high, self.a_low = a >> np.uint64(32), a & np.uint64(MAX_HASH)
+        self.b = np.array([b for _, b in self.permutations], dtype=np.uint64)[:, None]
+
+        self.ids = array('Q')
+        self.groups = array('Q')
+        self.signatures = array('Q')
+        self.buckets = {}
+        self.max_id = 0
+
+        # Signatures are appended to a sidecar file so resume does not re-hash the corpus
+        self.path = path
+        self.file = None
+        if path is not None:
+            self._load(path)
+            self.file = open(path, 'ab')
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def group_id(category: Optional[str], aspect: Optional[str]) -> int:
+        return zlib.crc32(f"{category}\x1f{aspect}".encode('utf-8'))
+
+    def signature(self, text: str) -> array:
+        words = WORD_PATTERN.findall(text.lower())
+        if words and words[-1] == "eos":
+            words.pop()
+        size = self.shingle_size
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), np.uint64, len(shingles))
+        signature = array('Q')
+        signature.frombytes((self.hash_min(hashes) & np.uint64(MAX_HASH)).tobytes())
+        return signature
+
+    def hash_min(self, hashes: np.ndarray) -> np.ndarray:
+        # min((a * h + b) % p) per permutation, exact in uint64: a * h (up to 93 bits) is split at bit 32 and
+        # reduced with 2^61 = 1 (mod p), so signatures match the ones already stored in the sidecar file
+        prime = np.uint64(MERSENNE_PRIME)
+        high = self.a_high * hashes
+        low = self.a_low * hashes
+        value = ((high >> np.uint64(29)) + ((high & np.uint64((1 << 29) - 1)) << np.uint64(32))
+                 + (low & prime) + (low >> np.uint64(61)) + self.b)
+        value = (value & prime) + (value >> np.uint64(61))
+        value = np.where(value >= prime, value - prime, value)
+        return value.min(axis=1)
+
+    def _band_keys(self, signature: array, group: int):
+        rows = self.rows
+        for band in range(self.bands):
+            yield hash((group, band, tuple(signature[band * rows:(band + 1) * rows])))
+
+    def similarity(self, signature: array, position: int) -> float:
+        offset = position * self.num_perm
+        stored = self.signatures[offset:offset + self.num_perm]
+        return sum(1 for x, y in zip(signature, stored) if x == y) / self.num_perm
+
+    def query(self, signature: array, group: int) -> Optional[Tuple[int, float]]:
+        best = None
+        seen = set()
+        for key in self._band_keys(signature, group):
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                continue
+            for position in (bucket if isinstance(bucket, list) else (bucket,)):
+                if position in seen or self.groups[position] != group:
+                    continue
+                seen.add(position)
+                score = self.similarity(signature, position)
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (self.ids[position], score)
+        return best
+
+    def _index(self, story_id: int, signature: array, group: int):
+        position = len(self.ids)
+        self.ids.append(story_id)
+        self.groups.append(group)
+        self.signatures.extend(signature)
+        self.max_id = max(self.max_id, story_id)
+        for key in self._band_keys(signature, group):
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                self.buckets[key] = position
+            elif isinstance(bucket, list):
+                bucket.append(position)
+            else:
+                self.buckets[key] = [bucket, position]
+
+    def add(self, story_id: int, signature: array, group: int):
+        self._index(story_id, signature, group)
+        if self.file is not None:
+            array('Q', (story_id, group)).tofile(self.file)
+            signature.tofile(self.file)
+            self.file.flush()
+
+    def _load(self, path: str):
+        if not os.path.exists(path):
+            return
+        entry = array('Q')
+        entry_size = (self.num_perm + 2) * entry.itemsize
+        with open(path, 'rb') as f:
+            data = f.read()
+        usable = len(data) - len(data) % entry_size
+        entry.frombytes(data[:usable])
+        width = self.num_perm + 2
+        for start in range(0, len(entry), width):
+            self._index(entry[start], entry[start + 2:start + width], entry[start + 1])
+        if usable != len(data):
+            # Drop a partially written entry left by a crash
+            with open(path, 'r+b') as f:
+                f.truncate(usable)
+
+    def bulk_load(self, records: Iterable[Dict]) -> int:
+        loaded = 0
+        for record in records:
+            if record.get("seq", 0) <= self.max_id:
+                continue
+            self.add(record["seq"], self.signature(record["text"]),
+                     self.group_id(record.get("category"), record.get("aspect")))
+            loaded += 1
+        return loaded
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,263 @@
+import collections
+import math
+import random
+import sys
+import threading
+import time
+import types
+
+from multi_story import HEADER_PATTERN
+from story_generator import load_generator_module
+from validator import PROMPT_OPENING, PROMPT_SECTION
+
+FILLER_WORDS = (
+    "rotate back post while your teammate challenges and keep enough boost for the next "
+    "aerial so the defense stays compact and the ball is cleared toward the corner"
+).split()
+
+
+LATENCY_DISTRIBUTIONS = ("uniform", "lognormal", "exponential")
+
+
+class FakeAPIError(Exception):
+    code = 500
+
+
+class ResourceExhausted(FakeAPIError):
+    code = 429
+
+
+class ServiceUnavailable(FakeAPIError):
+    code = 503
+
+
+class InvalidArgument(FakeAPIError):
+    code = 400
+
+
+class FakeUsageMetadata:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeCandidate:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, texts, prompt: str = ""):
+        texts = [texts] if isinstance(texts, str) else texts
+        self.candidates = [FakeCandidate(text) for text in texts]
+        self.usage_metadata = FakeUsageMetadata(max(1, len(prompt) // 4),
+                                                sum(max(1, len(text) // 4) for text in texts))
+
+    @property
+    def text(self) -> str:
+        # Same as the SDK: the shortcut only works for single-candidate responses
+        if len(self.candidates) != 1:
+            raise ValueError("The response has multiple candidates; use response.candidates")
+        return self.candidates[0].text
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name: str = "fake-gemini", latency: float = 0.0, jitter: float = 0.0,
+                 response_chars: int = 2000, seed: int = None, throttle_rate: float = 0.0,
+                 transient_rate: float = 0.0, permanent_rate: float = 0.0, max_concurrent: int = None,
+                 malformed_rate: float = 0.0, chunk_chars: int = 120, chunk_delay: float = 0.0,
+                 latency_distribution: str = "uniform", response_chars_sigma: float = 0.0,
+                 quota: int = None, quota_window: float = 60.0, follow_format: bool = False,
+                 off_format_rate: float = 0.0):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"latency_distribution must be one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.model_name = model_name
+        self.latency = latency
+        self.jitter = jitter
+        # uniform: latency +/- jitter; lognormal: median latency, jitter is sigma of the log;
+        # exponential: mean latency (a long tail of slow calls)
+        self.latency_distribution = latency_distribution
+        self.response_chars = response_chars
+        # Story length is lognormal around response_chars when sigma > 0
+        self.response_chars_sigma = response_chars_sigma
+        # Request quota like the Vertex per-minute one: calls beyond quota in a sliding window get a 429
+        self.quota = quota
+        self.quota_window = quota_window
+        self.recent_calls = collections.deque()
+        self.random = random.Random(seed)
+        self.throttle_rate = throttle_rate
+        self.transient_rate = transient_rate
+        self.permanent_rate = permanent_rate
+        self.max_concurrent = max_concurrent
+        # Share of packed responses that drop a story header, to exercise the strict parser
+        self.malformed_rate = malformed_rate
+        # Answer with the opening and numbered sections the prompt asks for, except for off_format_rate of
+        # the stories, which come back as plain text for the response validator to reject
+        self.follow_format = follow_format
+        self.off_format_rate = off_format_rate
+        # Streaming: latency is the time to the first chunk, then chunk_delay per chunk
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.streamed_chars = 0
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def _prompt_text(self, contents) -> str:
+        if isinstance(contents, str):
+            return contents
+        return " ".join(part.get('text', '') for message in contents for part in message.get('parts', []))
+
+    def _sample_latency(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        if self.latency_distribution == "lognormal":
+            return self.random.lognormvariate(math.log(self.latency), self.jitter)
+        if self.latency_distribution == "exponential":
+            return self.random.expovariate(1 / self.latency)
+        return self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+
+    def _sample_chars(self) -> int:
+        if self.response_chars_sigma <= 0:
+            return self.response_chars
+        return max(1, int(self.random.lognormvariate(math.log(self.response_chars), self.response_chars_sigma)))
+
+    def _over_quota(self) -> bool:
+        if self.quota is None:
+            return False
+        now = time.monotonic()
+        while self.recent_calls and now - self.recent_calls[0] >= self.quota_window:
+            self.recent_calls.popleft()
+        if len(self.recent_calls) >= self.quota:
+            return True
+        self.recent_calls.append(now)
+        return False
+
+    def _filler(self, target: int) -> str:
+        words = []
+        length = 0
+        while length < target:
+            word = self.random.choice(FILLER_WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[:target]
+
+    def _story_text(self, prompt: str) -> str:
+        return self._filler(self._sample_chars())
+
+    def _formatted_text(self, prompt: str, aspect: str = None) -> str:
+        target = self._sample_chars()
+        sections = PROMPT_SECTION.findall(prompt)
+        if not sections or self.random.random() < self.off_format_rate:
+            return self._filler(target)
+        parts = []
+        opening = PROMPT_OPENING.search(prompt)
+        if opening:
+            parts.append(opening.group(1).replace("<scenario>", aspect or "") + " " + self._filler(80))
+        share = max(1, target // len(sections))
+        parts.extend(f"{number}. {title}\n{self._filler(share)}" for number, title in sections)
+        return "\n\n".join(parts)
+
+    def _packed_text(self, headers: list, prompt: str = "") -> str:
+        # Each section names its topic so callers can check the split kept the attribution
+        if self.follow_format:
+            sections = [f"{header}\n{self._formatted_text(prompt, header.split('/', 1)[1].strip())}"
+                        for header in headers]
+        else:
+            sections = [f"{header}\nNotes on {header.split(':', 1)[1].strip()}. {self._story_text('')}"
+                        for header in headers]
+        if self.random.random() < self.malformed_rate:
+            sections[self.random.randrange(len(sections))] = self._story_text('')
+        return "\n\n".join(sections)
+
+    def _response_texts(self, prompt: str, generation_config) -> list:
+        # A packed prompt lists the headers the sections must echo back
+        headers = [match.group(0).strip() for match in HEADER_PATTERN.finditer(prompt)]
+        if headers:
+            return [self._packed_text(headers, prompt)]
+        count = (generation_config or {}).get('candidate_count', 1)
+        if self.follow_format:
+            return [self._formatted_text(prompt) for _ in range(count)]
+        return [self._story_text(prompt) for _ in range(count)]
+
+    def _injected_error(self) -> Exception:
+        # Quota errors come back immediately; server errors only after the usual latency
+        if self.max_concurrent is not None and self.in_flight > self.max_concurrent:
+            return ResourceExhausted("429 Quota exceeded (too many concurrent requests)")
+        if self._over_quota():
+            return ResourceExhausted("429 Quota exceeded (request quota)")
+        roll = self.random.random()
+        if roll < self.throttle_rate:
+            return ResourceExhausted("429 Quota exceeded")
+        roll -= self.throttle_rate
+        if roll < self.transient_rate:
+            return ServiceUnavailable("503 Service unavailable")
+        roll -= self.transient_rate
+        if roll < self.permanent_rate:
+            return InvalidArgument("400 Request contains an invalid argument")
+        return None
+
+    def _stream(self, text: str, prompt: str):
+        chunks = [text[start:start + self.chunk_chars] for start in range(0, len(text), self.chunk_chars)]
+        for number, chunk in enumerate(chunks):
+            if number and self.chunk_delay > 0:
+                time.sleep(self.chunk_delay)
+            with self.lock:
+                self.streamed_chars += len(chunk)
+            response = FakeResponse(chunk, prompt)
+            # Usage only arrives with the final chunk
+            if number < len(chunks) - 1:
+                response.usage_metadata = None
+            else:
+                response.usage_metadata = FakeUsageMetadata(max(1, len(prompt) // 4), max(1, len(text) // 4))
+            yield response
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False, **kwargs):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            error = self._injected_error()
+            delay = self._sample_latency()
+        try:
+            if isinstance(error, ResourceExhausted):
+                raise error
+            if delay > 0:
+                time.sleep(delay)
+            if error is not None:
+                raise error
+            prompt = self._prompt_text(contents)
+            with self.lock:
+                texts = self._response_texts(prompt, generation_config)
+            if stream:
+                return self._stream(texts[0], prompt)
+            return FakeResponse(texts, prompt)
+        except FakeAPIError:
+            with self.lock:
+                self.errors += 1
+            raise
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def install():
+    # Lets the generator scripts import without the Vertex SDK; the model is swapped out afterwards
+    if "vertexai.generative_models._generative_models" in sys.modules:
+        return
+    vertexai = types.ModuleType("vertexai")
+    generative_models = types.ModuleType("vertexai.generative_models")
+    private = types.ModuleType("vertexai.generative_models._generative_models")
+    private.GenerativeModel = FakeGenerativeModel
+    generative_models._generative_models = private
+    generative_models.GenerativeModel = FakeGenerativeModel
+    vertexai.generative_models = generative_models
+    sys.modules["vertexai"] = vertexai
+    sys.modules["vertexai.generative_models"] = generative_models
+    sys.modules["vertexai.generative_models._generative_models"] = private
+
+
+def load_generator_script(path: str, module_name: str = "rocket_league_generator"):
+    install()
+    return load_generator_module(path, module_name)
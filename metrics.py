@@ -0,0 +1,184 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Seconds; spans a cache hit up to a slow, retried API call
+LATENCY_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# prompt: building the request, cache: response cache lookups, api: the model call including retries,
+# validation: splitting/clipping responses, format checks and the dedup check,
+# persistence: story log and checkpoints, sleep: the pause between sequential requests
+PHASES = ("prompt", "cache", "api", "validation", "persistence", "sleep")
+COUNTERS = ("requests", "stories", "cached_stories", "characters", "duplicates", "rejected_responses",
+            "invalid_stories", "requeued_stories")
+PREFIX = "rocket_league"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+class RunMetrics:
+    # Counters and histograms are plain ints/floats behind one lock: cheap enough to stay on for every request
+    def __init__(self, interval: float = 30.0):
+        self.interval = interval
+        self.ledger = None
+        self.retry_policy = None
+        self.snapshot_path = None
+        self.prometheus_path = None
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.last_flush = self.start
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # Stories the response validator turned away, by reason
+        self.invalid_reasons = {}
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+    def open(self, output_dir: str, ledger=None, retry_policy=None):
+        self.snapshot_path = os.path.join(output_dir, "metrics.jsonl")
+        self.prometheus_path = os.path.join(output_dir, "metrics.prom")
+        self.ledger = ledger
+        self.retry_policy = retry_policy
+        self.start = self.last_flush = time.monotonic()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, phase: str, seconds: float):
+        with self.lock:
+            self.phases[phase].observe(seconds)
+
+    def count(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] += value
+
+    def reject(self, reason: str):
+        with self.lock:
+            self.counters["invalid_stories"] += 1
+            self.invalid_reasons[reason] = self.invalid_reasons.get(reason, 0) + 1
+
+    def snapshot(self) -> Dict:
+        elapsed = time.monotonic() - self.start
+        with self.lock:
+            counters = dict(self.counters)
+            invalid_reasons = dict(self.invalid_reasons)
+            phases = {phase: histogram.to_dict() for phase, histogram in self.phases.items()}
+        snapshot = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "elapsed": round(elapsed, 3),
+            "counters": counters,
+            "invalid_reasons": invalid_reasons,
+            "phases": phases,
+            "chars_per_sec": round(counters["characters"] / elapsed, 3) if elapsed else 0.0,
+        }
+        if self.retry_policy is not None:
+            snapshot["errors"] = dict(self.retry_policy.error_counts)
+            snapshot["retries"] = self.retry_policy.retries
+        if self.ledger is not None:
+            snapshot["cost"] = round(self.ledger.spent, 6)
+            snapshot["budget_remaining"] = round(self.ledger.remaining, 6)
+            snapshot["cost_per_sec"] = round(self.ledger.spent / elapsed, 8) if elapsed else 0.0
+        return snapshot
+
+    def maybe_flush(self):
+        if self.snapshot_path is not None and time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self) -> Optional[Dict]:
+        if self.snapshot_path is None:
+            return None
+        self.last_flush = time.monotonic()
+        snapshot = self.snapshot()
+        with open(self.snapshot_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(snapshot) + "\n")
+        # The textfile collector may read at any moment, so the file is replaced, never rewritten in place
+        tmp_path = f"{self.prometheus_path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(prometheus_text(snapshot))
+        os.replace(tmp_path, self.prometheus_path)
+        return snapshot
+
+    def report(self) -> str:
+        snapshot = self.snapshot()
+        elapsed = snapshot["elapsed"] or 1.0
+        parts = [f"{phase} {data['sum']:.2f}s ({data['sum'] / elapsed:.0%})"
+                 for phase, data in snapshot["phases"].items() if data["count"]]
+        return "Time by phase: " + ", ".join(parts)
+
+
+def prometheus_text(snapshot: Dict) -> str:
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples: list):
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for suffix, labels, value in samples:
+            label_text = "{" + ",".join(f'{key}="{label}"' for key, label in labels.items()) + "}" if labels else ""
+            lines.append(f"{PREFIX}_{name}{suffix}{label_text} {value}")
+
+    for name, value in snapshot["counters"].items():
+        metric(f"{name}_total", "counter", f"{name.replace('_', ' ').capitalize()} so far", [("", {}, value)])
+    metric("invalid_stories_by_reason_total", "counter", "Stories rejected by the response validator",
+           [("", {"reason": reason}, count) for reason, count in snapshot["invalid_reasons"].items()])
+    metric("characters_per_second", "gauge", "Story characters per second of run time",
+           [("", {}, snapshot["chars_per_sec"])])
+
+    samples = []
+    for phase, data in snapshot["phases"].items():
+        cumulative = 0
+        for bound, count in data["buckets"].items():
+            cumulative += count
+            samples.append(("_bucket", {"phase": phase, "le": bound}, cumulative))
+        samples.append(("_sum", {"phase": phase}, data["sum"]))
+        samples.append(("_count", {"phase": phase}, data["count"]))
+    metric("phase_duration_seconds", "histogram", "Time spent per phase occurrence", samples)
+
+    if "errors" in snapshot:
+        metric("errors_total", "counter", "API errors by class",
+               [("", {"class": error_class}, count) for error_class, count in snapshot["errors"].items()])
+        metric("retries_total", "counter", "Retried API calls", [("", {}, snapshot["retries"])])
+    if "cost" in snapshot:
+        metric("cost_dollars_total", "counter", "Spend recorded in the cost ledger", [("", {}, snapshot["cost"])])
+        metric("budget_remaining_dollars", "gauge", "Budget left", [("", {}, snapshot["budget_remaining"])])
+        metric("cost_dollars_per_second", "gauge", "Spend per second of run time",
+               [("", {}, snapshot["cost_per_sec"])])
+    return "\n".join(lines) + "\n"
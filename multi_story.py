@@ -0,0 +1,48 @@
+import re
+from typing import List, Tuple
+
+# Gemini 1.5 limits for a single request
+MAX_CANDIDATES = 8
+MAX_OUTPUT_TOKENS = 8192
+
+# "### STORY 2: mechanics / ceiling shot execution"; markdown bold around the line is tolerated
+HEADER_PATTERN = re.compile(r"^[ \t]*\**[ \t]*#{1,6}[ \t]*STORY[ \t]+(\d+)[ \t]*:[ \t]*(.+?)[ \t]*\**[ \t]*$",
+                            re.MULTILINE)
+MIN_SECTION_CHARS = 100
+
+
+class PackedResponseError(ValueError):
+    pass
+
+
+def story_header(number: int, category: str, aspect: str) -> str:
+    return f"### STORY {number}: {category} / {aspect}"
+
+
+def _normalize(label: str) -> str:
+    return " ".join(label.replace("*", "").lower().split())
+
+
+def split_packed_response(text: str, requests: List[Tuple[str, str]],
+                          min_chars: int = MIN_SECTION_CHARS) -> List[str]:
+    # All or nothing: a response whose sections cannot be attributed with certainty is dropped whole
+    headers = list(HEADER_PATTERN.finditer(text))
+    if len(headers) != len(requests):
+        raise PackedResponseError(f"Expected {len(requests)} story sections, found {len(headers)}")
+    if text[:headers[0].start()].strip():
+        raise PackedResponseError("Text before the first story header")
+
+    sections = []
+    for position, (match, (category, aspect)) in enumerate(zip(headers, requests)):
+        number = int(match.group(1))
+        if number != position + 1:
+            raise PackedResponseError(f"Story section {number} found where {position + 1} was expected")
+        if _normalize(match.group(2)) != _normalize(f"{category} / {aspect}"):
+            raise PackedResponseError(f"Story {number} is labelled '{match.group(2)}', "
+                                      f"expected '{category} / {aspect}'")
+        end = headers[position + 1].start() if position + 1 < len(headers) else len(text)
+        body = text[match.end():end].strip()
+        if len(body) < min_chars:
+            raise PackedResponseError(f"Story {number} is only {len(body)} characters")
+        sections.append(body)
+    return sections
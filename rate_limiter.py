@@ -0,0 +1,49 @@
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate_per_second)
+        self.last_refill = now
+
+    def acquire(self, amount: float = 1.0):
+        # Requests bigger than the bucket can never fit, so they only wait for a full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate_per_second
+            time.sleep(wait)
+
+    def refund(self, amount: float):
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float, chars_per_minute: float = None):
+        self.requests = TokenBucket(requests_per_minute)
+        self.chars = TokenBucket(chars_per_minute) if chars_per_minute else None
+
+    def acquire(self, estimated_chars: int = 0):
+        self.requests.acquire(1)
+        if self.chars is not None and estimated_chars:
+            self.chars.acquire(estimated_chars)
+
+    def reconcile(self, estimated_chars: int, actual_chars: int):
+        # Reservations are made for the worst case; give back what the response did not use
+        if self.chars is not None and estimated_chars > actual_chars:
+            self.chars.refund(estimated_chars - actual_chars)
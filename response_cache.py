@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class ResponseCache:
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024, hot_entries: int = 256,
+                 replay_only: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hot_entries = hot_entries
+        self.replay_only = replay_only
+        self.lock = threading.Lock()
+        self.hot = OrderedDict()
+        self.stats = {"hot_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        os.makedirs(directory, exist_ok=True)
+
+        # LRU order of the disk tier, oldest first; hits refresh the file mtime so order survives restarts
+        entries = []
+        for shard in os.listdir(directory):
+            shard_dir = os.path.join(directory, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if name.endswith(".json"):
+                    stat = os.stat(os.path.join(shard_dir, name))
+                    entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        entries.sort()
+        self.disk = OrderedDict((key, size) for _, key, size in entries)
+        self.disk_bytes = sum(self.disk.values())
+
+    @staticmethod
+    def make_key(model_id: str, prompt: str, generation_config: Dict, sample_index: int) -> str:
+        payload = json.dumps([model_id, prompt, generation_config, sample_index], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _remember_hot(self, key: str, record: Dict):
+        self.hot[key] = record
+        self.hot.move_to_end(key)
+        while len(self.hot) > self.hot_entries:
+            self.hot.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        record = self.get_record(key)
+        return record["text"] if record is not None else None
+
+    def get_record(self, key: str) -> Optional[Dict]:
+        # The text with whatever metadata was stored alongside it
+        with self.lock:
+            if key in self.hot:
+                self.hot.move_to_end(key)
+                self.disk.move_to_end(key)
+                self.stats["hot_hits"] += 1
+                return self.hot[key]
+
+            if key in self.disk:
+                path = self._path(key)
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        record = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    record = {}
+                if "text" in record:
+                    os.utime(path)
+                    self.disk.move_to_end(key)
+                    self._remember_hot(key, record)
+                    self.stats["disk_hits"] += 1
+                    return record
+                self.disk_bytes -= self.disk.pop(key)
+
+            self.stats["misses"] += 1
+        if self.replay_only:
+            raise CacheMiss(key)
+        return None
+
+    def put(self, key: str, text: str, metadata: Dict = None):
+        if self.replay_only:
+            return
+        record = {"text": text}
+        if metadata:
+            record.update(metadata)
+        data = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        path = self._path(key)
+
+        with self.lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp.{threading.get_ident()}"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+            self.disk_bytes += len(data) - self.disk.pop(key, 0)
+            self.disk[key] = len(data)
+            self._remember_hot(key, record)
+            self.stats["writes"] += 1
+            self._evict()
+
+    def _evict(self):
+        while self.disk_bytes > self.max_bytes and len(self.disk) > 1:
+            key, size = self.disk.popitem(last=False)
+            self.hot.pop(key, None)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self.disk_bytes -= size
+            self.stats["evictions"] += 1
+
+    def summary(self) -> Dict:
+        with self.lock:
+            hits = self.stats["hot_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            return dict(self.stats, hits=hits, hit_rate=hits / lookups if lookups else 0.0,
+                        entries=len(self.disk), bytes=self.disk_bytes)
@@ -0,0 +1,181 @@
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+THROTTLED = "throttled"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+BLOCKED = "blocked"
+RETRYABLE = (THROTTLED, TRANSIENT)
+
+# Matched against the exception class name so google.api_core does not have to be imported
+THROTTLED_NAMES = {"ResourceExhausted", "TooManyRequests"}
+TRANSIENT_NAMES = {"ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "GatewayTimeout",
+                   "BadGateway", "Aborted", "Unknown", "RetryError", "ServerError"}
+PERMANENT_NAMES = {"InvalidArgument", "BadRequest", "PermissionDenied", "Forbidden", "NotFound",
+                   "Unauthenticated", "Unauthorized", "FailedPrecondition"}
+
+
+class RetryExhausted(Exception):
+    def __init__(self, error: Exception, error_class: str, attempts: int):
+        super().__init__(f"{error_class} error after {attempts} attempts: {error}")
+        self.error = error
+        self.error_class = error_class
+        self.attempts = attempts
+
+
+def classify_error(error: Exception) -> str:
+    if isinstance(error, RetryExhausted):
+        return error.error_class
+    name = type(error).__name__
+    if name in THROTTLED_NAMES:
+        return THROTTLED
+    if name in TRANSIENT_NAMES:
+        return TRANSIENT
+    if name in PERMANENT_NAMES:
+        return PERMANENT
+
+    code = getattr(error, "code", None)
+    code = code() if callable(code) else code
+    code = getattr(code, "value", code)
+    if isinstance(code, tuple):
+        code = code[0]
+    if code == 429 or code == 8:
+        return THROTTLED
+    if isinstance(code, int) and (code >= 500 or code in (4, 10, 14)):
+        return TRANSIENT
+    if isinstance(code, int) and code >= 400:
+        return PERMANENT
+
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return TRANSIENT
+    # response.text raises a plain ValueError when the candidate was blocked or has no parts; subclasses such as
+    # json.JSONDecodeError come from our own code
+    if type(error) is ValueError:
+        return BLOCKED
+    # Anything unrecognised is more likely a bug than an outage, and retrying it would buy the prompt again
+    return PERMANENT
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: random.Random = random) -> float:
+    # Full jitter: spreads retries from many workers instead of synchronizing them
+    return rng.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 10, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def seconds_until_retry(self) -> float:
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                # Re-opening from half-open restarts the cool-down
+                self.opened_at = time.monotonic()
+
+
+class AIMDController:
+    def __init__(self, initial: int = 2, minimum: int = 1, maximum: int = 16, increase_every: int = 1):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase_every = increase_every
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def on_success(self):
+        with self.lock:
+            self.successes += 1
+            if self.successes >= self.increase_every * self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self.successes = 0
+
+    def on_throttle(self):
+        with self.lock:
+            self.limit = max(self.minimum, self.limit // 2)
+            self.successes = 0
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                 breaker: Optional[CircuitBreaker] = None, seed: int = None, max_permanent_streak: int = 10):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.error_counts = {THROTTLED: 0, TRANSIENT: 0, PERMANENT: 0, BLOCKED: 0}
+        self.retries = 0
+        # Non-retryable errors since the last successful call. The breaker only counts outages; a long run of these
+        # means every request is broken (key, model, prompt), which waiting does not fix
+        self.permanent_streak = 0
+        self.max_permanent_streak = max_permanent_streak
+
+    def _delay(self, attempt: int) -> float:
+        with self.lock:
+            return backoff_delay(attempt, self.base_delay, self.max_delay, self.rng)
+
+    def check_permanent_streak(self, error: Exception):
+        # Callers skip a prompt after a permanent error; this stops the run once too many were skipped in a row
+        if self.permanent_streak >= self.max_permanent_streak:
+            raise RuntimeError(f"{self.permanent_streak} API calls in a row failed with errors that retrying cannot "
+                               f"fix, last: {error}") from error
+
+    def call(self, fn: Callable, controller: Optional[AIMDController] = None):
+        attempt = 0
+        while True:
+            wait = self.breaker.seconds_until_retry()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                result = fn()
+            except Exception as e:
+                error_class = classify_error(e)
+                with self.lock:
+                    self.error_counts[error_class] += 1
+                if error_class == THROTTLED and controller is not None:
+                    controller.on_throttle()
+                if error_class not in RETRYABLE:
+                    with self.lock:
+                        self.permanent_streak += 1
+                    raise
+                self.breaker.record_failure()
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise RetryExhausted(e, error_class, attempt) from e
+                with self.lock:
+                    self.retries += 1
+                time.sleep(self._delay(attempt))
+                continue
+            self.breaker.record_success()
+            with self.lock:
+                self.permanent_streak = 0
+            if controller is not None:
+                controller.on_success()
+            return result
@@ -0,0 +1,185 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, Optional
+
+from checkpoint import read_json, read_last_line
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = {"v1": "rocket-league-gemini_v1.py", "master": "rocket-league-gemini-master.py"}
+# Subcommands whose remaining arguments go to the generator script or the benchmark suite
+FORWARDED = ("generate", "resume", "benchmark")
+
+logger = logging.getLogger("rocket_league")
+
+
+def load_script(script: str):
+    # Importing a generator script is cheap: the Vertex SDK is only imported on the first API call
+    from story_generator import load_generator_module
+    path = os.path.join(REPO_ROOT, SCRIPTS[script]) if script in SCRIPTS else script
+    return path, load_generator_module(path)
+
+
+def tail_record(output_dir: str) -> Optional[Dict]:
+    # Read-only; StoryStore would repair the tail of a segment a running generator is still writing
+    for path in sorted(glob.glob(os.path.join(output_dir, "stories_*.jsonl")), reverse=True):
+        line = read_last_line(path)
+        if line and line.endswith(b'\n'):
+            return json.loads(line)
+    return None
+
+
+def has_stories(output_dir: str) -> bool:
+    return (tail_record(output_dir) is not None or os.path.exists(os.path.join(output_dir, "stories.txt"))
+            or os.path.exists(os.path.join(output_dir, "generation_state.json")))
+
+
+def collect_stats(generator, output_dir: str) -> Dict:
+    tail = tail_record(output_dir) or {}
+    state = tail.get("state") or read_json(os.path.join(output_dir, "generation_state.json")) or {}
+    ledger_path = os.path.join(output_dir, "cost_ledger.jsonl")
+    line = read_last_line(ledger_path) if os.path.exists(ledger_path) else None
+    totals = json.loads(line)["totals"] if line and line.endswith(b'\n') else {"requests": 0, "cost": 0.0}
+    stats = {
+        "output_dir": output_dir,
+        "stories": tail.get("seq", state.get("stories_generated", 0)),
+        "characters": state.get("characters_generated", 0),
+        "last_timestamp": tail.get("timestamp", state.get("timestamp")),
+        "requests": totals["requests"],
+        "spent": round(totals["cost"], 4),
+        "budget": generator.BUDGET,
+        "remaining": round(generator.BUDGET - totals["cost"], 4),
+    }
+    coverage = read_json(os.path.join(output_dir, "coverage_index.json"))
+    if coverage:
+        accepted = [cell["accepted"] for cell in coverage["cells"]]
+        stats["coverage"] = {"cells": len(accepted), "min": min(accepted, default=0), "max": max(accepted, default=0),
+                             "empty_cells": sum(1 for count in accepted if count == 0)}
+    catalog_path = os.path.join(output_dir, "catalog.sqlite")
+    if os.path.exists(catalog_path):
+        from catalog import Catalog
+        catalog = Catalog(catalog_path)
+        stats["categories"] = {category or "(none)": stories for category, stories, _ in catalog.counts()}
+        catalog.close()
+    return stats
+
+
+def command_stats(module, args):
+    stats = collect_stats(module.RocketLeagueGeminiGenerator(), args.output_dir)
+    if args.json:
+        print(json.dumps(stats, indent=4))
+        return
+    print(f"{stats['stories']:,} stories, {stats['characters']:,} characters in {stats['output_dir']}")
+    print(f"${stats['spent']:.2f} of ${stats['budget']} spent on {stats['requests']:,} requests, "
+          f"${stats['remaining']:.2f} remaining")
+    if stats["last_timestamp"]:
+        print(f"Last story: {stats['last_timestamp']}")
+    if "coverage" in stats:
+        coverage = stats["coverage"]
+        print(f"Coverage: {coverage['cells']} cells, {coverage['min']}-{coverage['max']} stories per cell, "
+              f"{coverage['empty_cells']} empty")
+    for category, stories in stats.get("categories", {}).items():
+        print(f"- {category}: {stories:,}")
+
+
+def command_export(args):
+    filters = {"category": args.category, "aspect": args.aspect}
+    if args.query is None and not any(filters.values()) and args.format == "text":
+        from story_store import StoryStore
+        stories = StoryStore(args.output_dir)
+        path = args.path or os.path.join(args.output_dir, "stories.txt")
+        exported = stories.export_text(path)
+        stories.close()
+    else:
+        # Subsets go through the catalog, which is brought up to date with the story store first
+        from catalog import Catalog
+        catalog = Catalog(os.path.join(args.output_dir, "catalog.sqlite"))
+        catalog.ingest([args.output_dir])
+        path = args.path or os.path.join(args.output_dir, f"export.{'jsonl' if args.format == 'jsonl' else 'txt'}")
+        exported = catalog.export(path, catalog.ids(args.query, **filters), args.format)
+        catalog.close()
+    logger.info(f"Exported {exported} stories to {path}")
+
+
+def command_validate(module, args):
+    generator = module.RocketLeagueGeminiGenerator()
+    generator.enable_validation(min_words=args.min_words)
+    report = generator.validate_existing(args.output_dir)
+    if args.rejected:
+        for seq, reason in report["rejected"]:
+            print(f"{seq}\t{reason}")
+
+
+def forward(path: str, main, argv: list):
+    # The script and the suite parse their own flags
+    sys.argv = [path] + argv
+    main()
+
+
+def main():
+    start = time.perf_counter()
+    parser = argparse.ArgumentParser(description="Rocket League dataset generation and offline tools")
+    parser.add_argument("--script", default="v1",
+                        help=f"Generator script: {' or '.join(SCRIPTS)}, or a path (default: v1)")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("generate", help="Run the generator; any further flags go to the script (see generate -h)",
+                        add_help=False)
+    resume = commands.add_parser("resume", help="Continue an existing run; further flags go to the script",
+                                 add_help=False)
+    resume.add_argument("output_dir")
+    commands.add_parser("benchmark", help="Run benchmarks/suite.py; further flags go to the suite", add_help=False)
+
+    stats = commands.add_parser("stats", help="Stories, spend and coverage of a run (offline)")
+    stats.add_argument("output_dir")
+    stats.add_argument("--json", action="store_true")
+
+    export = commands.add_parser("export", help="Write all or a subset of the stories in a training format (offline)")
+    export.add_argument("output_dir")
+    export.add_argument("--path", default=None, help="Default: stories.txt or export.<format> in the output directory")
+    export.add_argument("--format", choices=["text", "jsonl"], default="text")
+    export.add_argument("--category", default=None)
+    export.add_argument("--aspect", default=None)
+    export.add_argument("--query", default=None, help="FTS5 query, e.g. 'NEAR(boost starve, 5)'")
+
+    validate = commands.add_parser("validate", help="Check stored stories against the prompt format (offline)")
+    validate.add_argument("output_dir")
+    validate.add_argument("--min-words", type=int, default=100)
+    validate.add_argument("--rejected", action="store_true", help="Print the seq and reason of every rejected story")
+
+    args, extra = parser.parse_known_args()
+    if extra and args.command not in FORWARDED:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    if args.command == "benchmark":
+        from benchmarks import suite
+        forward(suite.__file__, suite.main, extra)
+        return
+
+    if args.command in ("generate", "resume"):
+        if args.command == "resume":
+            if not has_stories(args.output_dir):
+                parser.error(f"{args.output_dir} has no stories or saved state to resume; use generate")
+            extra = ["--output-dir", args.output_dir] + extra
+        path, module = load_script(args.script)
+        forward(path, module.main, extra)
+        return
+
+    logging.basicConfig(level=getattr(logging, args.log_level), format="%(asctime)s %(levelname)s %(message)s")
+    if not os.path.isdir(args.output_dir):
+        parser.error(f"{args.output_dir} does not exist")
+    if args.command == "export":
+        command_export(args)
+    else:
+        # stats needs the script's budget, validate its prompt
+        _, module = load_script(args.script)
+        {"stats": command_stats, "validate": command_validate}[args.command](module, args)
+    logger.debug(f"{args.command} took {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
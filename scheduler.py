@@ -0,0 +1,167 @@
+import heapq
+import random
+import threading
+from typing import Dict, Iterable, Optional
+
+from checkpoint import atomic_write_json, read_json
+
+
+class CoverageScheduler:
+    # Always hands out the least-covered (category, aspect, starter) cell. Ties are broken by a fixed seeded
+    # order, so the sequence only depends on the counts and a restart continues exactly where it stopped.
+    def __init__(self, cells: Iterable[tuple], path: Optional[str] = None, rejection_weight: float = 4.0,
+                 seed: int = 0, failure_allowance: int = 2):
+        self.cells = sorted(set(cells), key=lambda cell: tuple("" if part is None else part for part in cell))
+        self.index = {cell: number for number, cell in enumerate(self.cells)}
+        order = list(range(len(self.cells)))
+        random.Random(seed).shuffle(order)
+        self.tiebreak = [0] * len(self.cells)
+        for rank, number in enumerate(order):
+            self.tiebreak[number] = rank
+        self.path = path
+        # A rejected story (near-duplicate) counts as this much coverage: cells that keep producing
+        # duplicates are saturated, so the budget goes elsewhere
+        self.rejection_weight = rejection_weight
+        self.accepted = [0] * len(self.cells)
+        self.rejected = [0] * len(self.cells)
+        # Next sample index per cell; also part of the response cache key
+        self.attempts = [0] * len(self.cells)
+        self.in_flight = [0] * len(self.cells)
+        # Replay-only misses, only for this session
+        self.skipped = [0] * len(self.cells)
+        # Permanent API errors since the cell last stored a story. Up to failure_allowance of them in a row are
+        # retried right away (a one-off failure must not reorder the schedule); beyond that the cell is set aside
+        self.failed = [0] * len(self.cells)
+        self.failure_allowance = failure_allowance
+        self.lock = threading.Lock()
+        self.heap = []
+        self._rebuild()
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def _priority(self, number: int) -> float:
+        failed = self.failed[number] if self.failed[number] > self.failure_allowance else 0
+        return (self.accepted[number] + self.in_flight[number] + self.skipped[number] + failed
+                + self.rejection_weight * self.rejected[number])
+
+    def _push(self, number: int):
+        heapq.heappush(self.heap, (self._priority(number), self.tiebreak[number], number))
+        # Stale entries are skipped when popped; rebuild before they dominate the heap
+        if len(self.heap) > 4 * len(self.cells):
+            self._rebuild()
+
+    def _rebuild(self):
+        self.heap = [(self._priority(number), self.tiebreak[number], number) for number in range(len(self.cells))]
+        heapq.heapify(self.heap)
+
+    def _top(self) -> int:
+        while True:
+            priority, _, number = self.heap[0]
+            if priority == self._priority(number):
+                return number
+            heapq.heappop(self.heap)
+
+    def peek(self) -> tuple:
+        with self.lock:
+            return self.cells[self._top()]
+
+    def take(self, samples: int = 1) -> tuple[tuple, int]:
+        # Returns the cell and its first sample index; the cell stays in flight until record/release
+        with self.lock:
+            number = self._top()
+            heapq.heappop(self.heap)
+            sample_index = self.attempts[number]
+            self.attempts[number] += samples
+            self.in_flight[number] += samples
+            self._push(number)
+            return self.cells[number], sample_index
+
+    def record(self, cell: tuple, accepted: bool = True):
+        number = self.index.get(cell)
+        if number is None:
+            return
+        with self.lock:
+            self.in_flight[number] = max(0, self.in_flight[number] - 1)
+            if accepted:
+                self.accepted[number] += 1
+                self.failed[number] = 0
+            else:
+                self.rejected[number] += 1
+            self._push(number)
+
+    def release(self, cell: tuple, skipped: bool = False):
+        # The request failed or had nothing to replay; the sample index is not reused
+        number = self.index.get(cell)
+        if number is None:
+            return
+        with self.lock:
+            self.in_flight[number] = max(0, self.in_flight[number] - 1)
+            if skipped:
+                self.skipped[number] += 1
+            self._push(number)
+
+    def fail(self, cell: tuple):
+        # The request hit an error that retrying the same prompt cannot fix. A cell that keeps failing counts as
+        # one story fuller per error until it stores one, so the others go first instead of it being picked forever
+        number = self.index.get(cell)
+        if number is None:
+            return
+        with self.lock:
+            self.in_flight[number] = max(0, self.in_flight[number] - 1)
+            self.failed[number] += 1
+            self._push(number)
+
+    def save(self, stories: int):
+        if self.path is None:
+            return
+        with self.lock:
+            cells = [{"category": cell[0], "aspect": cell[1], "starter": cell[2], "accepted": self.accepted[number],
+                      "rejected": self.rejected[number], "attempts": self.attempts[number],
+                      "failed": self.failed[number]}
+                     for number, cell in enumerate(self.cells)]
+        atomic_write_json(self.path, {"stories": stories, "rejection_weight": self.rejection_weight, "cells": cells})
+
+    def load(self, stories) -> str:
+        # Accepted counts must match the story store exactly; if the index is behind the store (crash between
+        # append and save) they are recounted from the records
+        data = read_json(self.path) if self.path is not None else None
+        saved = {}
+        if data:
+            saved = {(cell["category"], cell["aspect"], cell["starter"]): cell for cell in data["cells"]}
+        counts = None
+        source = "index"
+        if not data or data["stories"] != len(stories):
+            counts = self.count_stories(stories)
+            source = "store"
+
+        with self.lock:
+            for number, cell in enumerate(self.cells):
+                entry = saved.get(cell, {})
+                self.accepted[number] = counts.get(cell, 0) if counts is not None else entry.get("accepted", 0)
+                self.rejected[number] = entry.get("rejected", 0)
+                self.attempts[number] = max(entry.get("attempts", 0), self.accepted[number] + self.rejected[number])
+                self.in_flight[number] = 0
+                self.skipped[number] = 0
+                self.failed[number] = entry.get("failed", 0)
+            self._rebuild()
+        return source
+
+    @staticmethod
+    def count_stories(stories) -> Dict[tuple, int]:
+        counts = {}
+        for record in stories:
+            cell = (record.get("category"), record.get("aspect"), record.get("starter"))
+            counts[cell] = counts.get(cell, 0) + 1
+        return counts
+
+    def coverage(self) -> Dict:
+        with self.lock:
+            accepted = list(self.accepted)
+        return {
+            "cells": len(self.cells),
+            "stories": sum(accepted),
+            "min": min(accepted, default=0),
+            "max": max(accepted, default=0),
+            "empty_cells": sum(1 for count in accepted if count == 0),
+        }
@@ -0,0 +1,417 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from batch_pipeline import expand_grid
+from cost_ledger import EMPTY_TOTALS, CostLedger, load_price_tables
+from multi_story import PackedResponseError
+from rate_limiter import RateLimiter
+from story_generator import load_generator_module
+
+logger = logging.getLogger(__name__)
+
+# A failed item goes back to the queue this many times before it is given up
+MAX_ATTEMPTS = 3
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 1), requests INTEGER, stories INTEGER,
+    input_tokens INTEGER, output_tokens INTEGER, input_chars INTEGER, output_chars INTEGER, cost REAL);
+CREATE TABLE IF NOT EXISTS reservations (worker INTEGER PRIMARY KEY, amount REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY AUTOINCREMENT, worker INTEGER, entry TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS work_items (item_id TEXT PRIMARY KEY, position INTEGER, category TEXT, aspect TEXT,
+    starter TEXT, sample_index INTEGER, prompt TEXT, worker INTEGER, state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0, story_seq INTEGER, updated REAL);
+CREATE INDEX IF NOT EXISTS work_items_queue ON work_items (worker, state, position);
+INSERT OR IGNORE INTO totals VALUES (1, 0, 0, 0, 0, 0, 0, 0.0);
+"""
+TOTAL_KEYS = tuple(EMPTY_TOTALS)
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    # WAL lets workers read totals while another one commits; writers serialize on BEGIN IMMEDIATE
+    connection = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def transaction(connection: sqlite3.Connection, lock: threading.Lock, fn: Callable):
+    # fn runs on the connection inside BEGIN IMMEDIATE, so it sees and writes a consistent state
+    with lock:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(connection)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+
+class SharedLedger(CostLedger):
+    # Same interface as CostLedger, but totals and reservations live in SQLite so every worker process
+    # checks the budget against everybody's spend and in-flight worst cases
+    def __init__(self, db_path: str, model_id: str, budget: float, price_tables: Dict = None, worker: int = 0):
+        self.db_path = db_path
+        self.worker = worker
+        self.connection = connect(db_path)
+        super().__init__(model_id, budget, price_tables)
+
+    def _load_totals(self):
+        # Nothing to load: totals and reservations are read from the database on every access
+        pass
+
+    def _transaction(self, fn: Callable):
+        return transaction(self.connection, self.lock, fn)
+
+    def _totals(self, connection: sqlite3.Connection) -> Dict:
+        row = connection.execute(f"SELECT {', '.join(TOTAL_KEYS)} FROM totals WHERE id = 1").fetchone()
+        return dict(zip(TOTAL_KEYS, row))
+
+    @staticmethod
+    def _reserved(connection: sqlite3.Connection) -> float:
+        return connection.execute("SELECT COALESCE(SUM(amount), 0) FROM reservations").fetchone()[0]
+
+    @property
+    def totals(self) -> Dict:
+        with self.lock:
+            return self._totals(self.connection)
+
+    @property
+    def reserved(self) -> float:
+        with self.lock:
+            return self._reserved(self.connection)
+
+    def can_afford(self, amount: float) -> bool:
+        with self.lock:
+            cost = self.connection.execute("SELECT cost FROM totals WHERE id = 1").fetchone()[0]
+            return cost + self._reserved(self.connection) + amount <= self.budget
+
+    def try_reserve(self, amount: float) -> bool:
+        def reserve(connection):
+            cost = connection.execute("SELECT cost FROM totals WHERE id = 1").fetchone()[0]
+            if cost + self._reserved(connection) + amount > self.budget:
+                return False
+            connection.execute("INSERT INTO reservations VALUES (?, ?) "
+                               "ON CONFLICT (worker) DO UPDATE SET amount = amount + excluded.amount",
+                               (self.worker, amount))
+            return True
+        return self._transaction(reserve)
+
+    def release(self, amount: float):
+        self._transaction(lambda connection: connection.execute(
+            "UPDATE reservations SET amount = MAX(0, amount - ?) WHERE worker = ?", (amount, self.worker)))
+
+    def reserved_by_others(self) -> float:
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(SUM(amount), 0) FROM reservations WHERE worker != ?",
+                                           (self.worker,)).fetchone()[0]
+
+    def record(self, prompt: str, response_text: str, usage=None, stories: int = 1, discount: float = 0.0,
+               **metadata) -> Dict:
+        entry = self.price_entry(prompt, response_text, usage, stories, discount)
+        entry.update(metadata, worker=self.worker)
+
+        def apply(connection):
+            connection.execute(
+                "UPDATE totals SET requests = requests + 1, stories = stories + ?, input_tokens = input_tokens + ?, "
+                "output_tokens = output_tokens + ?, input_chars = input_chars + ?, output_chars = output_chars + ?, "
+                "cost = cost + ? WHERE id = 1",
+                (stories, entry["input_tokens"], entry["output_tokens"], entry["input_chars"], entry["output_chars"],
+                 entry["cost"]))
+            entry["totals"] = self._totals(connection)
+            connection.execute("INSERT INTO entries (worker, entry) VALUES (?, ?)", (self.worker, json.dumps(entry)))
+        self._transaction(apply)
+        return entry
+
+    def forfeit_reservations(self, worker: int) -> float:
+        # A worker that died may have had a call in flight that is billed anyway: its worst case counts as spent
+        def forfeit(connection):
+            row = connection.execute("SELECT amount FROM reservations WHERE worker = ?", (worker,)).fetchone()
+            amount = row[0] if row else 0.0
+            connection.execute("DELETE FROM reservations WHERE worker = ?", (worker,))
+            if amount > 0:
+                connection.execute("UPDATE totals SET cost = cost + ? WHERE id = 1", (amount,))
+                connection.execute("INSERT INTO entries (worker, entry) VALUES (?, ?)", (worker, json.dumps(
+                    {"model": self.model_id, "cost": amount, "forfeited_reservation": True,
+                     "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")})))
+            return amount
+        return self._transaction(forfeit)
+
+    def summary(self) -> Dict:
+        totals = self.totals
+        return dict(totals, budget=self.budget, remaining=self.budget - totals["cost"])
+
+    def sync(self):
+        pass
+
+    def close(self):
+        self.connection.close()
+
+
+class WorkQueue:
+    # The (category, aspect, starter, sample) grid with an owner per item; lives in the ledger database
+    def __init__(self, db_path: str):
+        self.connection = connect(db_path)
+        self.lock = threading.Lock()
+
+    def _transaction(self, fn: Callable):
+        return transaction(self.connection, self.lock, fn)
+
+    def seed(self, requests, workers: list) -> int:
+        # Items are dealt round-robin, so every worker gets a slice of every category
+        def insert(connection):
+            before = connection.execute("SELECT COUNT(*) FROM work_items").fetchone()[0]
+            for position, request in enumerate(requests):
+                connection.execute(
+                    "INSERT OR IGNORE INTO work_items (item_id, position, category, aspect, starter, sample_index, "
+                    "prompt, worker, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (request["request_id"], position, request["category"], request["aspect"], request["starter"],
+                     request["sample_index"], request["prompt"], workers[position % len(workers)], time.time()))
+            return connection.execute("SELECT COUNT(*) FROM work_items").fetchone()[0] - before
+        return self._transaction(insert)
+
+    def rebalance(self, workers: list) -> int:
+        # On (re)start, every unfinished item is dealt again over the current workers
+        def deal(connection):
+            rows = connection.execute("SELECT item_id FROM work_items WHERE state IN ('pending', 'leased') "
+                                      "ORDER BY position").fetchall()
+            for number, (item_id,) in enumerate(rows):
+                connection.execute("UPDATE work_items SET worker = ?, state = 'pending' WHERE item_id = ?",
+                                   (workers[number % len(workers)], item_id))
+            return len(rows)
+        return self._transaction(deal)
+
+    def claim(self, worker: int) -> Optional[Dict]:
+        def lease(connection):
+            row = connection.execute(
+                "SELECT item_id, category, aspect, starter, sample_index, prompt FROM work_items "
+                "WHERE worker = ? AND state = 'pending' ORDER BY position LIMIT 1", (worker,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE work_items SET state = 'leased', updated = ? WHERE item_id = ?",
+                               (time.time(), row[0]))
+            return dict(zip(("item_id", "category", "aspect", "starter", "sample_index", "prompt"), row))
+        return self._transaction(lease)
+
+    def complete(self, item_id: str, story_seq: Optional[int]):
+        self._transaction(lambda connection: connection.execute(
+            "UPDATE work_items SET state = 'done', story_seq = ?, updated = ? WHERE item_id = ?",
+            (story_seq, time.time(), item_id)))
+
+    def release(self, item_id: str, failed: bool = False):
+        def back(connection):
+            attempts = connection.execute("SELECT attempts FROM work_items WHERE item_id = ?",
+                                          (item_id,)).fetchone()[0] + failed
+            state = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+            connection.execute("UPDATE work_items SET state = ?, attempts = ?, updated = ? WHERE item_id = ?",
+                               (state, attempts, time.time(), item_id))
+        self._transaction(back)
+
+    def reassign(self, worker: int, survivors: list) -> int:
+        def move(connection):
+            rows = connection.execute("SELECT item_id FROM work_items WHERE worker = ? AND state IN "
+                                      "('pending', 'leased') ORDER BY position", (worker,)).fetchall()
+            for number, (item_id,) in enumerate(rows):
+                connection.execute("UPDATE work_items SET worker = ?, state = 'pending' WHERE item_id = ?",
+                                   (survivors[number % len(survivors)], item_id))
+            return len(rows)
+        return self._transaction(move)
+
+    def counts(self) -> Dict:
+        with self.lock:
+            rows = self.connection.execute("SELECT state, COUNT(*) FROM work_items GROUP BY state").fetchall()
+        return dict(rows)
+
+    def close(self):
+        self.connection.close()
+
+
+def run_worker(worker: int, script_path: str, output_dir: str, budget: float, price_table: Optional[str] = None,
+               requests_per_minute: float = 60, load_module: Callable = None, setup: Callable = None):
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s worker {worker} %(levelname)s %(message)s")
+    module = (load_module or load_generator_module)(script_path)
+    generator = module.RocketLeagueGeminiGenerator()
+    generator.price_tables = load_price_tables(price_table)
+    generator.enable_validation()
+    # Rejected stories go back to the work queue, which has its own retry limit
+    generator.max_validation_retries = 0
+    if setup is not None:
+        setup(generator, worker)
+
+    db_path = os.path.join(output_dir, "shared_ledger.sqlite")
+    worker_dir = os.path.join(output_dir, f"worker_{worker:02d}")
+    os.makedirs(worker_dir, exist_ok=True)
+    generator.ledger = SharedLedger(db_path, generator.MODEL_ID, budget, generator.price_tables, worker)
+    generator.metrics.open(worker_dir, generator.ledger, generator.retry_policy)
+    queue = WorkQueue(db_path)
+    stories = generator.load_existing_stories(worker_dir)
+    generator.load_progress_state(worker_dir, stories)
+    limiter = RateLimiter(requests_per_minute)
+    max_output_tokens = generator.max_request_output_tokens()
+
+    while True:
+        item = queue.claim(worker)
+        if item is None:
+            break
+        prompt = item["prompt"]
+        slots = [(item["category"], item["aspect"], prompt, item["sample_index"])]
+        results = generator.cached_batch(slots)
+        if results is None:
+            cost = generator.ledger.worst_case_cost(prompt, max_output_tokens)
+            if not generator.ledger.try_reserve(cost):
+                queue.release(item["item_id"])
+                if generator.ledger.reserved_by_others() > 0:
+                    # Calls in flight elsewhere usually cost less than reserved; wait for them to settle
+                    time.sleep(0.5)
+                    continue
+                logger.info("Shared budget cannot cover another request. Stopping.")
+                break
+            limiter.acquire()
+            try:
+                with generator.metrics.phase("api"):
+                    texts, usage, stream_stats = generator.retry_policy.call(lambda: generator.call_batch(prompt))
+            except Exception as e:
+                generator.ledger.release(cost)
+                logger.warning(f"Gemini API error for {item['item_id'][:12]}: {e}")
+                queue.release(item["item_id"], failed=True)
+                generator.retry_policy.check_permanent_streak(e)
+                continue
+            generator.metrics.count("requests")
+            # Only errors from the API call itself are skipped; a bug while handling a paid response stops the worker
+            try:
+                with generator.metrics.phase("validation"):
+                    results = generator.complete_batch(slots, prompt, texts, usage, stream_stats)
+            except PackedResponseError as e:
+                logger.warning(f"Discarding packed response for {item['item_id'][:12]}: {e}")
+                results = []
+            finally:
+                generator.ledger.release(cost)
+            if not results:
+                queue.release(item["item_id"], failed=True)
+                continue
+
+        story, chars, category, aspect, cached, fields = results[0]
+        accepted = generator.accept_story(stories, worker_dir, story, chars, category, aspect, cached,
+                                          starter=item["starter"], request_id=item["item_id"], **fields)
+        queue.complete(item["item_id"], len(stories) if accepted else None)
+        generator.last_aspect_index += 1
+        generator.metrics.maybe_flush()
+
+    generator.save_stories(stories, worker_dir)
+    stories.close()
+    generator.metrics.flush()
+    generator.ledger.close()
+    queue.close()
+
+
+class ShardedLauncher:
+    def __init__(self, script_path: str, output_dir: str, workers: int = 4, budget: float = 300,
+                 samples: int = 1, requests_per_minute: float = 60, price_table: Optional[str] = None,
+                 load_module: Callable = None, setup: Callable = None):
+        self.script_path = script_path
+        self.output_dir = output_dir
+        self.workers = workers
+        self.budget = budget
+        self.samples = samples
+        # The quota is per project, so each worker gets an equal share of it
+        self.worker_rpm = requests_per_minute / workers
+        self.price_table = price_table
+        self.load_module = load_module
+        self.setup = setup
+        self.db_path = os.path.join(output_dir, "shared_ledger.sqlite")
+        self.model_id = None
+        self.processes = {}
+        # Spawned, not forked: SQLite connections must not cross a fork
+        self.context = multiprocessing.get_context("spawn")
+
+    def prepare(self) -> WorkQueue:
+        os.makedirs(self.output_dir, exist_ok=True)
+        module = (self.load_module or load_generator_module)(self.script_path)
+        generator = module.RocketLeagueGeminiGenerator()
+        if self.setup is not None:
+            self.setup(generator, -1)
+        self.model_id = generator.MODEL_ID
+        queue = WorkQueue(self.db_path)
+        workers = list(range(self.workers))
+        added = queue.seed(expand_grid(generator, self.samples), workers)
+        dealt = queue.rebalance(workers)
+        logger.info(f"{added} new work items, {dealt} unfinished items dealt over {self.workers} workers")
+        return queue
+
+    def start_worker(self, worker: int):
+        process = self.context.Process(target=run_worker, name=f"worker-{worker}", args=(
+            worker, self.script_path, self.output_dir, self.budget, self.price_table, self.worker_rpm,
+            self.load_module, self.setup))
+        process.start()
+        return process
+
+    def run(self, poll_interval: float = 1.0) -> Dict:
+        queue = self.prepare()
+        ledger = SharedLedger(self.db_path, self.model_id, self.budget, load_price_tables(self.price_table), -1)
+        self.processes = {worker: self.start_worker(worker) for worker in range(self.workers)}
+        start = time.monotonic()
+        try:
+            while self.processes:
+                time.sleep(poll_interval)
+                for worker, process in list(self.processes.items()):
+                    if process.is_alive():
+                        continue
+                    del self.processes[worker]
+                    forfeited = ledger.forfeit_reservations(worker)
+                    survivors = list(self.processes)
+                    moved = queue.reassign(worker, survivors) if survivors else 0
+                    if process.exitcode != 0:
+                        logger.warning(f"Worker {worker} exited with code {process.exitcode}: {moved} unfinished "
+                                       f"items moved to workers {survivors}, ${forfeited:.4f} reservation counted "
+                                       f"as spent")
+                    elif moved:
+                        logger.info(f"Worker {worker} stopped with {moved} unfinished items, moved to {survivors}")
+                counts = queue.counts()
+                logger.info(f"{counts.get('done', 0)} done, {counts.get('pending', 0) + counts.get('leased', 0)} "
+                            f"left, {counts.get('failed', 0)} failed; ${ledger.spent:.4f} of ${self.budget} spent")
+        except KeyboardInterrupt:
+            logger.info("Interrupted, stopping workers...")
+            for process in self.processes.values():
+                process.terminate()
+            for worker, process in self.processes.items():
+                process.join()
+                ledger.forfeit_reservations(worker)
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            counts = queue.counts()
+            summary = dict(ledger.summary(), items=counts, seconds=round(elapsed, 3),
+                           stories_per_second=round(counts.get("done", 0) / elapsed, 3) if elapsed else 0.0)
+            ledger.close()
+            queue.close()
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several generator processes against one shared budget")
+    parser.add_argument("--script", default="rocket-league-gemini-master.py")
+    parser.add_argument("--output-dir", default="rocket_league_sharded")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--budget", type=float, default=300, help="Dollar budget shared by all workers")
+    parser.add_argument("--samples", type=int, default=1, help="Stories per grid cell")
+    parser.add_argument("--requests-per-minute", type=float, default=60, help="Project quota, split over workers")
+    parser.add_argument("--price-table", default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s launcher %(levelname)s %(message)s")
+
+    launcher = ShardedLauncher(args.script, args.output_dir, args.workers, args.budget, args.samples,
+                               args.requests_per_minute, args.price_table)
+    summary = launcher.run()
+    logger.info(f"Final cost: ${summary['cost']:.2f} of ${summary['budget']} ({summary['requests']} paid requests), "
+                f"{summary['stories']} stories in {summary['seconds']:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
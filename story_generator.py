@@ -0,0 +1,866 @@
+import abc
+import argparse
+import importlib.util
+import logging
+import time
+import os
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from checkpoint import atomic_write_json, read_json, recover_counters
+from cost_ledger import PRICE_TABLES, CostLedger, load_price_tables
+from metrics import RunMetrics
+from multi_story import MAX_CANDIDATES, MAX_OUTPUT_TOKENS, PackedResponseError, split_packed_response
+from response_cache import CacheMiss, ResponseCache
+from retry_policy import RETRYABLE, RetryPolicy, classify_error
+from scheduler import CoverageScheduler
+from story_store import StoryStore
+from streaming import clip_text, consume_stream
+from validator import REASONS, ResponseFormat, validate_stories
+
+# Typical length of a story answering the 400-500 word prompts, used before any story exists
+DEFAULT_STORY_CHARS = 2500
+
+logger = logging.getLogger("rocket_league")
+
+
+class StoryGenerator(abc.ABC):
+    # Everything but the prompts and the category/aspect tables, which each generator script defines
+    def __init__(self):
+        self.MODEL_ID = "gemini-1.5-pro-001"
+        # The Vertex client is only created on the first API call, so offline commands never import the SDK
+        self._model = None
+        self.model_lock = threading.Lock()
+        #stopping generation of stories at $300 or less
+        self.BUDGET = 300
+        self.price_tables = PRICE_TABLES
+        self.ledger = None
+        # Appended to every stored story
+        self.EOS_TOKEN = ""
+
+        self.generation_config = {
+            'candidate_count': 1,
+            'temperature': 0.7,
+            'top_p': 0.9,
+            'max_output_tokens': 1024,
+        }
+        
+        self.stories_generated = 0
+        self.characters_generated = 0
+        self.last_aspect_index = 0
+        self.cache = None
+        self.dedup = None
+        self.dedup_mode = "reject"
+        self.scheduler = None
+        self.catalog = None
+        # Empty and blocked responses are always rejected; enable_validation adds the prompt's format
+        self.response_format = ResponseFormat()
+        self.max_validation_retries = 2
+        self.retry_slots = deque()
+        self.validation_attempts = {}
+        self.retry_policy = RetryPolicy()
+        # Pause between sequential requests
+        self.request_interval = 2
+        self.metrics = RunMetrics()
+        self.candidate_count = 1
+        self.pack_size = 1
+        self.streaming = False
+        # Subclasses set this to the word limit their prompt states
+        self.max_story_words = None
+        self.max_story_chars = None
+        self.stream_totals = {"requests": 0, "truncated": 0, "ttfc": 0.0, "latency": 0.0}
+        # Shuffled (category, aspect) pairs, filled in by the subclass
+        self.aspect_list = []
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self.model_lock:
+                if self._model is None:
+                    from vertexai.generative_models._generative_models import GenerativeModel
+                    self._model = GenerativeModel(self.MODEL_ID)
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    @abc.abstractmethod
+    def create_prompt(self, category: str, aspect: str) -> str:
+        pass
+
+    @abc.abstractmethod
+    def create_packed_prompt(self, requests: list[tuple[str, str]]) -> str:
+        pass
+
+    def configure_batching(self, candidates: int = 1, pack: int = 1):
+        if candidates > 1 and pack > 1:
+            raise ValueError("Use either multiple candidates or packed requests, not both")
+        if not 1 <= candidates <= MAX_CANDIDATES:
+            raise ValueError(f"candidate_count must be between 1 and {MAX_CANDIDATES}")
+        if pack < 1 or pack * self.generation_config['max_output_tokens'] > MAX_OUTPUT_TOKENS:
+            raise ValueError(f"Packing {pack} stories would exceed {MAX_OUTPUT_TOKENS} output tokens")
+        self.candidate_count = candidates
+        self.pack_size = pack
+
+    def enable_streaming(self, max_words: int = None, max_chars: int = None):
+        if self.candidate_count > 1 or self.pack_size > 1:
+            raise ValueError("Streaming only supports one story per request")
+        self.streaming = True
+        if max_words is not None:
+            self.max_story_words = max_words
+        self.max_story_chars = max_chars
+
+    def request_config(self) -> Dict:
+        # generation_config stays the per-story config so cache keys do not depend on the batching mode
+        return dict(self.generation_config, candidate_count=self.candidate_count,
+                    max_output_tokens=self.generation_config['max_output_tokens'] * self.pack_size)
+
+    def max_request_output_tokens(self) -> int:
+        return self.request_config()['max_output_tokens'] * self.candidate_count
+
+    def build_batch(self, index: int, reserve: bool = True) -> tuple[list, str, int]:
+        # Returns the stories a request will produce, its prompt, and how many list positions it covers
+        if reserve and self.retry_slots:
+            return self.build_retry_batch()
+        if self.scheduler is not None:
+            return self.build_scheduled_batch(reserve)
+        if self.pack_size > 1:
+            slots = [self.build_request(index + offset) for offset in range(self.pack_size)]
+            prompt = self.create_packed_prompt([(category, aspect) for category, aspect, _, _ in slots])
+            return slots, prompt, self.pack_size
+        category, aspect, prompt, sample_index = self.build_request(index)
+        slots = [(category, aspect, prompt, sample_index * self.candidate_count + number)
+                 for number in range(self.candidate_count)]
+        return slots, prompt, 1
+
+    def build_retry_batch(self) -> tuple[list, str, int]:
+        # Re-queued stories go first, with their original prompt and sample index; they cover no new list positions
+        slots = [self.retry_slots.popleft() for _ in range(min(self.pack_size, len(self.retry_slots)))]
+        if self.pack_size > 1:
+            return slots, self.create_packed_prompt([(category, aspect) for category, aspect, _, _ in slots]), 0
+        return slots, slots[0][2], 0
+
+    def build_scheduled_batch(self, reserve: bool = True) -> tuple[list, str, int]:
+        # Least-covered cells first; reserve=False only looks at the next cell, for cost projections
+        def next_cell(samples: int = 1):
+            return self.scheduler.take(samples) if reserve else (self.scheduler.peek(), 0)
+
+        if self.pack_size > 1:
+            cells = [next_cell() for _ in range(self.pack_size)]
+            slots = [(category, aspect, self.create_prompt(category, aspect), sample_index)
+                     for (category, aspect, _), sample_index in cells]
+            prompt = self.create_packed_prompt([(category, aspect) for category, aspect, _, _ in slots])
+            return slots, prompt, self.pack_size
+        (category, aspect, _), sample_index = next_cell(self.candidate_count)
+        prompt = self.create_prompt(category, aspect)
+        slots = [(category, aspect, prompt, sample_index + number) for number in range(self.candidate_count)]
+        return slots, prompt, 1
+
+    def build_request(self, index: int) -> tuple[str, str, str, int]:
+        category, aspect = self.aspect_list[index % len(self.aspect_list)]
+        # Each full pass over the list asks for a new sample of the same prompt
+        return category, aspect, self.create_prompt(category, aspect), index // len(self.aspect_list)
+
+    @property
+    def cycle_length(self) -> int:
+        return len(self.aspect_list)
+
+    def enable_cache(self, cache_dir: str, max_bytes: int = 1024 * 1024 * 1024, replay_only: bool = False):
+        self.cache = ResponseCache(cache_dir, max_bytes, replay_only=replay_only)
+
+    def cached_response(self, prompt: str, sample_index: int) -> Optional[str]:
+        record = self.cached_record(prompt, sample_index)
+        return record["text"] if record is not None else None
+
+    def cached_record(self, prompt: str, sample_index: int) -> Optional[Dict]:
+        if self.cache is None:
+            return None
+        return self.cache.get_record(ResponseCache.make_key(self.MODEL_ID, prompt, self.generation_config,
+                                                            sample_index))
+
+    def cache_response(self, prompt: str, sample_index: int, text: str, truncated: bool = False):
+        if self.cache is not None:
+            key = ResponseCache.make_key(self.MODEL_ID, prompt, self.generation_config, sample_index)
+            # A clipped stream shares its key with a full response, so the flag travels with the text
+            self.cache.put(key, text, {"truncated": True} if truncated else None)
+
+    def report_error_stats(self):
+        errors = ", ".join(f"{name}: {count}" for name, count in self.retry_policy.error_counts.items())
+        logger.info(f"API errors: {errors} ({self.retry_policy.retries} retries)")
+
+    def report_stream_stats(self):
+        totals = self.stream_totals
+        if not totals["requests"]:
+            return
+        logger.info(f"Streaming: {totals['truncated']} of {totals['requests']} stories cut at the length limit, "
+                    f"avg first chunk {totals['ttfc'] / totals['requests']:.2f}s, "
+                    f"avg latency {totals['latency'] / totals['requests']:.2f}s")
+
+    def report_cache_stats(self):
+        if self.cache is None:
+            return
+        stats = self.cache.summary()
+        logger.info(f"Cache: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+                    f"{stats['entries']} entries, {stats['bytes']:,} bytes")
+
+    def enable_dedup(self, output_dir: str, threshold: float = 0.8, mode: str = "reject"):
+        from dedup import NearDuplicateIndex
+        os.makedirs(output_dir, exist_ok=True)
+        self.dedup = NearDuplicateIndex(threshold, path=os.path.join(output_dir, "minhash_signatures.bin"))
+        self.dedup_mode = mode
+
+    def enable_scheduler(self, output_dir: str, rejection_weight: float = 4.0):
+        # The generators have no story starters, so every cell has starter None
+        os.makedirs(output_dir, exist_ok=True)
+        cells = [(category, aspect, None) for category, aspect in self.aspect_list]
+        self.scheduler = CoverageScheduler(cells, os.path.join(output_dir, "coverage_index.json"), rejection_weight)
+
+    def load_schedule(self, stories: StoryStore):
+        if self.scheduler is None:
+            return
+        source = self.scheduler.load(stories)
+        coverage = self.scheduler.coverage()
+        logger.info(f"Coverage from the {source}: {coverage['stories']} stories over {coverage['cells']} cells "
+                    f"(min {coverage['min']}, max {coverage['max']}, {coverage['empty_cells']} empty)")
+
+    def enable_catalog(self, output_dir: str):
+        # Stories are catalogued at every checkpoint; the first one also catches up with stories written earlier
+        from catalog import Catalog
+        os.makedirs(output_dir, exist_ok=True)
+        self.catalog = Catalog(os.path.join(output_dir, "catalog.sqlite"))
+
+    def release_batch(self, slots: list, skipped: bool = False):
+        # Slots of a request that produced no stories go back to the scheduler
+        if self.scheduler is not None:
+            for category, aspect, _, _ in slots:
+                self.scheduler.release((category, aspect, None), skipped)
+
+    def fail_batch(self, slots: list, error: Exception) -> str:
+        # The API call of a request failed for good; returns the error class
+        error_class = classify_error(error)
+        logger.warning(f"Gemini API error ({error_class}): {error}")
+        self.retry_policy.check_permanent_streak(error)
+        if self.scheduler is not None and error_class not in RETRYABLE:
+            # The same prompt cannot succeed, so the scheduler moves on to other cells before trying this one again
+            for category, aspect, _, _ in slots:
+                self.scheduler.fail((category, aspect, None))
+        else:
+            self.release_batch(slots)
+        return error_class
+
+    def enable_validation(self, max_retries: int = 2, min_words: int = 100):
+        # The patterns come from the prompt itself, so they follow any change to create_prompt
+        self.response_format = ResponseFormat.from_prompt(self.create_prompt("{category}", "{aspect}"), min_words)
+        self.max_validation_retries = max_retries
+
+    def reject_story(self, slot: tuple, reason: str):
+        category, aspect, _, sample_index = slot
+        self.metrics.reject(reason)
+        key = (category, aspect, sample_index)
+        attempts = self.validation_attempts.get(key, 0) + 1
+        # With several candidates per prompt, the other candidates already stand in for a rejected one
+        if self.candidate_count == 1 and attempts <= self.max_validation_retries:
+            self.validation_attempts[key] = attempts
+            self.retry_slots.append(slot)
+            self.metrics.count("requeued_stories")
+            logger.info("Rejected story for %s / %s (%s), re-queued (retry %d of %d)", category, aspect, reason,
+                        attempts, self.max_validation_retries)
+            return
+        self.validation_attempts.pop(key, None)
+        logger.info("Rejected story for %s / %s (%s)", category, aspect, reason)
+        if self.scheduler is not None:
+            if self.candidate_count == 1:
+                # A cell that keeps failing the format is treated like one that keeps producing duplicates
+                self.scheduler.record((category, aspect, None), accepted=False)
+            else:
+                self.scheduler.release((category, aspect, None))
+
+    def validate_existing(self, output_dir: str) -> Dict:
+        stories = StoryStore(output_dir)
+        start = time.time()
+        report = validate_stories(stories, self.response_format)
+        stories.close()
+        counts = report["counts"]
+        logger.info(f"Validated {sum(counts.values())} stories in {time.time() - start:.1f}s: "
+                    f"{counts['valid']} valid")
+        for reason in REASONS:
+            if counts[reason]:
+                logger.info(f"- {reason}: {counts[reason]}")
+        return report
+
+    def load_dedup_index(self, stories: StoryStore):
+        if self.dedup is None or len(stories) <= self.dedup.max_id:
+            return
+        start = time.time()
+        loaded = self.dedup.bulk_load(stories)
+        logger.info(f"Indexed {loaded} existing stories for near-duplicate detection in {time.time() - start:.1f}s")
+
+    def accept_story(self, stories: StoryStore, output_dir: str, story: str, chars: int, category: str,
+                     aspect: str, cached: bool, **fields) -> bool:
+        extra = dict(fields)
+        if self.dedup is not None:
+            with self.metrics.phase("validation"):
+                group = self.dedup.group_id(category, aspect)
+                signature = self.dedup.signature(story)
+                match = self.dedup.query(signature, group)
+            if match is not None:
+                action = "rejecting" if self.dedup_mode == "reject" else "flagged"
+                logger.info("Near-duplicate of story #%d (similarity %.2f), %s", match[0], match[1], action)
+                self.metrics.count("duplicates")
+                if self.dedup_mode == "reject":
+                    if self.scheduler is not None:
+                        self.scheduler.record((category, aspect, extra.get("starter")), accepted=False)
+                    return False
+                extra.update(near_duplicate_of=match[0], similarity=round(match[1], 3))
+
+        self.stories_generated += 1
+        self.characters_generated += chars
+        with self.metrics.phase("persistence"):
+            record = stories.append(story, category, aspect, chars=chars, cached=cached,
+                                    state=self.progress_counters(), **extra)
+        self.metrics.count("stories")
+        self.metrics.count("characters", chars)
+        if cached:
+            self.metrics.count("cached_stories")
+        if self.dedup is not None:
+            self.dedup.add(record["seq"], signature, group)
+        if self.scheduler is not None:
+            self.scheduler.record((category, aspect, extra.get("starter")))
+        if self.stories_generated % 5 == 0:
+            logger.debug("Saving checkpoint at %d stories", self.stories_generated)
+            self.save_stories(stories, output_dir)
+        return True
+
+    def call_model(self, prompt: str) -> tuple[str, object]:
+        response = self.model.generate_content(
+            [{'role': 'user', 'parts': [{'text': prompt}]}],
+            generation_config=self.generation_config
+        )
+        return response.text, getattr(response, "usage_metadata", None)
+
+    def call_model_streaming(self, prompt: str) -> tuple[str, object, Dict]:
+        start = time.monotonic()
+        stream = self.model.generate_content(
+            [{'role': 'user', 'parts': [{'text': prompt}]}],
+            generation_config=self.generation_config,
+            stream=True
+        )
+        return consume_stream(stream, self.max_story_words, self.max_story_chars, start)
+
+    def call_batch(self, prompt: str) -> tuple[list, object, Optional[Dict]]:
+        if self.streaming:
+            text, usage, stream_stats = self.call_model_streaming(prompt)
+            return [text], usage, stream_stats
+        # response.text raises ValueError for a blocked candidate; it comes back as None and the validator
+        # rejects and re-queues it
+        if self.candidate_count == 1 and self.pack_size == 1:
+            try:
+                text, usage = self.call_model(prompt)
+            except ValueError:
+                return [None], None, None
+            return [text], usage, None
+        response = self.model.generate_content(
+            [{'role': 'user', 'parts': [{'text': prompt}]}],
+            generation_config=self.request_config()
+        )
+        texts = []
+        for candidate in response.candidates:
+            try:
+                texts.append(candidate.text)
+            except ValueError:
+                texts.append(None)
+        return texts or [None], getattr(response, "usage_metadata", None), None
+
+    def finalize_story(self, text: str) -> str:
+        return text.strip() + self.EOS_TOKEN
+
+    def cached_batch(self, slots: list) -> Optional[list]:
+        records = [self.cached_record(prompt, sample_index) for _, _, prompt, sample_index in slots]
+        if any(record is None for record in records):
+            return None
+        results = []
+        for (category, aspect, _, _), record in zip(slots, records):
+            story = self.finalize_story(record["text"])
+            fields = {"truncated": True} if record.get("truncated") else {}
+            results.append((story, len(story), category, aspect, True, fields))
+        return results
+
+    def complete_batch(self, slots: list, prompt: str, texts: list, usage, stream_stats: Dict = None) -> list:
+        category, aspect = slots[0][:2]
+        response_text = "".join(text or "" for text in texts)
+        if self.pack_size > 1 and texts[0] is None:
+            texts = [None] * len(slots)
+        elif self.pack_size > 1:
+            try:
+                texts = split_packed_response(texts[0], [(category, aspect) for category, aspect, _, _ in slots])
+            except PackedResponseError:
+                # The response is paid for even when it cannot be split
+                self.metrics.count("rejected_responses")
+                self.ledger.record(prompt, response_text, usage, category=category, aspect=aspect, stories=0)
+                raise
+        fields = {}
+        if stream_stats is not None:
+            # Billed for everything received, but only the part within the ceiling is kept
+            text, truncated = clip_text(texts[0], self.max_story_words, self.max_story_chars)
+            texts = [text]
+            fields = {"truncated": truncated, "ttfc": stream_stats["ttfc"], "latency": stream_stats["latency"]}
+            self.stream_totals["requests"] += 1
+            self.stream_totals["truncated"] += truncated
+            self.stream_totals["ttfc"] += stream_stats["ttfc"]
+            self.stream_totals["latency"] += stream_stats["latency"]
+        reasons = [self.response_format.check(text, slot[1], complete=not fields.get("truncated"))
+                   for slot, text in zip(slots, texts)]
+        # Billed before anything is stored, but only the stories that passed validation count as produced
+        self.ledger.record(prompt, response_text, usage, category=category, aspect=aspect,
+                           stories=reasons.count(None))
+        results = []
+        for slot, text, reason in zip(slots, texts, reasons):
+            category, aspect, story_prompt, sample_index = slot
+            if reason is not None:
+                self.reject_story(slot, reason)
+                continue
+            self.validation_attempts.pop((category, aspect, sample_index), None)
+            # Cached per story, so a later run in any mode can replay it; only stories that passed validation
+            self.cache_response(story_prompt, sample_index, text, fields.get("truncated", False))
+            story = self.finalize_story(text)
+            results.append((story, len(story), category, aspect, False, fields))
+        return results
+
+    def generate_batch(self, slots: list, prompt: str, span: int) -> Optional[list]:
+        # None when the request is not cached and the remaining budget cannot cover its worst case
+        try:
+            with self.metrics.phase("cache"):
+                results = self.cached_batch(slots)
+        except CacheMiss:
+            self.release_batch(slots, skipped=True)
+            raise
+        if results is not None:
+            return results
+        if not self.ledger.can_afford(self.ledger.worst_case_cost(prompt, self.max_request_output_tokens())):
+            self.release_batch(slots, skipped=True)
+            return None
+
+        try:
+            with self.metrics.phase("api"):
+                texts, usage, stream_stats = self.retry_policy.call(lambda: self.call_batch(prompt))
+        except Exception as e:
+            if self.fail_batch(slots, e) not in RETRYABLE:
+                # Retrying the same prompt cannot succeed, move on to the next one
+                self.last_aspect_index += span
+            return []
+        self.metrics.count("requests")
+
+        # Past this point the request is paid for; anything else raised here is a bug and propagates
+        try:
+            with self.metrics.phase("validation"):
+                results = self.complete_batch(slots, prompt, texts, usage, stream_stats)
+        except PackedResponseError as e:
+            logger.warning(f"Discarding packed response: {e}")
+            self.release_batch(slots)
+            results = []
+        if not results:
+            # Every story was rejected, and re-queued unless out of retries; this position is done
+            self.last_aspect_index += span
+        return results
+
+    def save_progress_state(self, output_dir: str):
+        state = {
+            "stories_generated": self.stories_generated,
+            "characters_generated": self.characters_generated,
+            "last_aspect_index": self.last_aspect_index,
+            "budget_used": self.ledger.spent,
+            "cost_totals": self.ledger.summary(),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        
+        state_file = os.path.join(output_dir, "generation_state.json")
+        atomic_write_json(state_file, state)
+        
+        logger.debug(f"Progress state saved to {state_file}")
+
+    def progress_counters(self) -> Dict:
+        return {
+            "stories_generated": self.stories_generated,
+            "characters_generated": self.characters_generated,
+            "last_aspect_index": self.last_aspect_index,
+        }
+
+    def load_progress_state(self, output_dir: str, stories: StoryStore = None) -> Dict:
+        state_file = os.path.join(output_dir, "generation_state.json")
+        state, source = recover_counters(state_file, stories)
+        if not state:
+            logger.info("No previous state found, starting fresh")
+            return {}
+
+        self.stories_generated = state["stories_generated"]
+        self.characters_generated = state["characters_generated"]
+        self.last_aspect_index = state["last_aspect_index"]
+        if source == "log":
+            logger.info(f"Recovered previous state from the story log tail ({stories.current_segment})")
+        else:
+            logger.info(f"Loaded previous state from {state_file}")
+        logger.info("Last run statistics:")
+        logger.info(f"- Stories generated: {self.stories_generated}")
+        logger.info(f"- Characters generated: {self.characters_generated:,}")
+        logger.info(f"- Budget used: ${self.ledger.spent:.2f}")
+        if "timestamp" in state:
+            logger.info(f"- Last timestamp: {state['timestamp']}")
+        return state
+
+    def open_ledger(self, output_dir: str) -> CostLedger:
+        path = os.path.join(output_dir, "cost_ledger.jsonl")
+        # Runs from before the ledger only kept their spend as budget_used in the state file
+        legacy = None if os.path.exists(path) else read_json(os.path.join(output_dir, "generation_state.json"))
+        self.ledger = CostLedger(self.MODEL_ID, self.BUDGET, self.price_tables, path)
+        if legacy and legacy.get("budget_used"):
+            self.ledger.open_balance(legacy["budget_used"], legacy.get("stories_generated", 0),
+                                     source="generation_state.json")
+            logger.info(f"Carried ${legacy['budget_used']:.2f} of earlier spend over from generation_state.json")
+        return self.ledger
+
+    def expected_story_chars(self) -> int:
+        if self.stories_generated:
+            return self.characters_generated // self.stories_generated
+        return DEFAULT_STORY_CHARS
+
+    def report_projection(self, stories: int = None) -> Dict:
+        slots, prompt, span = self.build_batch(self.last_aspect_index, reserve=False)
+        projection = self.ledger.project(prompt, self.expected_story_chars(), stories, len(slots))
+        logger.info(f"Projected cost per story: ${projection['cost_per_story']:.5f} at {len(slots)} stories/request "
+                    f"({projection['input_share']:.0%} of it is prompt input)")
+        totals = self.ledger.summary()
+        if totals["requests"] and totals["stories"]:
+            # The projection assumes every story is kept; the ledger only counts the ones that passed validation
+            logger.info(f"So far: ${totals['cost'] / totals['stories']:.5f} per accepted story, "
+                        f"{totals['stories'] / totals['requests']:.2f} accepted per paid request")
+        logger.info(f"Remaining budget covers ~{projection['stories_in_remaining_budget']:,} more stories")
+        if stories is not None:
+            logger.info(f"Projected cost for {stories:,} stories: ${projection['cost_for_stories']:.2f}")
+        return projection
+
+    def report_cost_stats(self):
+        totals = self.ledger.summary()
+        logger.info(f"Final cost: ${totals['cost']:.2f} of ${self.BUDGET} ({totals['requests']} paid requests)")
+        logger.info(f"Input: {totals['input_chars']:,} chars / {totals['input_tokens']:,} tokens, "
+                    f"output: {totals['output_chars']:,} chars / {totals['output_tokens']:,} tokens")
+        if self.stories_generated:
+            logger.info(f"Average cost/story: ${totals['cost'] / self.stories_generated:.5f}")
+        if totals['requests']:
+            logger.info(f"Stories per paid request: {totals['stories'] / totals['requests']:.2f}")
+
+    def save_stories(self, stories: StoryStore, output_dir: str):
+        with self.metrics.phase("persistence"):
+            stories.checkpoint()
+            self.ledger.sync()
+            self.save_progress_state(output_dir)
+            if self.scheduler is not None:
+                self.scheduler.save(len(stories))
+            if self.catalog is not None:
+                self.catalog.sync_store(stories)
+
+        logger.info(f"Progress saved: {len(stories)} stories ({stories.current_segment}), "
+                    f"${self.ledger.spent:.2f} of ${self.BUDGET} used, ${self.ledger.remaining:.2f} remaining")
+
+    def load_existing_stories(self, output_dir: str) -> StoryStore:
+        stories = StoryStore(output_dir)
+        legacy_file = os.path.join(output_dir, "stories.txt")
+        if len(stories) == 0 and os.path.exists(legacy_file):
+            imported = stories.import_text(legacy_file)
+            logger.info(f"Imported {imported} stories from {legacy_file} into {stories.current_segment}")
+        return stories
+
+    def export_stories(self, output_dir: str) -> str:
+        stories = StoryStore(output_dir)
+        stories_file = os.path.join(output_dir, "stories.txt")
+        exported = stories.export_text(stories_file)
+        stories.close()
+        logger.info(f"Exported {exported} stories to {stories_file}")
+        return stories_file
+
+    def generate_dataset(self, output_dir: str):
+        os.makedirs(output_dir, exist_ok=True)
+        stories = self.load_existing_stories(output_dir)
+        self.open_ledger(output_dir)
+        self.metrics.open(output_dir, self.ledger, self.retry_policy)
+        self.load_progress_state(output_dir, stories)
+        self.load_dedup_index(stories)
+        self.load_schedule(stories)
+        
+        logger.info(f"Generating stories within ${self.BUDGET} budget...")
+        logger.info(f"Budget remaining: ${self.ledger.remaining:.2f}")
+        self.report_projection()
+        logger.info(f"Starting from story #{len(stories) + 1}")
+        
+        replay_misses = 0
+        try:
+            while True:
+                with self.metrics.phase("prompt"):
+                    slots, prompt, span = self.build_batch(self.last_aspect_index)
+                logger.debug("Requesting story #%d (%d per request)", len(stories) + 1, len(slots))
+                
+                try:
+                    # Cached responses are free, so the budget is only checked once the cache misses
+                    results = self.generate_batch(slots, prompt, span)
+                except CacheMiss:
+                    replay_misses += span
+                    self.last_aspect_index += span
+                    if replay_misses >= self.cycle_length:
+                        logger.info("No cached responses left to replay. Stopping.")
+                        break
+                    continue
+                replay_misses = 0
+                if results is None:
+                    logger.info("Remaining budget cannot cover another request. Stopping generation.")
+                    break
+                
+                cached = bool(results) and all(result[4] for result in results)
+                if results:
+                    self.last_aspect_index += span
+                for story, chars, category, aspect, from_cache, fields in results:
+                    logger.info("Story #%d (%s / %s): %d characters%s, budget used $%.4f", len(stories) + 1, category,
+                                aspect, chars, " (from cache, not billed)" if from_cache else "", self.ledger.spent)
+                    preview = story[:150] + "..." if len(story) > 150 else story
+                    logger.debug("New story preview: %s", preview)
+                    if "ttfc" in fields:
+                        logger.debug("Streamed: first chunk after %.2fs, done after %.2fs%s", fields['ttfc'],
+                                     fields['latency'], " (truncated at the length limit)" if fields['truncated'] else "")
+                    
+                    self.accept_story(stories, output_dir, story, chars, category, aspect, from_cache, **fields)
+                
+                if not cached:
+                    with self.metrics.phase("sleep"):
+                        time.sleep(self.request_interval)
+                self.metrics.maybe_flush()
+                
+        except KeyboardInterrupt:
+            logger.info("Generation interrupted by user. Saving progress...")
+            self.save_stories(stories, output_dir)
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            logger.info("Saving current progress...")
+            self.save_stories(stories, output_dir)
+            raise
+        
+        self.save_stories(stories, output_dir)
+        stories.close()
+        self.ledger.close()
+        self.metrics.flush()
+        
+        logger.info("Final Statistics:")
+        logger.info(f"Stories generated: {self.stories_generated}")
+        logger.info(f"Total characters: {self.characters_generated:,}")
+        self.report_cost_stats()
+        self.report_cache_stats()
+        self.report_stream_stats()
+        self.report_error_stats()
+        logger.info(self.metrics.report())
+        logger.info(f"Average chars/story: {self.characters_generated / self.stories_generated if self.stories_generated > 0 else 0:.2f}")
+
+    def generate_dataset_concurrent(self, output_dir: str, max_concurrency: int = 8,
+                                    requests_per_minute: float = 60, chars_per_minute: float = None):
+        os.makedirs(output_dir, exist_ok=True)
+        stories = self.load_existing_stories(output_dir)
+        self.open_ledger(output_dir)
+        self.metrics.open(output_dir, self.ledger, self.retry_policy)
+        self.load_progress_state(output_dir, stories)
+        self.load_dedup_index(stories)
+        self.load_schedule(stories)
+
+        logger.info(f"Generating stories within ${self.BUDGET} budget ({max_concurrency} concurrent requests)...")
+        logger.info(f"Budget remaining: ${self.ledger.remaining:.2f}")
+        self.report_projection()
+        logger.info(f"Starting from story #{len(stories) + 1}")
+
+        def on_batch(results: list, span: int):
+            self.last_aspect_index += span
+            for story, chars, category, aspect, cached, fields in results:
+                if self.accept_story(stories, output_dir, story, chars, category, aspect, cached, **fields):
+                    logger.info("Story #%d (%s / %s): %d characters%s", len(stories), category, aspect, chars,
+                                " (cached)" if cached else "")
+            self.metrics.maybe_flush()
+
+        # concurrent.futures is only imported for concurrent runs
+        from concurrent_generation import ConcurrentGenerationEngine
+        engine = ConcurrentGenerationEngine(self, max_concurrency, requests_per_minute, chars_per_minute)
+        try:
+            engine.run(on_batch)
+        except KeyboardInterrupt:
+            logger.info("Generation interrupted by user. Saving progress...")
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            logger.info("Saving current progress...")
+            self.save_stories(stories, output_dir)
+            raise
+
+        self.save_stories(stories, output_dir)
+        stories.close()
+        self.ledger.close()
+        self.metrics.flush()
+
+        logger.info("Final Statistics:")
+        logger.info(f"Requests sent: {engine.requests_sent} ({engine.requests_failed} failed)")
+        logger.info(f"Stories generated: {self.stories_generated}")
+        logger.info(f"Total characters: {self.characters_generated:,}")
+        self.report_cost_stats()
+        self.report_cache_stats()
+        self.report_stream_stats()
+        self.report_error_stats()
+        logger.info(self.metrics.report())
+
+    def generate_dataset_batch(self, output_dir: str, step: str = "run", backend=None, job_dir: str = None,
+                               samples: int = 1, shard_size: int = 1000, poll_interval: float = 60,
+                               requests_per_minute: float = 60):
+        from batch_pipeline import BatchJob, LocalBatchBackend
+        from rate_limiter import RateLimiter
+        os.makedirs(output_dir, exist_ok=True)
+        stories = self.load_existing_stories(output_dir)
+        self.open_ledger(output_dir)
+        self.metrics.open(output_dir, self.ledger, self.retry_policy)
+        self.load_progress_state(output_dir, stories)
+        self.load_dedup_index(stories)
+        job = BatchJob(job_dir or os.path.join(output_dir, "batch_job"))
+        # The local backend makes online calls, so they are paced and retried like the realtime loop
+        backend = backend or LocalBatchBackend(self.model, self.retry_policy, RateLimiter(requests_per_minute))
+
+        if step in ("prepare", "run"):
+            job.prepare(self, stories, samples, shard_size)
+        while True:
+            if step in ("submit", "run"):
+                job.submit(backend, self.ledger, self.generation_config['max_output_tokens'])
+            if step == "run":
+                job.wait(backend, poll_interval)
+            if step not in ("ingest", "run"):
+                break
+            counts = job.ingest(self, stories, output_dir)
+            logger.info(f"Ingested {counts['accepted']} stories ({counts['duplicates']} near-duplicates, "
+                        f"{counts['failed']} failed and {counts['rejected']} rejected requests, "
+                        f"{counts['requeued']} of them re-queued, {counts['skipped']} already stored)")
+            # A full run also submits the follow-up shards of re-queued requests
+            if step != "run" or not counts["requeued"]:
+                break
+
+        self.save_stories(stories, output_dir)
+        stories.close()
+        self.ledger.close()
+
+        status = job.status()
+        logger.info(f"Batch job: {status['ingested']}/{status['shards']} shards ingested, "
+                    f"{status['completed']} completed, {status['submitted']} submitted")
+        logger.info(f"Stories generated: {self.stories_generated}")
+        logger.info(f"Total characters: {self.characters_generated:,}")
+        self.report_cost_stats()
+
+
+def load_generator_module(path: str, module_name: str = "rocket_league_generator"):
+    # The generator scripts have dashes in their file names, so they are loaded by path rather than imported
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_cli(generator_class):
+    # The command line of both generator scripts
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output-dir", default="rocket_league_output_v2")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Number of in-flight requests; 1 keeps the sequential loop")
+    parser.add_argument("--requests-per-minute", type=float, default=60)
+    parser.add_argument("--chars-per-minute", type=float, default=None)
+    parser.add_argument("--cache-dir", default=None,
+                        help="Reuse responses for identical prompts from this directory")
+    parser.add_argument("--cache-max-mb", type=int, default=1024)
+    parser.add_argument("--replay-only", action="store_true",
+                        help="Only use cached responses, never call the API")
+    parser.add_argument("--dedup", choices=["off", "flag", "reject"], default="off",
+                        help="Near-duplicate check against stories with the same category/aspect")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8)
+    parser.add_argument("--skip-format-check", action="store_true",
+                        help="Only reject empty or blocked responses, not ones that miss the prompt's opening, "
+                             "sections or word limit")
+    parser.add_argument("--max-invalid-retries", type=int, default=2,
+                        help="Times a rejected story is re-queued before its slot is given up")
+    parser.add_argument("--min-words", type=int, default=100, help="Shorter stories are rejected")
+    parser.add_argument("--validate-existing", action="store_true",
+                        help="Check the stored stories against the prompt format and exit")
+    parser.add_argument("--schedule", choices=["coverage", "shuffled"], default="coverage",
+                        help="coverage: always ask for the least-covered cell; shuffled: walk the shuffled list")
+    parser.add_argument("--rejection-weight", type=float, default=4.0,
+                        help="Stories' worth of coverage a rejected near-duplicate counts for under --schedule coverage")
+    parser.add_argument("--catalog", action="store_true",
+                        help="Keep <output-dir>/catalog.sqlite (category/aspect index and full-text search) up to date")
+    parser.add_argument("--candidates", type=int, default=1,
+                        help="Stories per request via candidate_count (one prompt, several samples)")
+    parser.add_argument("--pack", type=int, default=1,
+                        help="Pack this many aspects into one request and split the response")
+    parser.add_argument("--batch", choices=["prepare", "submit", "ingest", "run"], default=None,
+                        help="Generate through batch prediction instead of the realtime loop")
+    parser.add_argument("--batch-dir", default=None, help="Batch job directory (default: <output-dir>/batch_job)")
+    parser.add_argument("--batch-backend", choices=["local", "vertex"], default="local")
+    parser.add_argument("--gcs-bucket", default=None, help="Bucket for batch input/output with --batch-backend vertex")
+    parser.add_argument("--samples", type=int, default=1, help="Stories per grid cell in batch mode")
+    parser.add_argument("--shard-size", type=int, default=1000)
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream responses and cancel once a story passes the length limit")
+    parser.add_argument("--max-words", type=int, default=None,
+                        help="Word ceiling for streamed stories (default: the limit stated in the prompt)")
+    parser.add_argument("--max-chars", type=int, default=None, help="Character ceiling for streamed stories")
+    parser.add_argument("--price-table", default=None,
+                        help="JSON file with per-model prices, merged over the built-in table")
+    parser.add_argument("--project", type=int, default=None, metavar="STORIES",
+                        help="Print the projected cost for this many stories and exit")
+    parser.add_argument("--export", action="store_true",
+                        help="Write stories.txt from the story store and exit")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO")
+    parser.add_argument("--metrics-interval", type=float, default=30,
+                        help="Seconds between metrics.jsonl / metrics.prom snapshots in the output directory")
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level), format="%(asctime)s %(levelname)s %(message)s")
+
+    generator = generator_class()
+    generator.price_tables = load_price_tables(args.price_table)
+    generator.metrics.interval = args.metrics_interval
+    generator.configure_batching(args.candidates, args.pack)
+    if args.stream:
+        generator.enable_streaming(args.max_words, args.max_chars)
+    if args.export:
+        generator.export_stories(args.output_dir)
+        return
+    if not args.skip_format_check:
+        generator.enable_validation(args.max_invalid_retries, args.min_words)
+    if args.validate_existing:
+        generator.validate_existing(args.output_dir)
+        return
+    if args.project is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        stories = generator.load_existing_stories(args.output_dir)
+        generator.open_ledger(args.output_dir)
+        generator.load_progress_state(args.output_dir, stories)
+        generator.report_projection(args.project)
+        return
+    if args.cache_dir or args.replay_only:
+        generator.enable_cache(args.cache_dir or os.path.join(args.output_dir, "response_cache"),
+                               args.cache_max_mb * 1024 * 1024, args.replay_only)
+    if args.dedup != "off":
+        generator.enable_dedup(args.output_dir, args.dedup_threshold, args.dedup)
+    if args.schedule == "coverage" and not args.batch:
+        generator.enable_scheduler(args.output_dir, args.rejection_weight)
+    if args.catalog:
+        generator.enable_catalog(args.output_dir)
+    if args.batch:
+        backend = None
+        if args.batch_backend == "vertex":
+            if not args.gcs_bucket:
+                parser.error("--batch-backend vertex needs --gcs-bucket")
+            from batch_pipeline import VertexBatchBackend
+            backend = VertexBatchBackend(generator.MODEL_ID, args.gcs_bucket)
+        generator.generate_dataset_batch(args.output_dir, args.batch, backend, args.batch_dir,
+                                         args.samples, args.shard_size, requests_per_minute=args.requests_per_minute)
+        return
+    if args.concurrency > 1:
+        generator.generate_dataset_concurrent(args.output_dir, args.concurrency,
+                                              args.requests_per_minute, args.chars_per_minute)
+    else:
+        generator.generate_dataset(args.output_dir)
@@ -0,0 +1,141 @@
+import glob
+import json
+import os
+import time
+from typing import Dict, Iterator, Optional
+
+from checkpoint import read_last_line, repair_tail
+from corpus_reader import CorpusReader
+
+STORY_SEPARATOR = "\n\n---\n\n"
+
+
+class StoryStore:
+    SEGMENT_PATTERN = "stories_{:06d}.jsonl"
+
+    def __init__(self, directory: str, segment_max_bytes: int = 64 * 1024 * 1024, fsync_every: int = 20):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_every = fsync_every
+        self.unsynced = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = sorted(glob.glob(os.path.join(directory, "stories_*.jsonl")))
+        if not self.segments:
+            self.segments.append(self._segment_path(1))
+        else:
+            repair_tail(self.segments[-1])
+
+        tail = self.tail_record()
+        if tail is None:
+            self.count = 0
+        elif "seq" in tail:
+            self.count = tail["seq"]
+        else:
+            self.count = sum(self._count_lines(path) for path in self.segments)
+        self.file = open(self.segments[-1], 'a', encoding='utf-8')
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, self.SEGMENT_PATTERN.format(number))
+
+    @staticmethod
+    def _count_lines(path: str) -> int:
+        count = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                count += block.count(b'\n')
+        return count
+
+    def tail_record(self) -> Optional[Dict]:
+        if getattr(self, "file", None) is not None:
+            self.file.flush()
+        for path in reversed(self.segments):
+            if not os.path.exists(path):
+                continue
+            line = read_last_line(path)
+            if line and line.endswith(b'\n'):
+                return json.loads(line)
+        return None
+
+    @property
+    def current_segment(self) -> str:
+        return self.segments[-1]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, text: str, category: str = None, aspect: str = None, starter: str = None,
+               chars: int = None, **extra) -> Dict:
+        record = {
+            "seq": self.count + 1,
+            "text": text,
+            "category": category,
+            "aspect": aspect,
+            "starter": starter,
+            "chars": len(text) if chars is None else chars,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        record.update(extra)
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.count += 1
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every:
+            self.sync()
+        return record
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def rotate(self):
+        # Closed segments are never written again, so they double as backups
+        self.sync()
+        self.file.close()
+        self.segments.append(self._segment_path(len(self.segments) + 1))
+        self.file = open(self.segments[-1], 'a', encoding='utf-8')
+
+    def checkpoint(self):
+        self.sync()
+        if self.file.tell() >= self.segment_max_bytes:
+            self.rotate()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __iter__(self) -> Iterator[Dict]:
+        self.file.flush()
+        for path in self.segments:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.endswith("\n"):
+                        yield json.loads(line)
+
+    def iter_texts(self, category: Optional[str] = None) -> Iterator[str]:
+        for record in self:
+            if category is None or record["category"] == category:
+                yield record["text"]
+
+    def export_text(self, path: str, separator: str = STORY_SEPARATOR) -> int:
+        tmp_path = path + ".tmp"
+        written = 0
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for text in self.iter_texts():
+                if written:
+                    f.write(separator)
+                f.write(text)
+                written += 1
+        os.replace(tmp_path, path)
+        return written
+
+    def import_text(self, path: str, separator: str = None) -> int:
+        imported = 0
+        with CorpusReader(path, separator, strip_eos=False) as reader:
+            for text in reader:
+                self.append(text)
+                imported += 1
+        self.sync()
+        return imported
@@ -0,0 +1,72 @@
+import re
+import time
+from typing import Dict, Optional
+
+WORD_PATTERN = re.compile(r"\S+")
+SENTENCE_END = re.compile(r"[.!?][\"')\]*]*(?=\s)")
+
+
+def over_limit(text: str, max_words: Optional[int] = None, max_chars: Optional[int] = None) -> bool:
+    if max_chars is not None and len(text) > max_chars:
+        return True
+    return max_words is not None and len(WORD_PATTERN.findall(text)) > max_words
+
+
+def clip_text(text: str, max_words: Optional[int] = None, max_chars: Optional[int] = None) -> tuple[str, bool]:
+    end = len(text.rstrip())
+    if max_words is not None:
+        for count, match in enumerate(WORD_PATTERN.finditer(text), 1):
+            if count == max_words:
+                end = min(end, match.end())
+                break
+    if max_chars is not None:
+        end = min(end, max_chars)
+    if end >= len(text.rstrip()):
+        return text, False
+
+    clipped = text[:end]
+    # End on a full sentence when one finishes in the second half of what is kept
+    sentence_ends = [match.end() for match in SENTENCE_END.finditer(clipped + " ")]
+    if sentence_ends and sentence_ends[-1] >= end // 2:
+        clipped = clipped[:sentence_ends[-1]]
+    return clipped.rstrip(), True
+
+
+def consume_stream(stream, max_words: Optional[int] = None, max_chars: Optional[int] = None,
+                   start: Optional[float] = None) -> tuple[str, object, Dict]:
+    # start should be taken before the request is sent, so time-to-first-chunk includes the round trip
+    start = time.monotonic() if start is None else start
+    first_chunk = None
+    parts = []
+    usage = None
+    chunks = 0
+    cancelled = False
+    try:
+        for chunk in stream:
+            chunks += 1
+            if first_chunk is None:
+                first_chunk = time.monotonic() - start
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            try:
+                parts.append(chunk.text)
+            except ValueError:
+                # The last chunk can carry only the finish reason
+                continue
+            if over_limit("".join(parts), max_words, max_chars):
+                cancelled = True
+                break
+    finally:
+        if cancelled and hasattr(stream, "close"):
+            # Closing the generator drops the underlying gRPC stream, which cancels generation server side
+            stream.close()
+
+    text = "".join(parts)
+    if not text:
+        raise ValueError("Streamed response contained no text")
+    stats = {
+        "ttfc": round(first_chunk, 3),
+        "latency": round(time.monotonic() - start, 3),
+        "chunks": chunks,
+        "cancelled": cancelled,
+    }
+    return text, usage, stats
@@ -0,0 +1,328 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from checkpoint import atomic_write_json, read_json
+from corpus_reader import CorpusReader
+
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+EOS_MARKERS = (" EOS", "[EOS]")
+JSONL_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+class ByteTokenizer:
+    # Dependency-free fallback: UTF-8 bytes as ids, with one extra id for EOS
+    name = "bytes"
+    vocab_size = 257
+    eos_id = 256
+
+    def encode(self, text: str) -> np.ndarray:
+        return np.frombuffer(text.encode('utf-8'), dtype=np.uint8).astype(np.uint32)
+
+
+class TiktokenTokenizer:
+    def __init__(self, encoding: str):
+        import tiktoken
+        self.name = f"tiktoken:{encoding}"
+        self.encoding = tiktoken.get_encoding(encoding)
+        self.vocab_size = self.encoding.n_vocab
+        self.eos_id = self.encoding.eot_token
+
+    def encode(self, text: str) -> np.ndarray:
+        return np.array(self.encoding.encode_ordinary(text), dtype=np.uint32)
+
+
+class HFTokenizer:
+    def __init__(self, path: str, eos_token: str = "</s>"):
+        from tokenizers import Tokenizer
+        self.name = f"hf:{path}"
+        self.tokenizer = Tokenizer.from_file(path)
+        self.vocab_size = self.tokenizer.get_vocab_size()
+        self.eos_id = self.tokenizer.token_to_id(eos_token)
+        if self.eos_id is None:
+            raise ValueError(f"{path} has no {eos_token!r} token; pass --eos-token")
+
+    def encode(self, text: str) -> np.ndarray:
+        return np.array(self.tokenizer.encode(text, add_special_tokens=False).ids, dtype=np.uint32)
+
+
+def load_tokenizer(spec: str, eos_token: str = "</s>"):
+    if spec == "bytes":
+        return ByteTokenizer()
+    if spec.startswith("tiktoken:"):
+        return TiktokenTokenizer(spec.split(":", 1)[1])
+    if spec.startswith("hf:"):
+        return HFTokenizer(spec.split(":", 1)[1], eos_token)
+    raise ValueError(f"Unknown tokenizer {spec!r}, expected bytes, tiktoken:<encoding> or hf:<tokenizer.json>")
+
+
+def token_dtype(vocab_size: int):
+    return np.uint16 if vocab_size <= 1 << 16 else np.uint32
+
+
+def strip_eos_marker(text: str) -> str:
+    text = text.strip()
+    for marker in EOS_MARKERS:
+        if text.endswith(marker):
+            return text[:-len(marker)].rstrip()
+    return text
+
+
+# Each worker process loads the tokenizer once
+_worker_tokenizer = None
+
+
+def _init_worker(spec: str, eos_token: str):
+    global _worker_tokenizer
+    _worker_tokenizer = load_tokenizer(spec, eos_token)
+
+
+def _task_texts(task: tuple) -> Iterator[str]:
+    kind, path, start, end = task
+    if kind == "text":
+        with CorpusReader(path) as reader:
+            for index in range(start, end):
+                yield reader[index]
+        return
+    # Story store segment: lines starting inside [start, end)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                break
+            yield json.loads(line)["text"]
+
+
+def _tokenize_task(task: tuple) -> tuple[np.ndarray, int]:
+    tokenizer = _worker_tokenizer
+    pieces = []
+    documents = 0
+    for text in _task_texts(task):
+        text = strip_eos_marker(text)
+        if not text:
+            continue
+        pieces.append(tokenizer.encode(text))
+        pieces.append(np.array([tokenizer.eos_id], dtype=np.uint32))
+        documents += 1
+    if not pieces:
+        return np.zeros(0, dtype=np.uint32), 0
+    return np.concatenate(pieces), documents
+
+
+def expand_sources(paths: List[str]) -> List[str]:
+    # A story store directory contributes its JSONL segments; anything else is read as a text corpus
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources.extend(sorted(glob.glob(os.path.join(path, "stories_*.jsonl"))))
+        else:
+            sources.append(path)
+    return [os.path.abspath(path) for path in sources]
+
+
+def source_tasks(path: str, chunk_stories: int) -> List[tuple]:
+    if path.endswith(".jsonl"):
+        size = os.path.getsize(path)
+        boundaries = [0]
+        with open(path, 'rb') as f:
+            while boundaries[-1] + JSONL_CHUNK_BYTES < size:
+                f.seek(boundaries[-1] + JSONL_CHUNK_BYTES)
+                f.readline()
+                boundaries.append(f.tell())
+        boundaries.append(size)
+        return [("jsonl", path, start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+    # Building the offset index here lets every worker reopen the file without rescanning it
+    with CorpusReader(path) as reader:
+        count = len(reader)
+    return [("text", path, start, min(start + chunk_stories, count)) for start in range(0, count, chunk_stories)]
+
+
+def source_signature(path: str) -> Dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class ShardWriter:
+    # Packs a token stream into rows of seq_len, rows_per_shard rows per file
+    def __init__(self, output_dir: str, prefix: str, seq_len: int, rows_per_shard: int, dtype, pad_id: int):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.seq_len = seq_len
+        self.rows_per_shard = rows_per_shard
+        self.dtype = dtype
+        self.pad_id = pad_id
+        self.carry = np.zeros(0, dtype=dtype)
+        self.shards = []
+        self.file = None
+        self.rows = 0
+        self.tokens = 0
+
+    def _open(self):
+        name = f"{self.prefix}-{len(self.shards):04d}.bin"
+        self.shards.append({"path": name, "rows": 0, "tokens": 0})
+        self.file = open(os.path.join(self.output_dir, name + ".tmp"), 'wb')
+
+    def _write_rows(self, rows: np.ndarray, tokens: int):
+        if self.file is None:
+            self._open()
+        self.file.write(rows.tobytes())
+        self.shards[-1]["rows"] += len(rows)
+        self.shards[-1]["tokens"] += tokens
+        if self.shards[-1]["rows"] >= self.rows_per_shard:
+            self._close_shard()
+
+    def _close_shard(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        path = os.path.join(self.output_dir, self.shards[-1]["path"])
+        os.replace(path + ".tmp", path)
+
+    def add(self, tokens: np.ndarray):
+        tokens = np.concatenate([self.carry, tokens.astype(self.dtype)])
+        self.tokens += len(tokens) - len(self.carry)
+        full = len(tokens) // self.seq_len
+        position = 0
+        while position < full:
+            count = min(full - position, self.rows_per_shard - (self.shards[-1]["rows"] if self.file else 0))
+            rows = tokens[position * self.seq_len:(position + count) * self.seq_len].reshape(count, self.seq_len)
+            self._write_rows(rows, rows.size)
+            position += count
+        self.carry = tokens[full * self.seq_len:]
+
+    def finish(self) -> List[Dict]:
+        if len(self.carry):
+            # The last row is padded; "tokens" in the index tells the loader how many are real
+            row = np.full(self.seq_len, self.pad_id, dtype=self.dtype)
+            row[:len(self.carry)] = self.carry
+            self._write_rows(row.reshape(1, self.seq_len), len(self.carry))
+            self.carry = np.zeros(0, dtype=self.dtype)
+        if self.file is not None:
+            self._close_shard()
+        return self.shards
+
+
+def tokenize_corpus(paths: List[str], output_dir: str, tokenizer_spec: str = "bytes", eos_token: str = "</s>",
+                    seq_len: int = 2048, rows_per_shard: int = 8192, workers: Optional[int] = None,
+                    chunk_stories: int = 1000) -> Dict:
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = load_tokenizer(tokenizer_spec, eos_token)
+    dtype = token_dtype(tokenizer.vocab_size)
+    settings = {"version": INDEX_VERSION, "tokenizer": tokenizer.name, "vocab_size": tokenizer.vocab_size,
+                "eos_id": tokenizer.eos_id, "dtype": np.dtype(dtype).name, "seq_len": seq_len}
+
+    index_path = os.path.join(output_dir, INDEX_FILE)
+    index = read_json(index_path) or {}
+    if any(index.get(key) != value for key, value in settings.items()):
+        # Different tokenizer or row length: nothing from the old index can be reused
+        index = dict(settings, sources={})
+    sources = expand_sources(paths)
+    stats = {"sources": len(sources), "skipped": 0, "tokenized": 0, "documents": 0, "tokens": 0, "seconds": 0.0}
+
+    for path in list(index["sources"]):
+        if path not in sources:
+            for shard in index["sources"].pop(path)["shards"]:
+                os.remove(os.path.join(output_dir, shard["path"]))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(tokenizer_spec, eos_token)) as pool:
+        for path in sources:
+            signature = source_signature(path)
+            previous = index["sources"].get(path)
+            if previous is not None and previous["signature"] == signature:
+                stats["skipped"] += 1
+                continue
+
+            prefix = f"{os.path.splitext(os.path.basename(path))[0]}-{hashlib.sha1(path.encode()).hexdigest()[:8]}"
+            writer = ShardWriter(output_dir, prefix, seq_len, rows_per_shard, dtype, tokenizer.eos_id)
+            documents = 0
+            # map keeps task order, so documents are packed in corpus order
+            for tokens, count in pool.map(_tokenize_task, source_tasks(path, chunk_stories)):
+                writer.add(tokens)
+                documents += count
+            shards = writer.finish()
+
+            if previous is not None:
+                names = {shard["path"] for shard in shards}
+                for shard in previous["shards"]:
+                    if shard["path"] not in names:
+                        os.remove(os.path.join(output_dir, shard["path"]))
+            index["sources"][path] = {"signature": signature, "documents": documents, "tokens": writer.tokens,
+                                      "shards": shards}
+            # Saved after every source so an interrupted run keeps what is finished
+            atomic_write_json(index_path, index)
+            stats["tokenized"] += 1
+            stats["documents"] += documents
+            stats["tokens"] += writer.tokens
+
+    atomic_write_json(index_path, index)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    stats["tokens_per_second"] = round(stats["tokens"] / stats["seconds"]) if stats["seconds"] else 0
+    return stats
+
+
+class TokenShards:
+    # Training-side reader: rows are numpy views into memory-mapped shard files, no copies
+    def __init__(self, output_dir: str):
+        index = read_json(os.path.join(output_dir, INDEX_FILE))
+        if index is None:
+            raise FileNotFoundError(f"No {INDEX_FILE} in {output_dir}")
+        self.seq_len = index["seq_len"]
+        self.eos_id = index["eos_id"]
+        self.dtype = np.dtype(index["dtype"])
+        self.shards = []
+        self.row_starts = []
+        rows = 0
+        for source in index["sources"].values():
+            for shard in source["shards"]:
+                self.row_starts.append(rows)
+                self.shards.append(np.memmap(os.path.join(output_dir, shard["path"]), dtype=self.dtype, mode='r',
+                                             shape=(shard["rows"], self.seq_len)))
+                rows += shard["rows"]
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, row: int) -> np.ndarray:
+        if row < 0:
+            row += self.rows
+        if not 0 <= row < self.rows:
+            raise IndexError(f"row {row} out of range")
+        shard = int(np.searchsorted(self.row_starts, row, side='right')) - 1
+        return self.shards[shard][row - self.row_starts[shard]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenize story corpora into fixed-length memory-mapped shards")
+    parser.add_argument("sources", nargs="+",
+                        help="Corpus text files (---, EOS or [EOS] separated) or story store directories")
+    parser.add_argument("--output-dir", default="token_shards")
+    parser.add_argument("--tokenizer", default="bytes", help="bytes, tiktoken:<encoding> or hf:<tokenizer.json>")
+    parser.add_argument("--eos-token", default="</s>", help="EOS token for hf: tokenizers")
+    parser.add_argument("--seq-len", type=int, default=2048)
+    parser.add_argument("--rows-per-shard", type=int, default=8192)
+    parser.add_argument("--workers", type=int, default=None, help="Default: one per core")
+    parser.add_argument("--chunk-stories", type=int, default=1000)
+    args = parser.parse_args()
+
+    stats = tokenize_corpus(args.sources, args.output_dir, args.tokenizer, args.eos_token, args.seq_len,
+                            args.rows_per_shard, args.workers, args.chunk_stories)
+    print(f"Tokenized {stats['tokenized']} sources ({stats['skipped']} unchanged, skipped): "
+          f"{stats['documents']:,} documents, {stats['tokens']:,} tokens in {stats['seconds']:.1f}s "
+          f"({stats['tokens_per_second']:,} tokens/s)")
+
+
+if __name__ == "__main__":
+    main()
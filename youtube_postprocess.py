@@ -0,0 +1,288 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+from corpus_reader import CorpusReader
+from story_generator import load_generator_module
+
+logger = logging.getLogger(__name__)
+
+# Bounded read size: a single-line transcript dump is consumed in pieces of at most this many characters
+READ_CHARS = 1024 * 1024
+CAPTION_NOISE = re.compile(r"\[\s*(?:music|applause|laughter|inaudible|__)\s*\]|>>", re.IGNORECASE)
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[\"'(A-Z0-9])")
+WORD_PATTERN = re.compile(r"\S+")
+VIDEO_ID_PREFIX = re.compile(r"^([A-Za-z0-9_-]{6,20})\t")
+HEADER_PATTERN = re.compile(r"^\[VIDEO_TITLE\] (.*?)(?: \[VIDEO_ID\] (\S+))?$")
+
+REFORMAT_PROMPT = """As a Rocket League 3v3 coach, rewrite the following excerpt from the video "{title}" as clear, conversational coaching advice.
+
+Keep every gameplay detail, mechanic and decision mentioned in the transcript, drop filler words, sponsor mentions and off-topic chatter, and do not add advice that is not in the transcript. Maximum 500 words.
+
+Transcript:
+{text}"""
+
+
+class TranscriptSegmenter:
+    # Auto-generated captions often have no punctuation, so sentences fall back to fixed word counts
+    def __init__(self, paragraph_words: int = 150, sentence_words: int = 30):
+        self.paragraph_words = paragraph_words
+        self.sentence_words = sentence_words
+        self.buffer = ""
+        self.sentences = []
+        self.words = 0
+
+    def _add_sentence(self, sentence: str) -> Optional[str]:
+        sentence = " ".join(CAPTION_NOISE.sub(" ", sentence).split())
+        if not sentence:
+            return None
+        self.sentences.append(sentence)
+        self.words += sentence.count(" ") + 1
+        if self.words >= self.paragraph_words:
+            return self._take_paragraph()
+        return None
+
+    def _take_paragraph(self) -> Optional[str]:
+        if not self.sentences:
+            return None
+        paragraph = " ".join(self.sentences)
+        self.sentences = []
+        self.words = 0
+        return paragraph
+
+    def _add_words(self, words: List[str]) -> Iterator[str]:
+        for start in range(0, len(words), self.sentence_words):
+            paragraph = self._add_sentence(" ".join(words[start:start + self.sentence_words]))
+            if paragraph:
+                yield paragraph
+
+    def feed(self, text: str) -> Iterator[str]:
+        pieces = SENTENCE_BOUNDARY.split(self.buffer + text)
+        # The last piece may continue in the next read
+        self.buffer = pieces.pop()
+        for sentence in pieces:
+            words = WORD_PATTERN.findall(sentence)
+            if len(words) > 2 * self.sentence_words:
+                yield from self._add_words(words)
+                continue
+            paragraph = self._add_sentence(sentence)
+            if paragraph:
+                yield paragraph
+
+        words = list(WORD_PATTERN.finditer(self.buffer))
+        if len(words) > 2 * self.sentence_words:
+            # Keep the last word back, it may be cut in half
+            cut = words[len(words) - 1 - (len(words) - 1) % self.sentence_words].start()
+            head, self.buffer = self.buffer[:cut], self.buffer[cut:]
+            yield from self._add_words(WORD_PATTERN.findall(head))
+
+    def flush(self) -> Iterator[str]:
+        paragraph = self._add_sentence(self.buffer)
+        self.buffer = ""
+        if paragraph:
+            yield paragraph
+        paragraph = self._take_paragraph()
+        if paragraph:
+            yield paragraph
+
+
+def format_block(title: str, video_id: str, text: str) -> str:
+    return f"[VIDEO_TITLE] {title} [VIDEO_ID] {video_id}\n{text}\n[EOS]\n\n"
+
+
+def parse_block(block: str) -> tuple[str, Optional[str], str]:
+    header, _, text = block.partition("\n")
+    match = HEADER_PATTERN.match(header.strip())
+    if match is None:
+        return "", None, block.strip()
+    return match.group(1), match.group(2), text.strip()
+
+
+def load_titles(path: Optional[str]) -> Dict[str, str]:
+    # video_id -> title, from a .json dict/list, .jsonl or .csv with video_id and title fields
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(".csv"):
+            return {row["video_id"]: row["title"] for row in csv.DictReader(f)}
+        if path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = json.load(f)
+            if isinstance(rows, dict):
+                return rows
+    return {row["video_id"]: row["title"] for row in rows}
+
+
+def process_file(path: str, output_path: str, titles: Dict[str, str], paragraph_words: int = 150,
+                 sentence_words: int = 30) -> Dict:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    stats = {"file": path, "videos": 0, "paragraphs": 0, "words": 0}
+    start = time.perf_counter()
+    tmp_path = output_path + ".tmp"
+    with open(path, 'r', encoding='utf-8', errors='replace') as f, open(tmp_path, 'w', encoding='utf-8') as out:
+        # One video per line; a line may start with "<video_id>\t", otherwise the file name (and line number) is used
+        segmenter = None
+        new_line = True
+        line_number = 0
+        while True:
+            piece = f.readline(READ_CHARS)
+            if not piece:
+                break
+            if new_line:
+                line_number += 1
+                match = VIDEO_ID_PREFIX.match(piece)
+                if match:
+                    video_id = match.group(1)
+                    piece = piece[match.end():]
+                else:
+                    video_id = stem if line_number == 1 else f"{stem}-{line_number}"
+                title = titles.get(video_id, video_id)
+                segmenter = TranscriptSegmenter(paragraph_words, sentence_words)
+                stats["videos"] += 1
+            new_line = piece.endswith("\n")
+            paragraphs = list(segmenter.feed(piece))
+            if new_line:
+                paragraphs.extend(segmenter.flush())
+            for paragraph in paragraphs:
+                out.write(format_block(title, video_id, paragraph))
+                stats["paragraphs"] += 1
+                stats["words"] += paragraph.count(" ") + 1
+        if segmenter is not None and not new_line:
+            for paragraph in segmenter.flush():
+                out.write(format_block(title, video_id, paragraph))
+                stats["paragraphs"] += 1
+                stats["words"] += paragraph.count(" ") + 1
+    os.replace(tmp_path, output_path)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
+
+
+def output_path_for(path: str, output_dir: str, suffix: str = "processed") -> str:
+    return os.path.join(output_dir, f"{os.path.splitext(os.path.basename(path))[0]}.{suffix}.txt")
+
+
+def process_files(paths: List[str], output_dir: str, titles: Dict[str, str] = None, workers: Optional[int] = None,
+                  paragraph_words: int = 150, sentence_words: int = 30) -> List[Dict]:
+    os.makedirs(output_dir, exist_ok=True)
+    titles = titles or {}
+    results = []
+    pending = []
+    for path in paths:
+        output_path = output_path_for(path, output_dir)
+        if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(path):
+            results.append({"file": path, "skipped": True})
+            continue
+        pending.append((path, output_path))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_file, path, output_path, titles, paragraph_words, sentence_words)
+                   for path, output_path in pending]
+        for future in futures:
+            results.append(future.result())
+    return results
+
+
+def iter_reformat_requests(processed_path: str, group_words: int) -> Iterator[tuple[str, str, str]]:
+    # Consecutive paragraphs of one video are sent together, up to group_words, to spread the prompt cost
+    title = video_id = None
+    texts = []
+    words = 0
+    with CorpusReader(processed_path, "[EOS]") as reader:
+        for block in reader:
+            block_title, block_id, text = parse_block(block)
+            if texts and (block_id != video_id or words + text.count(" ") + 1 > group_words):
+                yield title, video_id, "\n\n".join(texts)
+                texts = []
+                words = 0
+            title, video_id = block_title, block_id
+            texts.append(text)
+            words += text.count(" ") + 1
+    if texts:
+        yield title, video_id, "\n\n".join(texts)
+
+
+def reformat_file(generator, processed_path: str, output_path: str, group_words: int = 800) -> Dict:
+    # Type 1 files: the generator's model, retry policy, response cache and cost ledger do the work
+    stats = {"requests": 0, "cached": 0, "failed": 0, "budget_stopped": False}
+    max_output_tokens = generator.generation_config['max_output_tokens']
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        for title, video_id, text in iter_reformat_requests(processed_path, group_words):
+            prompt = REFORMAT_PROMPT.format(title=title, text=text)
+            response = generator.cached_response(prompt, 0)
+            if response is not None:
+                stats["cached"] += 1
+            else:
+                if not generator.ledger.can_afford(generator.ledger.worst_case_cost(prompt, max_output_tokens)):
+                    logger.info("Remaining budget cannot cover another request. Stopping reformatting.")
+                    stats["budget_stopped"] = True
+                    break
+                try:
+                    response, usage = generator.retry_policy.call(lambda: generator.call_model(prompt))
+                except Exception as e:
+                    logger.warning(f"Gemini API error for {video_id}: {e}")
+                    stats["failed"] += 1
+                    generator.retry_policy.check_permanent_streak(e)
+                    continue
+                generator.ledger.record(prompt, response, usage, category="youtube_reformat", aspect=video_id)
+                generator.cache_response(prompt, 0, response)
+                stats["requests"] += 1
+            out.write(format_block(title, video_id, response.strip()))
+    # A partial file is kept; rerunning replays finished requests from the cache
+    os.replace(tmp_path, output_path)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn raw YouTube transcript dumps into [VIDEO_TITLE] ... [EOS] files")
+    parser.add_argument("sources", nargs="+", help="Raw transcript files, one video per line")
+    parser.add_argument("--output-dir", default="youtube_processed")
+    parser.add_argument("--titles", default=None, help="video_id -> title mapping (.json, .jsonl or .csv)")
+    parser.add_argument("--workers", type=int, default=None, help="Files processed in parallel (default: one per core)")
+    parser.add_argument("--paragraph-words", type=int, default=150)
+    parser.add_argument("--sentence-words", type=int, default=30,
+                        help="Sentence length used when the transcript has no punctuation")
+    parser.add_argument("--reformat", default=None, metavar="GENERATOR_SCRIPT",
+                        help="Also rewrite the paragraphs through Gemini with this generator script")
+    parser.add_argument("--budget", type=float, default=None, help="Dollar limit for the reformat stage")
+    parser.add_argument("--cache-dir", default=None, help="Response cache for the reformat stage")
+    parser.add_argument("--group-words", type=int, default=800, help="Transcript words per reformat request")
+    args = parser.parse_args()
+    # Also shows the generator's own log lines, such as the final cost of the reformat stage
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    results = process_files(args.sources, args.output_dir, load_titles(args.titles), args.workers,
+                            args.paragraph_words, args.sentence_words)
+    for result in results:
+        if result.get("skipped"):
+            logger.info(f"{result['file']}: unchanged, skipped")
+        else:
+            logger.info(f"{result['file']}: {result['videos']} videos, {result['paragraphs']} paragraphs, "
+                        f"{result['words']:,} words in {result['seconds']:.1f}s")
+
+    if args.reformat:
+        generator = load_generator_module(args.reformat).RocketLeagueGeminiGenerator()
+        if args.budget is not None:
+            generator.BUDGET = args.budget
+        generator.open_ledger(args.output_dir)
+        generator.enable_cache(args.cache_dir or os.path.join(args.output_dir, "response_cache"))
+        for path in args.sources:
+            stats = reformat_file(generator, output_path_for(path, args.output_dir),
+                                  output_path_for(path, args.output_dir, "gemini"), args.group_words)
+            logger.info(f"{path}: {stats['requests']} Gemini requests, {stats['cached']} from cache, "
+                        f"{stats['failed']} failed")
+            if stats["budget_stopped"]:
+                break
+        generator.report_cost_stats()
+        generator.ledger.close()
+
+
+if __name__ == "__main__":
+    main()